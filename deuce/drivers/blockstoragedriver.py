@@ -17,6 +17,10 @@ class BlockStorageDriver(object):
     of files (files exist only as a notion in the metadata layer).
     """
 
+    # Number of bytes read from a stream at a time when
+    # a block is streamed into storage
+    stream_chunk_size = 64 * 1024
+
     @abstractmethod
     def block_exists(self, vault_id, storage_block_id):
         """Determines if the specified block exists in the vault.
@@ -82,6 +86,20 @@ class BlockStorageDriver(object):
                     (True/False), and the storage id of the block"""
         raise NotImplementedError
 
+    @abstractmethod
+    def store_block_stream(self, vault_id, metadata_block_id, blockstream,
+                           block_length):
+        """Stores the block into the specified vault, reading the
+        block data from a file-like object in chunks of at most
+        stream_chunk_size bytes
+
+        :param metadata_block_id: The Metadata ID of the block
+        :param blockstream: A file-like object to read the block data from
+        :param block_length: The expected length of the block data
+        :returns: A tuple containing the status of saving the block to storage
+                    (True/False), and the storage id of the block"""
+        raise NotImplementedError
+
     @abstractmethod
     def store_async_block(self, vault_id, metadata_block_ids, block_datas):
         """Stores blocks asynchronously into the specified vault
@@ -111,6 +129,24 @@ class BlockStorageDriver(object):
                  self.get_block_obj(vault_id, storage_block_id))
             for storage_block_id in storage_block_gen)
 
+    def get_blocks_data(self, vault_id, storage_block_ids):
+        """Returns the data of each of the specified blocks, in the
+        same order. None is returned for each block that cannot be
+        retrieved. Drivers that can fetch several blocks at once
+        should override this to do so."""
+        datas = []
+
+        for storage_block_id in storage_block_ids:
+            obj = self.get_block_obj(vault_id, storage_block_id)
+
+            if obj is None:
+                datas.append(None)
+            else:
+                datas.append(obj.read())
+                obj.close()
+
+        return datas
+
     @staticmethod
     def storage_id(metadata_block_id):
         """Generates a storage id, for a given
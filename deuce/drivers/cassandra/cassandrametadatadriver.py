@@ -5,8 +5,10 @@ import ssl
 import uuid
 
 from deuce.drivers.metadatadriver import MetadataStorageDriver
-from deuce.drivers.metadatadriver import GapError, OverlapError
+from deuce.drivers.metadatadriver import EMPTY_FILE_COVERAGE
 from deuce.drivers.metadatadriver import ConstraintError
+from deuce.drivers.metadatadriver import VAULT_COUNTERS
+from deuce.util import pack_manifest, unpack_manifest
 from deuce import conf
 import deuce.util.log as logging
 import deuce
@@ -14,271 +16,430 @@ import deuce
 
 logger = logging.getLogger(__name__)
 
+# The number of block ids given to each IN query of vault_health
+MAX_IN_BLOCK_IDS = 100
+
 CQL_CREATE_VAULT = '''
     INSERT INTO vaults (projectid, vaultid)
-    VALUES (%(projectid)s, %(vaultid)s)
+    VALUES (:projectid, :vaultid)
 '''
 
 CQL_DELETE_VAULT = '''
     DELETE FROM vaults
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
 '''
 
 CQL_GET_ALL_VAULTS = '''
     SELECT vaultid
     FROM vaults
-    WHERE projectid = %(projectid)s
-    AND vaultid >= %(vaultid)s
+    WHERE projectid = :projectid
+    AND vaultid >= :vaultid
     ORDER BY vaultid
-    LIMIT %(limit)s
+    LIMIT :limit
 '''
 
 CQL_CREATE_FILE = '''
-    INSERT INTO files (projectid, vaultid, fileid, finalized, size)
-    VALUES (%(projectid)s, %(vaultid)s, %(fileid)s, false, %(size)s)
+    INSERT INTO files (projectid, vaultid, fileid, finalized, size, coverage)
+    VALUES (:projectid, :vaultid, :fileid, false, :size,
+    :coverage)
 '''
 
 CQL_MARK_BLOCK_AS_BAD = '''
     UPDATE blocks SET
     isinvalid = true
     WHERE
-    projectid = %(projectid)s AND
-    vaultid = %(vaultid)s AND
-    blockid = %(blockid)s
+    projectid = :projectid AND
+    vaultid = :vaultid AND
+    blockid = :blockid
 '''
 
 CQL_MARK_BLOCK_AS_GOOD = '''
     UPDATE blocks SET
     isinvalid = false
     WHERE
-    projectid = %(projectid)s AND
-    vaultid = %(vaultid)s AND
-    blockid = %(blockid)s
+    projectid = :projectid AND
+    vaultid = :vaultid AND
+    blockid = :blockid
 '''
 
 CQL_GET_FILE = '''
     SELECT finalized
     FROM files
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND fileid = %(fileid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+'''
+
+CQL_GET_FILE_MANIFEST = '''
+    SELECT finalized, manifest, size
+    FROM files
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+'''
+
+CQL_SET_FILE_MANIFEST = '''
+    UPDATE files
+    SET manifest = :manifest
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+'''
+
+CQL_DROP_FILE_MANIFEST = '''
+    UPDATE files
+    SET manifest = null, coverage = null
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+'''
+
+CQL_GET_FILE_COVERAGE = '''
+    SELECT coverage
+    FROM files
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+'''
+
+CQL_SET_FILE_COVERAGE = '''
+    UPDATE files
+    SET coverage = :coverage
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+'''
+
+CQL_UPDATE_FILE_COVERAGE = '''
+    UPDATE files
+    SET coverage = :coverage
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+    IF coverage = :previous
 '''
 
 CQL_GET_FILE_SIZE = '''
     SELECT size
     FROM files
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND fileid = %(fileid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
 '''
 
 CQL_DELETE_FILE = '''
     DELETE FROM files
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND fileid = %(fileid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
 '''
 
 CQL_GET_BAD_BLOCKS = '''
     SELECT blockid
-    FROM blocks
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND isinvalid = true
+    FROM badblocks
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+'''
+
+CQL_ADD_BAD_BLOCK = '''
+    INSERT INTO badblocks (projectid, vaultid, blockid)
+    VALUES (:projectid, :vaultid, :blockid)
+'''
+
+CQL_DEL_BAD_BLOCK = '''
+    DELETE FROM badblocks
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
 '''
 
 CQL_GET_FILE_PER_BLOCK = '''
     SELECT fileid
     FROM blockfiles
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND blockid = %(blockid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
+'''
+
+CQL_GET_FILES_PER_BLOCKS = '''
+    SELECT fileid
+    FROM blockfiles
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid IN :blockids
 '''
 
 CQL_GET_ALL_FILE_BLOCKS = '''
     SELECT blockid, offset
     FROM fileblocks
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND fileid = %(fileid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
     ORDER BY offset
 '''
 
 CQL_GET_FILE_BLOCKS = '''
     SELECT blockid, offset
     FROM fileblocks
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND fileid = %(fileid)s
-    AND offset >= %(marker)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+    AND offset >= :marker
     ORDER BY offset
-    LIMIT %(limit)s
+    LIMIT :limit
 '''
 
 CQL_GET_ALL_FILE_BLOCKS_W_SIZE = '''
     SELECT blockid, offset, blocksize
     FROM fileblocks
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND fileid = %(fileid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
     ORDER by offset
 '''
 
 CQL_GET_ALL_BLOCKS = '''
     SELECT blockid
     FROM blocks
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND blockid >= %(marker)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid >= :marker
     ORDER BY blockid
-    LIMIT %(limit)s
+    LIMIT :limit
 '''
 
 CQL_GET_STORAGE_ID = '''
     SELECT storageid
     FROM blocks
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND blockid =%(blockid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid =:blockid
+'''
+
+CQL_GET_BLOCK_STORAGE = '''
+    SELECT storageid, blocksize, isinvalid
+    FROM blocks
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
+'''
+
+CQL_GET_BLOCK_INFO = '''
+    SELECT storageid, blocksize, reftime, isinvalid
+    FROM blocks
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
 '''
 
 CQL_GET_BLOCK_ID = '''
     SELECT blockid
-    FROM blocks
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND storageid =%(storageid)s
+    FROM blockstorage
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND storageid = :storageid
 '''
 
-CQL_GET_COUNT_ALL_BLOCKS = '''
-    SELECT COUNT(*)
+CQL_ADD_BLOCK_STORAGE = '''
+    INSERT INTO blockstorage (projectid, vaultid, storageid, blockid)
+    VALUES (:projectid, :vaultid, :storageid, :blockid)
+'''
+
+CQL_DEL_BLOCK_STORAGE = '''
+    DELETE FROM blockstorage
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND storageid = :storageid
+'''
+
+CQL_GET_ALL_BLOCK_SIZES = '''
+    SELECT blocksize, isinvalid
     FROM blocks
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
 '''
 
 CQL_GET_ALL_FILES_MARKER = '''
     SELECT fileid
-    FROM files
-    WHERE projectid=%(projectid)s
-    AND vaultid = %(vaultid)s
-    AND fileid >= %(marker)s
-    AND finalized = %(finalized)s
-    LIMIT %(limit)s
+    FROM finalizedfiles
+    WHERE projectid=:projectid
+    AND vaultid = :vaultid
+    AND fileid >= :marker
+    LIMIT :limit
 '''
 
 CQL_GET_ALL_FILES = '''
     SELECT fileid
-    FROM files
-    WHERE projectid=%(projectid)s
-    AND vaultid = %(vaultid)s
-    AND finalized = %(finalized)s
-    LIMIT %(limit)s
+    FROM finalizedfiles
+    WHERE projectid=:projectid
+    AND vaultid = :vaultid
+    LIMIT :limit
+'''
+
+CQL_GET_ALL_UNFINALIZED_FILES_MARKER = '''
+    SELECT fileid
+    FROM unfinalizedfiles
+    WHERE projectid=:projectid
+    AND vaultid = :vaultid
+    AND fileid >= :marker
+    LIMIT :limit
+'''
+
+CQL_GET_ALL_UNFINALIZED_FILES = '''
+    SELECT fileid
+    FROM unfinalizedfiles
+    WHERE projectid=:projectid
+    AND vaultid = :vaultid
+    LIMIT :limit
+'''
+
+CQL_ADD_FINALIZED_FILE = '''
+    INSERT INTO finalizedfiles (projectid, vaultid, fileid)
+    VALUES (:projectid, :vaultid, :fileid)
+'''
+
+CQL_DEL_FINALIZED_FILE = '''
+    DELETE FROM finalizedfiles
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+'''
+
+CQL_ADD_UNFINALIZED_FILE = '''
+    INSERT INTO unfinalizedfiles (projectid, vaultid, fileid)
+    VALUES (:projectid, :vaultid, :fileid)
+'''
+
+CQL_DEL_UNFINALIZED_FILE = '''
+    DELETE FROM unfinalizedfiles
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
 '''
 
 CQL_GET_COUNT_ALL_FILES = '''
     SELECT COUNT(*)
     FROM files
-    WHERE projectid=%(projectid)s
-    AND vaultid = %(vaultid)s
+    WHERE projectid=:projectid
+    AND vaultid = :vaultid
+'''
+
+CQL_GET_VAULT_STATISTICS = '''
+    SELECT files, blocks, bytes, badblocks
+    FROM vaultstats
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+'''
+
+# Note: like the block reference counts, the counters
+# are decremented by passing negative deltas
+CQL_INC_VAULT_STATISTICS = '''
+    UPDATE vaultstats
+    SET files = files + :files,
+    blocks = blocks + :blocks,
+    bytes = bytes + :bytes,
+    badblocks = badblocks + :badblocks
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
 '''
 
 CQL_FINALIZE_FILE = '''
     UPDATE files
     SET finalized=true,
-    size=%(size)s
-    WHERE projectid=%(projectid)s
-    AND vaultid=%(vaultid)s
-    AND fileid=%(fileid)s
+    size=:size,
+    manifest=:manifest
+    WHERE projectid=:projectid
+    AND vaultid=:vaultid
+    AND fileid=:fileid
 '''
 
 CQL_ASSIGN_BLOCK_TO_FILE = '''
     INSERT INTO fileblocks
     (projectid, vaultid, fileid, blockid, blocksize, offset)
-    VALUES (%(projectid)s, %(vaultid)s, %(fileid)s, %(blockid)s,
-    %(blocksize)s, %(offset)s)
+    VALUES (:projectid, :vaultid, :fileid, :blockid,
+    :blocksize, :offset)
 '''
 CQL_REGISTER_FILE_TO_BLOCK = '''
     INSERT INTO blockfiles
     (projectid, vaultid, fileid, blockid)
-    VALUES (%(projectid)s, %(vaultid)s, %(fileid)s, %(blockid)s)
+    VALUES (:projectid, :vaultid, :fileid, :blockid)
 '''
 CQL_UNREGISTER_FILE_TO_BLOCK = '''
     DELETE FROM blockfiles
-    WHERE projectid=%(projectid)s
-    AND vaultid=%(vaultid)s
-    AND blockid=%(blockid)s
+    WHERE projectid=:projectid
+    AND vaultid=:vaultid
+    AND blockid=:blockid
+    AND fileid=:fileid
 '''
 CQL_REGISTER_BLOCK = '''
     INSERT INTO blocks
     (projectid, vaultid, blockid, storageid, blocksize, isinvalid, reftime)
-    VALUES (%(projectid)s, %(vaultid)s, %(blockid)s, %(storageid)s,
-    %(blocksize)s, %(isinvalid)s, %(reftime)s)
+    VALUES (:projectid, :vaultid, :blockid, :storageid,
+    :blocksize, :isinvalid, :reftime)
 '''
 
 CQL_UNREGISTER_BLOCK = '''
     DELETE FROM blocks
-    WHERE projectid=%(projectid)s
-    AND vaultid=%(vaultid)s
-    AND blockid=%(blockid)s
+    WHERE projectid=:projectid
+    AND vaultid=:vaultid
+    AND blockid=:blockid
 '''
 
 CQL_GET_BLOCK_SIZE = '''
-    SELECT blocksize FROM blocks
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND blockid = %(blockid)s
-    AND isinvalid = false
+    SELECT blocksize, isinvalid FROM blocks
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
 '''
 
 CQL_GET_BLOCK_REF_COUNT = '''
     SELECT refcount
     FROM blockreferences
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND blockid = %(blockid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
 '''
 
 CQL_UPDATE_REF_TIME = '''
     UPDATE blocks
-    SET reftime = %(reftime)s
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND blockid = %(blockid)s
+    SET reftime = :reftime
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
 '''
 
 CQL_GET_BLOCK_REF_TIME = '''
     SELECT reftime
     FROM blocks
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND blockid = %(blockid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
 '''
 
 # Note: negative numbers for decrementing works
 # fine here.
 CQL_INC_BLOCK_REF_COUNT = '''
     UPDATE blockreferences
-    SET refcount = refcount + %(delta)s
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND blockid = %(blockid)s
+    SET refcount = refcount + :delta
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
 '''
 
 CQL_DEL_BLOCK_REF_COUNT = '''
     DELETE FROM blockreferences
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND blockid = %(blockid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
 '''
 
 CQL_GET_BLOCK_STATUS = '''
     SELECT isinvalid
     FROM blocks
-    WHERE projectid = %(projectid)s
-    AND vaultid = %(vaultid)s
-    AND blockid = %(blockid)s
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
 '''
 
 CQL_HEALTH_CHECK = '''
@@ -306,14 +467,12 @@ class CassandraStorageDriver(MetadataStorageDriver):
         auth_module = importlib.import_module(
             '{0}.auth'.format(conf.metadata_driver.cassandra.db_module))
 
-        # Import the query submodule
-        query_module = importlib.import_module(
-            '{0}.query'.format(conf.metadata_driver.cassandra.db_module))
+        # Import the policies submodule
+        policies_module = importlib.import_module(
+            '{0}.policies'.format(conf.metadata_driver.cassandra.db_module))
 
         self.consistency = getattr(self.cassandra,
                                    'ConsistencyLevel')
-        self.simplestatement = getattr(query_module,
-                                       'SimpleStatement')
 
         if conf.metadata_driver.cassandra.ssl_enabled:
             ssl_version = getattr(ssl,
@@ -329,10 +488,17 @@ class CassandraStorageDriver(MetadataStorageDriver):
                 password=conf.metadata_driver.cassandra.password
             )
 
+        # Prepared statements carry the routing key of each query,
+        # which lets the token aware policy send it straight to one
+        # of the replicas of its partition
+        load_balancing_policy = policies_module.TokenAwarePolicy(
+            policies_module.RoundRobinPolicy())
+
         self._cluster = cluster_module.Cluster(
             contact_points=conf.metadata_driver.cassandra.cluster,
             auth_provider=auth_provider,
-            ssl_options=ssl_options)
+            ssl_options=ssl_options,
+            load_balancing_policy=load_balancing_policy)
 
         # NOTE(TheSriram): We need the total number of nodes in the
         # cluster to be greater than two, if we are going to apply
@@ -347,6 +513,22 @@ class CassandraStorageDriver(MetadataStorageDriver):
         deuce_keyspace = conf.metadata_driver.cassandra.keyspace
         self._session = self._cluster.connect(deuce_keyspace)
 
+        # Registry of the statements prepared on this session
+        self._statements = {}
+
+    def _statement(self, cql):
+        """Returns the prepared statement for the CQL query. Each
+        query is prepared once per session, the first time it is
+        used, with the configured consistency level"""
+        try:
+            return self._statements[cql]
+
+        except KeyError:
+            statement = self._session.prepare(cql)
+            statement.consistency_level = self.consistency_level
+            self._statements[cql] = statement
+            return statement
+
     def create_vault(self, vault_id):
         """Creates a vault"""
         args = dict(
@@ -354,8 +536,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             vaultid=vault_id
         )
 
-        query = self.simplestatement(CQL_CREATE_VAULT,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_CREATE_VAULT)
         res = self._session.execute(query, args)
         return
 
@@ -364,8 +545,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             projectid=deuce.context.project_id,
             vaultid=vault_id
         )
-        query = self.simplestatement(CQL_DELETE_VAULT,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_DELETE_VAULT)
         res = self._session.execute(query, args)
         return
 
@@ -375,8 +555,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             vaultid=marker or '',
             limit=self._determine_limit(limit)
         )
-        query = self.simplestatement(CQL_GET_ALL_VAULTS,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_ALL_VAULTS)
         res = self._session.execute(query, args)
         return [row[0] for row in res]
 
@@ -384,46 +563,68 @@ class CassandraStorageDriver(MetadataStorageDriver):
         """Return the statistics on the vault.
 
         "param vault_id: The ID of the vault to gather statistics for"""
-        res = {}
 
+        return self._build_vault_statistics(
+            vault_id, self._get_vault_statistics(vault_id))
+
+    def _get_vault_statistics(self, vault_id):
+        """Returns the counters of the vault"""
         args = dict(
             projectid=deuce.context.project_id,
             vaultid=vault_id
         )
 
-        def __stats_query(cql_statement, default_value):
-            query = self.simplestatement(cql_statement,
-                consistency_level=self.consistency_level)
-            result = self._session.execute(query, args)
+        query = self._statement(CQL_GET_VAULT_STATISTICS)
+        res = self._session.execute(query, args)
 
-            try:
-                return result[0][0]
+        try:
+            return dict(zip(VAULT_COUNTERS,
+                            (count or 0 for count in res[0])))
 
-            except IndexError:  # pragma: no cover
-                return default_value
+        except IndexError:
+            return dict((name, 0) for name in VAULT_COUNTERS)
 
-        def __stats_get_vault_file_count():
-            return __stats_query(CQL_GET_COUNT_ALL_FILES, 0)
+    def _inc_vault_statistics(self, vault_id, **deltas):
+        """Adds the given deltas to the counters of the vault"""
+        if any(deltas.values()):
+            args = dict(
+                projectid=deuce.context.project_id,
+                vaultid=vault_id
+            )
 
-        def __stats_get_vault_block_count():
-            return __stats_query(CQL_GET_COUNT_ALL_BLOCKS, 0)
+            args.update((name, int(deltas.get(name, 0)))
+                        for name in VAULT_COUNTERS)
 
-        # Add any statistics regarding files
-        res['files'] = {}
-        res['files']['count'] = __stats_get_vault_file_count()
+            query = self._statement(CQL_INC_VAULT_STATISTICS)
+            self._session.execute(query, args)
 
-        # Add any statistics regarding blocks
-        res['blocks'] = {}
-        res['blocks']['count'] = __stats_get_vault_block_count()
+    def reconcile_vault_statistics(self, vault_id):
+        args = dict(
+            projectid=deuce.context.project_id,
+            vaultid=vault_id
+        )
+
+        actual = dict((name, 0) for name in VAULT_COUNTERS)
+
+        query = self._statement(CQL_GET_COUNT_ALL_FILES)
+        actual['files'] = self._session.execute(query, args)[0][0]
+
+        query = self._statement(CQL_GET_ALL_BLOCK_SIZES)
+
+        for blocksize, isinvalid in self._session.execute(query, args):
+            actual['blocks'] += 1
+            actual['bytes'] += blocksize
+            actual['badblocks'] += int(bool(isinvalid))
+
+        # Counter columns cannot be set, only incremented
+        current = self._get_vault_statistics(vault_id)
 
-        # Add information about bad blocks and bad files
+        deltas = dict((name, actual[name] - current[name])
+                      for name in VAULT_COUNTERS)
 
-        res['blocks']['bad'], res['files']['bad'] = \
-            self.vault_health(vault_id)
-        # Add any statistics specific to the Cassandra backend
-        res['internal'] = {}
+        self._inc_vault_statistics(vault_id, **deltas)
 
-        return res
+        return deltas
 
     def vault_health(self, vault_id):
         '''Returns the number of bad blocks and bad files associated
@@ -434,27 +635,27 @@ class CassandraStorageDriver(MetadataStorageDriver):
             vaultid=vault_id,
         )
 
-        bad_blocks = self._session.execute(CQL_GET_BAD_BLOCKS, args)
+        # The bad blocks are listed by their lookup table
+        bad_blocks = [row[0] for row in self._session.execute(
+            self._statement(CQL_GET_BAD_BLOCKS), args)]
 
         no_of_bad_blocks = len(bad_blocks)
 
-        bad_files = set()
-        results = []
+        # The files referencing them are looked up in blockfiles,
+        # a chunk of blocks at a time
+        query = self._statement(CQL_GET_FILES_PER_BLOCKS)
+        futures = []
 
-        for block_id in bad_blocks:
+        for start in range(0, no_of_bad_blocks, MAX_IN_BLOCK_IDS):
             args = dict(
                 projectid=deuce.context.project_id,
                 vaultid=vault_id,
-                blockid=block_id[0],
+                blockids=bad_blocks[start:start + MAX_IN_BLOCK_IDS]
             )
-            future = self._session.execute_async(CQL_GET_FILE_PER_BLOCK, args)
-            results.append(future)
+            futures.append(self._session.execute_async(query, args))
 
-        for future in results:
-            try:
-                bad_files.add(future.result()[0][0])
-            except IndexError:
-                pass
+        bad_files = set(row[0] for future in futures
+                        for row in future.result())
 
         no_of_bad_files = len(bad_files)
 
@@ -467,12 +668,18 @@ class CassandraStorageDriver(MetadataStorageDriver):
             projectid=deuce.context.project_id,
             vaultid=vault_id,
             fileid=uuid.UUID(file_id),
-            size=0
+            size=0,
+            coverage=EMPTY_FILE_COVERAGE
         )
 
-        query = self.simplestatement(CQL_CREATE_FILE,
-            consistency_level=self.consistency_level)
-        res = self._session.execute(query, args)
+        futures = [
+            self._session.execute_async(self._statement(query), args)
+            for query in (CQL_CREATE_FILE, CQL_ADD_UNFINALIZED_FILE)]
+
+        for future in futures:
+            future.result()
+
+        self._inc_vault_statistics(vault_id, files=1)
 
         return file_id
 
@@ -484,8 +691,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             fileid=uuid.UUID(file_id)
         )
 
-        query = self.simplestatement(CQL_GET_FILE_SIZE,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_FILE_SIZE)
         res = self._session.execute(query, args)
 
         try:
@@ -501,14 +707,95 @@ class CassandraStorageDriver(MetadataStorageDriver):
             blockid=block_id
         )
 
-        query = self.simplestatement(CQL_GET_STORAGE_ID,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_STORAGE_ID)
         res = self._session.execute(query, args)
         try:
             return str(res[0][0])
         except IndexError:
             return None
 
+    def _get_blocks_storage_rows(self, vault_id, block_ids):
+        """Returns the (storage id, size, isinvalid) row of each of
+        the specified blocks, looked up concurrently. None is
+        returned for the blocks that are not registered"""
+
+        def get_result(future):
+            try:
+                return future[0]
+            except IndexError:
+                return None
+
+        futures = []
+
+        query = self._statement(CQL_GET_BLOCK_STORAGE)
+
+        for block_id in block_ids:
+            args = dict(
+                projectid=deuce.context.project_id,
+                vaultid=vault_id,
+                blockid=block_id
+            )
+
+            future = self._session.execute_async(query, args)
+            futures.append(future)
+        return [get_result(future.result()) for future in futures]
+
+    def _get_blocks_storage(self, vault_id, block_ids, check_status=False):
+        """Returns (storage id, size) for each of the specified
+        blocks, looked up concurrently. If a block is not found,
+        or check_status is set and the block is marked as bad,
+        (None, None) is returned for it"""
+
+        def get_result(row):
+            if row is None or (check_status and row[2]):
+                return (None, None)
+
+            return (str(row[0]), row[1])
+
+        return [get_result(row) for row in
+                self._get_blocks_storage_rows(vault_id, block_ids)]
+
+    def get_block_storage_ids(self, vault_id, block_ids):
+        return [storage_id for storage_id, _ in
+                self._get_blocks_storage(vault_id, block_ids)]
+
+    def get_block_info(self, vault_id, block_id):
+        args = dict(
+            projectid=deuce.context.project_id,
+            vaultid=vault_id,
+            blockid=block_id
+        )
+
+        # The block and its reference count live in separate
+        # tables, so query both at the same time
+        info_query = self._statement(CQL_GET_BLOCK_INFO)
+        ref_count_query = self._statement(CQL_GET_BLOCK_REF_COUNT)
+
+        info_future = self._session.execute_async(info_query, args)
+        ref_count_future = self._session.execute_async(ref_count_query,
+                                                       args)
+
+        info = info_future.result()
+        ref_count = ref_count_future.result()
+
+        try:
+            storageid, blocksize, reftime, isinvalid = info[0]
+        except IndexError:
+            return None
+
+        try:
+            refcount = ref_count[0][0]
+        except IndexError:
+            refcount = 0
+
+        return dict(
+            storageid=str(storageid),
+            blocksize=blocksize,
+            reftime=reftime,
+            isinvalid=bool(isinvalid),
+            refcount=refcount
+        )
+
     def get_block_metadata_id(self, vault_id, storage_id):
         """Retrieve block id for a given storage id"""
         args = dict(
@@ -517,8 +804,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             storageid=storage_id
         )
 
-        query = self.simplestatement(CQL_GET_BLOCK_ID,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_BLOCK_ID)
         res = self._session.execute(query, args)
         try:
             return str(res[0][0])
@@ -532,8 +818,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             fileid=uuid.UUID(file_id)
         )
 
-        query = self.simplestatement(CQL_GET_FILE,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_FILE)
         res = self._session.execute(query, args)
 
         return len(res) > 0
@@ -546,8 +831,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             fileid=uuid.UUID(file_id)
         )
 
-        query = self.simplestatement(CQL_GET_FILE,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_FILE)
         res = self._session.execute(query, args)
 
         try:
@@ -556,17 +840,18 @@ class CassandraStorageDriver(MetadataStorageDriver):
         except IndexError:
             return False
 
-    def _delete_files_from_blockfiles(self, vault_id, blockids):
+    def _delete_files_from_blockfiles(self, vault_id, file_id, blockids):
         futures = []
 
-        query = self.simplestatement(CQL_UNREGISTER_FILE_TO_BLOCK,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_UNREGISTER_FILE_TO_BLOCK)
 
-        for blockid in blockids:
+        # The other files referencing the blocks are left in place
+        for blockid in set(blockids):
             args = dict(
                 projectid=deuce.context.project_id,
                 vaultid=vault_id,
-                blockid=blockid
+                blockid=blockid,
+                fileid=uuid.UUID(file_id)
             )
 
             future = self._session.execute_async(query,
@@ -584,19 +869,28 @@ class CassandraStorageDriver(MetadataStorageDriver):
             fileid=uuid.UUID(file_id)
         )
 
-        query = self.simplestatement(CQL_DELETE_FILE,
-            consistency_level=self.consistency_level)
-        self._session.execute(query, args)
+        query = self._statement(CQL_GET_FILE_SIZE)
+        file_exists = len(self._session.execute(query, args)) > 0
+
+        futures = [
+            self._session.execute_async(self._statement(query), args)
+            for query in (CQL_DELETE_FILE, CQL_DEL_FINALIZED_FILE,
+                          CQL_DEL_UNFINALIZED_FILE)]
+
+        for future in futures:
+            future.result()
+
+        if file_exists:
+            self._inc_vault_statistics(vault_id, files=-1)
 
         # now list the file blocks, delete the mapping from blocks to
         # files and decrement the block reference count
 
-        query = self.simplestatement(CQL_GET_ALL_FILE_BLOCKS_W_SIZE,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_ALL_FILE_BLOCKS_W_SIZE)
         res = self._session.execute(query, args)
 
         block_ids = [data[0] for data in res]
-        self._delete_files_from_blockfiles(vault_id,
+        self._delete_files_from_blockfiles(vault_id, file_id,
                                            block_ids)
 
         self._inc_block_ref_counts(vault_id, block_ids, -1)
@@ -606,59 +900,17 @@ class CassandraStorageDriver(MetadataStorageDriver):
         makes no assumptions about whether or not the file record actually
         exists"""
 
-        # Check for gaps and overlaps.
-        expected_offset = 0
+        coverage = self._get_file_coverage(vault_id, file_id)
 
-        args = dict(
-            projectid=deuce.context.project_id,
-            vaultid=vault_id,
-            fileid=uuid.UUID(file_id)
-        )
-
-        query = self.simplestatement(CQL_GET_ALL_FILE_BLOCKS_W_SIZE,
-            consistency_level=self.consistency_level)
-        res = self._session.execute(query, args)
+        if self._file_is_covered(coverage, file_size):
+            # The blocks were checked for gaps and overlaps as they
+            # were assigned, the manifest is recorded when the file
+            # is first read
+            manifest = None
 
-        for blockid, offset, size in res:
-
-            # Use one last chance to check for the block size
-            # if it is not in the fileblocks row.
-            if size is None:
-                size = self._get_block_size(vault_id, blockid)
-
-                # If size is None, the block was never registered so we
-                # skip this record. This will likely result in a GapError
-                # being thrown on the next pass
-                if size is None:
-                    continue
-
-            if offset == expected_offset:
-                expected_offset += size
-            elif offset < expected_offset:  # Block overlaps previous block
-                raise OverlapError(deuce.context.project_id, vault_id,
-                                   file_id, blockid, startpos=offset,
-                                   endpos=expected_offset)
-            else:  # There is a gap between this block and the previous one
-                raise GapError(deuce.context.project_id, vault_id, file_id,
-                               startpos=expected_offset, endpos=offset)
-
-        # Now we must check the very last block and ensure
-        # that is completes the file. This is only doable if
-        # the final file size was provided
-        if file_size and file_size != expected_offset:
-
-            if expected_offset < file_size:  # Gap
-                raise GapError(deuce.context.project_id, vault_id, file_id,
-                               startpos=expected_offset, endpos=file_size)
-
-            else:
-                assert expected_offset > file_size
-
-                # This means that the "last" block overlaps
-                # the end of the file.
-                raise OverlapError(deuce.context.project_id, vault_id, file_id,
-                                   blockid, startpos=file_size,
-                                   endpos=expected_offset)
+        else:
+            manifest = self._create_file_manifest(vault_id, file_id,
+                                                  file_size)
 
         if self.has_file(vault_id, file_id):
             if file_size is None:
@@ -666,14 +918,104 @@ class CassandraStorageDriver(MetadataStorageDriver):
 
             args = dict(
                 size=file_size,
+                manifest=manifest,
                 projectid=deuce.context.project_id,
                 vaultid=vault_id,
                 fileid=uuid.UUID(file_id)
             )
 
-            query = self.simplestatement(CQL_FINALIZE_FILE,
-                consistency_level=self.consistency_level)
-            res = self._session.execute(query, args)
+            futures = [
+                self._session.execute_async(self._statement(query), args)
+                for query in (CQL_FINALIZE_FILE, CQL_ADD_FINALIZED_FILE,
+                              CQL_DEL_UNFINALIZED_FILE)]
+
+            for future in futures:
+                future.result()
+
+    def _create_file_manifest(self, vault_id, file_id, file_size):
+        """Checks the blocks of a file for gaps and overlaps and
+        returns its packed manifest"""
+        args = dict(
+            projectid=deuce.context.project_id,
+            vaultid=vault_id,
+            fileid=uuid.UUID(file_id)
+        )
+
+        query = self._statement(CQL_GET_ALL_FILE_BLOCKS_W_SIZE)
+        res = list(self._session.execute(query, args))
+
+        # The storage ids of the blocks, along with the sizes missing
+        # from the fileblocks rows, are looked up concurrently. Blocks
+        # that are not registered or are marked as bad are skipped,
+        # which will likely result in a GapError
+        storage = self._get_blocks_storage(vault_id,
+                                           [row[0] for row in res],
+                                           check_status=True)
+
+        file_blocks = []
+
+        for (blockid, offset, size), (storage_id, blocksize) in \
+                zip(res, storage):
+            if storage_id is None:
+                size = None
+            elif size is None:
+                size = blocksize
+
+            file_blocks.append((blockid, offset, size, storage_id))
+
+        # Check for gaps and overlaps.
+        blocks = self._verify_file_blocks(vault_id, file_id, file_blocks,
+                                          file_size)
+
+        return pack_manifest([
+            (blockid, offset, storage_id, size)
+            for blockid, offset, size, storage_id in blocks])
+
+    def _get_file_coverage(self, vault_id, file_id):
+        """Returns the coverage summary of a file, or None"""
+        args = dict(
+            projectid=deuce.context.project_id,
+            vaultid=vault_id,
+            fileid=uuid.UUID(file_id)
+        )
+
+        query = self._statement(CQL_GET_FILE_COVERAGE)
+        res = self._session.execute(query, args)
+
+        try:
+            return res[0][0]
+        except IndexError:
+            return None
+
+    def _add_file_coverage(self, vault_id, file_id, blocks):
+        """Adds newly assigned blocks to the coverage summary of
+        the file
+
+        :param blocks: The (offset, size) of each block
+        """
+        previous = self._get_file_coverage(vault_id, file_id)
+
+        if previous is None:
+            return
+
+        args = dict(
+            projectid=deuce.context.project_id,
+            vaultid=vault_id,
+            fileid=uuid.UUID(file_id),
+            coverage=self._update_file_coverage(previous, blocks),
+            previous=previous
+        )
+
+        # The summary is only replaced if it has not been changed
+        # by a concurrent assignment, otherwise it is not known
+        query = self._statement(CQL_UPDATE_FILE_COVERAGE)
+        res = self._session.execute(query, args)
+
+        if not res[0][0]:
+            args['coverage'] = None
+
+            query = self._statement(CQL_SET_FILE_COVERAGE)
+            self._session.execute(query, args)
 
     def get_block_data(self, vault_id, block_id):
 
@@ -683,14 +1025,27 @@ class CassandraStorageDriver(MetadataStorageDriver):
             blockid=block_id
         )
 
-        query = self.simplestatement(CQL_GET_BLOCK_SIZE,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_BLOCK_SIZE)
         res = self._session.execute(query, args)
 
+        blocksize = self._valid_block_size(res)
+
+        if blocksize is None:
+            raise Exception("No such block: {0}".format(block_id))
+
+        return dict(blocksize=blocksize)
+
+    @staticmethod
+    def _valid_block_size(res):
+        """Returns the size of a block from the result of
+        CQL_GET_BLOCK_SIZE, or None if the block is not found
+        or is marked as bad"""
         try:
-            return dict(blocksize=res[0][0])
+            blocksize, isinvalid = res[0]
         except IndexError:
-            raise Exception("No such block: {0}".format(block_id))
+            return None
+
+        return None if isinvalid else blocksize
 
     def _get_block_size(self, vault_id, block_id):
         """Returns the size of the specified block. If the block
@@ -702,29 +1057,18 @@ class CassandraStorageDriver(MetadataStorageDriver):
             blockid=block_id
         )
 
-        query = self.simplestatement(CQL_GET_BLOCK_SIZE,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_BLOCK_SIZE)
         res = self._session.execute(query, args)
 
-        try:
-            return res[0][0]
-        except IndexError:
-            return None
+        return self._valid_block_size(res)
 
     def _get_block_sizes(self, vault_id, block_ids):
         """Returns the size of the specified block. If the block
         is not found, None is returned"""
 
-        def get_result(future):
-            try:
-                return future[0][0]
-            except IndexError:
-                return None
-
         futures = []
 
-        query = self.simplestatement(CQL_GET_BLOCK_SIZE,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_BLOCK_SIZE)
 
         for block_id in block_ids:
             args = dict(
@@ -735,7 +1079,8 @@ class CassandraStorageDriver(MetadataStorageDriver):
 
             future = self._session.execute_async(query, args)
             futures.append(future)
-        return [get_result(future.result()) for future in futures]
+        return [self._valid_block_size(future.result())
+                for future in futures]
 
     def get_file_data(self, vault_id, file_id):
         """Returns a tuple representing data for this file"""
@@ -745,8 +1090,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             fileid=uuid.UUID(file_id)
         )
 
-        query = self.simplestatement(CQL_GET_FILE,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_FILE)
         res = self._session.execute(query, args)
 
         try:
@@ -756,6 +1100,42 @@ class CassandraStorageDriver(MetadataStorageDriver):
 
         return row
 
+    def get_file_manifest(self, vault_id, file_id):
+        args = dict(
+            projectid=deuce.context.project_id,
+            vaultid=vault_id,
+            fileid=uuid.UUID(file_id)
+        )
+
+        query = self._statement(CQL_GET_FILE_MANIFEST)
+        res = self._session.execute(query, args)
+
+        try:
+            finalized, manifest, file_size = res[0]
+        except IndexError:
+            return None
+
+        if not finalized:
+            return None
+
+        if manifest is None:
+            # Files finalized through their coverage summary, and
+            # files that had a block marked as bad, have their
+            # manifest recorded on the first read that finds all of
+            # their blocks valid
+            manifest = self._rebuild_file_manifest(vault_id, file_id,
+                                                   file_size)
+
+            if manifest is None:
+                return None
+
+            args['manifest'] = manifest
+
+            query = self._statement(CQL_SET_FILE_MANIFEST)
+            self._session.execute(query, args)
+
+        return unpack_manifest(manifest)
+
     def reset_block_status(self, vault_id, marker=None, limit=None):
 
         # NOTE(TheSriram): This isnt the most performant version,
@@ -771,8 +1151,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
 
             for blockid in block_ids:
 
-                query = self.simplestatement(CQL_MARK_BLOCK_AS_GOOD,
-                    consistency_level=self.consistency_level)
+                query = self._statement(CQL_MARK_BLOCK_AS_GOOD)
                 args = dict(
                     projectid=deuce.context.project_id,
                     vaultid=vault_id,
@@ -782,9 +1161,18 @@ class CassandraStorageDriver(MetadataStorageDriver):
                 future = self._session.execute_async(query, args)
                 futures.append(future)
 
+                if blockid in bad_block_ids:
+                    query = self._statement(CQL_DEL_BAD_BLOCK)
+                    future = self._session.execute_async(query, args)
+                    futures.append(future)
+
             for future in futures:
                 future.result()
 
+            self._inc_vault_statistics(
+                vault_id, badblocks=-len(bad_block_ids.intersection(
+                    block_ids)))
+
             return block_ids[-1:][0] if len(block_ids) == limit else None
 
         query_args = dict(
@@ -794,10 +1182,13 @@ class CassandraStorageDriver(MetadataStorageDriver):
             limit=self._determine_limit(limit)
         )
 
-        query = self.simplestatement(CQL_GET_ALL_BLOCKS,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_ALL_BLOCKS)
         future = self._session.execute_async(query, query_args)
 
+        query = self._statement(CQL_GET_BAD_BLOCKS)
+        bad_block_ids = set(row[0] for row in
+                            self._session.execute(query, query_args))
+
         return mark_block_as_good(future.result(),
                                   self._determine_limit(limit))
 
@@ -809,10 +1200,39 @@ class CassandraStorageDriver(MetadataStorageDriver):
             blockid=block_id
         )
 
-        query = self.simplestatement(CQL_MARK_BLOCK_AS_BAD,
-            consistency_level=self.consistency_level)
+        row = self._get_blocks_storage_rows(vault_id, [block_id])[0]
+
+        futures = [
+            self._session.execute_async(self._statement(query), args)
+            for query in (CQL_MARK_BLOCK_AS_BAD, CQL_ADD_BAD_BLOCK)]
+
+        for future in futures:
+            future.result()
+
+        # Only count the block as bad if it was not already
+        if row is not None and not row[2]:
+            self._inc_vault_statistics(vault_id, badblocks=1)
+
+        # Drop the manifests of the files referencing the block
+        query = self._statement(CQL_GET_FILE_PER_BLOCK)
         res = self._session.execute(query, args)
 
+        futures = []
+
+        query = self._statement(CQL_DROP_FILE_MANIFEST)
+
+        for row in res:
+            args = dict(
+                projectid=deuce.context.project_id,
+                vaultid=vault_id,
+                fileid=row[0]
+            )
+
+            futures.append(self._session.execute_async(query, args))
+
+        for future in futures:
+            future.result()
+
     @staticmethod
     def _block_exists(result, check_status):
         """Helper function to check the result of a cassandra
@@ -839,8 +1259,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             blockid=block_id
         )
 
-        query = self.simplestatement(CQL_GET_BLOCK_STATUS,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_BLOCK_STATUS)
         res = self._session.execute(query, args)
 
         return CassandraStorageDriver._block_exists(res, check_status)
@@ -848,8 +1267,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
     def has_blocks(self, vault_id, block_ids, check_status=False):
 
         futures = []
-        query = self.simplestatement(CQL_GET_BLOCK_STATUS,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_BLOCK_STATUS)
 
         for block_id in block_ids:
             args = dict(
@@ -877,8 +1295,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             limit=self._determine_limit(limit)
         )
 
-        query = self.simplestatement(CQL_GET_ALL_BLOCKS,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_ALL_BLOCKS)
         res = self._session.execute(query, args)
 
         return [row[0] for row in res]
@@ -893,24 +1310,34 @@ class CassandraStorageDriver(MetadataStorageDriver):
             limit=self._determine_limit(limit)
         )
 
-        if marker is None:
-            # query = CQL_GET_ALL_FILES
-            query = self.simplestatement(CQL_GET_ALL_FILES,
-                consistency_level=self.consistency_level)
-        else:
+        if marker is not None:
             args.update(dict(
                 marker=uuid.UUID(marker)
             ))
-            query = self.simplestatement(CQL_GET_ALL_FILES_MARKER,
-                consistency_level=self.consistency_level)
-            # query = CQL_GET_ALL_FILES_MARKER
+
+        # The finalized and unfinalized files of each vault are kept
+        # in lookup tables of their own
+        if finalized:
+            query = self._statement(CQL_GET_ALL_FILES if marker is None
+                                    else CQL_GET_ALL_FILES_MARKER)
+        else:
+            query = self._statement(
+                CQL_GET_ALL_UNFINALIZED_FILES if marker is None
+                else CQL_GET_ALL_UNFINALIZED_FILES_MARKER)
 
         res = self._session.execute(query, args)
 
         return [str(row[0]) for row in res]
 
     def create_file_block_generator(self, vault_id, file_id,
-                                    offset=None, limit=None):
+                                    offset=None, limit=None,
+                                    with_storage=False):
+
+        manifest = self.get_file_manifest(vault_id, file_id)
+
+        if manifest is not None:
+            return self._slice_file_manifest(manifest, offset, limit,
+                                             with_storage)
 
         args = dict(
             projectid=deuce.context.project_id,
@@ -920,8 +1347,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
 
         if limit is None:
             # query = CQL_GET_ALL_FILE_BLOCKS
-            query = self.simplestatement(CQL_GET_ALL_FILE_BLOCKS,
-                consistency_level=self.consistency_level)
+            query = self._statement(CQL_GET_ALL_FILE_BLOCKS)
         else:
 
             args.update(dict(
@@ -930,11 +1356,18 @@ class CassandraStorageDriver(MetadataStorageDriver):
             ))
 
             # query = CQL_GET_FILE_BLOCKS
-            query = self.simplestatement(CQL_GET_FILE_BLOCKS,
-                consistency_level=self.consistency_level)
+            query = self._statement(CQL_GET_FILE_BLOCKS)
 
         query_res = self._session.execute(query, args)
 
+        if with_storage:
+            query_res = list(query_res)
+            blocks = self._get_blocks_storage(
+                vault_id, [row[0] for row in query_res])
+
+            return [(row[0], row[1]) + block
+                    for row, block in zip(query_res, blocks)]
+
         return [(row[0], row[1]) for row in query_res]
 
     def assign_blocks(self, vault_id, file_id, block_ids, offsets):
@@ -946,11 +1379,9 @@ class CassandraStorageDriver(MetadataStorageDriver):
         # this to be compatible with the other drivers.
         futures = []
 
-        file_to_block_query = self.simplestatement(CQL_REGISTER_FILE_TO_BLOCK,
-            consistency_level=self.consistency_level)
+        file_to_block_query = self._statement(CQL_REGISTER_FILE_TO_BLOCK)
 
-        block_to_file_query = self.simplestatement(CQL_ASSIGN_BLOCK_TO_FILE,
-            consistency_level=self.consistency_level)
+        block_to_file_query = self._statement(CQL_ASSIGN_BLOCK_TO_FILE)
 
         for block_id, blocksize, offset in zip(block_ids, blocksizes,
                                                offsets):
@@ -982,6 +1413,9 @@ class CassandraStorageDriver(MetadataStorageDriver):
         for future in futures:
             future.result()
 
+        self._add_file_coverage(vault_id, file_id,
+                                list(zip(offsets, blocksizes)))
+
         self._inc_block_ref_counts(vault_id, block_ids)
 
     def assign_block(self, vault_id, file_id, block_id, offset):
@@ -1000,10 +1434,8 @@ class CassandraStorageDriver(MetadataStorageDriver):
             offset=offset
         )
 
-        block_to_file_query = self.simplestatement(CQL_ASSIGN_BLOCK_TO_FILE,
-            consistency_level=self.consistency_level)
-        file_to_block_query = self.simplestatement(CQL_REGISTER_FILE_TO_BLOCK,
-            consistency_level=self.consistency_level)
+        block_to_file_query = self._statement(CQL_ASSIGN_BLOCK_TO_FILE)
+        file_to_block_query = self._statement(CQL_REGISTER_FILE_TO_BLOCK)
 
         blockfile_args = args.copy()
 
@@ -1013,37 +1445,114 @@ class CassandraStorageDriver(MetadataStorageDriver):
         self._session.execute(block_to_file_query, args)
         self._session.execute(file_to_block_query, blockfile_args)
 
+        self._add_file_coverage(vault_id, file_id, [(offset, blocksize)])
+
         self._inc_block_ref_count(vault_id, block_id)
 
     def register_block(self, vault_id, block_id, storage_id, blocksize):
-        if not self.has_block(vault_id, block_id, check_status=True):
+        self.register_blocks(vault_id, [(block_id, storage_id, blocksize)])
+
+    def register_blocks(self, vault_id, blocks):
+        rows = self._get_blocks_storage_rows(
+            vault_id, [block_id for block_id, _, _ in blocks])
+
+        futures = []
+        reftime = int(datetime.datetime.utcnow().timestamp())
+        registered_ids = set()
+        deltas = dict((name, 0) for name in VAULT_COUNTERS)
+
+        for (block_id, storage_id, blocksize), row in zip(blocks, rows):
+            # Blocks that are already registered and valid are kept.
+            # Guard against the same block appearing twice in the batch
+            if block_id in registered_ids or (row is not None and
+                                              not row[2]):
+                continue
+
+            registered_ids.add(block_id)
+            deltas['blocks'] += 1
+            deltas['bytes'] += int(blocksize)
+
+            if row is not None:
+                # The registration replaces a block marked as bad
+                old_storage_id = str(row[0])
+                futures.extend(self._drop_block_lookups(
+                    vault_id, block_id,
+                    old_storage_id if old_storage_id != storage_id
+                    else None, True))
+
+                deltas['blocks'] -= 1
+                deltas['bytes'] -= row[1]
+                deltas['badblocks'] -= 1
+
             args = dict(
                 projectid=deuce.context.project_id,
                 vaultid=vault_id,
                 blockid=block_id,
                 storageid=storage_id,
-                reftime=int(datetime.datetime.utcnow().timestamp()),
+                reftime=reftime,
                 isinvalid=False,
                 blocksize=int(blocksize)
             )
 
-            query = self.simplestatement(CQL_REGISTER_BLOCK,
-                consistency_level=self.consistency_level)
-            res = self._session.execute(query, args)
+            for query in (CQL_REGISTER_BLOCK, CQL_ADD_BLOCK_STORAGE):
+                future = self._session.execute_async(
+                    self._statement(query), args)
+                futures.append(future)
+
+        for future in futures:
+            future.result()
+
+        self._inc_vault_statistics(vault_id, **deltas)
+
+    def _drop_block_lookups(self, vault_id, block_id, storage_id,
+                            is_bad_block):
+        """Removes a block from the lookup tables of its storage id
+        (unless storage_id is None) and, if it is marked as bad, of
+        the bad blocks of the vault. Returns the futures of the
+        deletions"""
+        args = dict(
+            projectid=deuce.context.project_id,
+            vaultid=vault_id,
+            blockid=block_id,
+            storageid=storage_id
+        )
+
+        queries = []
+
+        if storage_id is not None:
+            queries.append(CQL_DEL_BLOCK_STORAGE)
+
+        if is_bad_block:
+            queries.append(CQL_DEL_BAD_BLOCK)
+
+        return [self._session.execute_async(self._statement(query), args)
+                for query in queries]
 
     def unregister_block(self, vault_id, block_id):
 
         self._require_no_block_refs(vault_id, block_id)
 
+        row = self._get_blocks_storage_rows(vault_id, [block_id])[0]
+
         args = dict(
             projectid=deuce.context.project_id,
             vaultid=vault_id,
             blockid=block_id
         )
 
-        query = self.simplestatement(CQL_UNREGISTER_BLOCK,
-            consistency_level=self.consistency_level)
-        res = self._session.execute(query, args)
+        query = self._statement(CQL_UNREGISTER_BLOCK)
+        futures = [self._session.execute_async(query, args)]
+
+        if row is not None:
+            futures.extend(self._drop_block_lookups(
+                vault_id, block_id, str(row[0]), row[2]))
+
+        for future in futures:
+            future.result()
+
+        if row is not None:
+            self._inc_vault_statistics(vault_id, blocks=-1, bytes=-row[1],
+                                       badblocks=-int(bool(row[2])))
 
         self._del_block_ref_count(vault_id, block_id)
 
@@ -1055,8 +1564,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             blockid=block_id
         )
 
-        query = self.simplestatement(CQL_GET_BLOCK_REF_COUNT,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_BLOCK_REF_COUNT)
         res = self._session.execute(query, args)
 
         try:
@@ -1067,8 +1575,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
     def _inc_block_ref_counts(self, vault_id, block_ids, cnt=1):
 
         futures = []
-        inc_ref_count_query = self.simplestatement(CQL_INC_BLOCK_REF_COUNT,
-            consistency_level=self.consistency_level)
+        inc_ref_count_query = self._statement(CQL_INC_BLOCK_REF_COUNT)
 
         for block_id in block_ids:
             args = dict(
@@ -1096,8 +1603,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
                                             check_status=True)
         update_block_ids = set(block_ids) - set(missing_block_ids)
         futures = []
-        update_reftime_query = self.simplestatement(CQL_UPDATE_REF_TIME,
-            consistency_level=self.consistency_level)
+        update_reftime_query = self._statement(CQL_UPDATE_REF_TIME)
         for block_id in update_block_ids:
 
             reftime_args = dict(
@@ -1122,8 +1628,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             delta=cnt
         )
 
-        query = self.simplestatement(CQL_INC_BLOCK_REF_COUNT,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_INC_BLOCK_REF_COUNT)
         res = self._session.execute(query, args)
 
         # The Ref-time value is stored in the blocks table
@@ -1141,8 +1646,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
                 blockid=block_id,
                 reftime=int(datetime.datetime.utcnow().timestamp())
             )
-            query = self.simplestatement(CQL_UPDATE_REF_TIME,
-                consistency_level=self.consistency_level)
+            query = self._statement(CQL_UPDATE_REF_TIME)
             res = self._session.execute(query, reftime_args)
 
     def _del_block_ref_count(self, vault_id, block_id):
@@ -1153,8 +1657,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             blockid=block_id
         )
 
-        query = self.simplestatement(CQL_DEL_BLOCK_REF_COUNT,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_DEL_BLOCK_REF_COUNT)
         res = self._session.execute(query, args)
 
     def get_block_ref_modified(self, vault_id, block_id):
@@ -1165,8 +1668,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
             blockid=block_id
         )
 
-        query = self.simplestatement(CQL_GET_BLOCK_REF_TIME,
-            consistency_level=self.consistency_level)
+        query = self._statement(CQL_GET_BLOCK_REF_TIME)
         res = self._session.execute(query, args)
 
         try:
@@ -1177,8 +1679,7 @@ class CassandraStorageDriver(MetadataStorageDriver):
     def get_health(self):
         try:
             args = ()
-            query = self.simplestatement(CQL_HEALTH_CHECK,
-                consistency_level=self.consistency_level)
+            query = self._statement(CQL_HEALTH_CHECK)
             res = self._session.execute(query, args)
             return ["cassandra cluster: [{0}] is active".format(res[0][0])]
         except:  # pragma: no cover
@@ -0,0 +1,225 @@
+"""
+Backfills the lookup tables of the v2 Cassandra schema from the
+blocks, files and fileblocks tables.
+
+The v2 schema replaces the secondary indexes on the storage id and
+status of blocks and on the finalized flag of files by the
+blockstorage, badblocks, finalizedfiles and unfinalizedfiles tables.
+It also clusters the blockfiles table on the file id, which used to
+hold only the last file assigned each block. To move an existing
+cluster over to it:
+
+  1. Create the four tables as found in schema.cql, and create
+     blockfiles again since its primary key cannot be altered:
+
+        DROP TABLE blockfiles;
+        CREATE TABLE blockfiles (...);
+
+  2. Deploy the version of Deuce that keeps them up to date
+  3. Run this tool to copy over the existing rows:
+
+        python -m deuce.drivers.cassandra.migrate --workers 16
+
+  4. Drop the secondary indexes, which are no longer used:
+
+        DROP INDEX storageid_index;
+        DROP INDEX invalid_block_index;
+        DROP INDEX finalized_index;
+
+The token range of the cluster is split into ranges that are
+scanned in parallel. Every row is written with the write time of
+the column it is copied from, so whatever Deuce writes or deletes
+while the backfill runs takes precedence over the copy.
+"""
+import argparse
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from deuce.drivers.cassandra.cassandrametadatadriver import \
+    CassandraStorageDriver
+
+CQL_SCAN_BLOCKS = '''
+    SELECT projectid, vaultid, blockid, storageid, isinvalid,
+    WRITETIME(storageid), WRITETIME(isinvalid)
+    FROM blocks
+    WHERE token(projectid, vaultid) > :start
+    AND token(projectid, vaultid) <= :end
+'''
+
+CQL_SCAN_FILES = '''
+    SELECT projectid, vaultid, fileid, finalized, WRITETIME(finalized)
+    FROM files
+    WHERE token(projectid, vaultid) > :start
+    AND token(projectid, vaultid) <= :end
+'''
+
+CQL_SCAN_FILE_BLOCKS = '''
+    SELECT projectid, vaultid, fileid, blockid, WRITETIME(blockid)
+    FROM fileblocks
+    WHERE token(projectid, vaultid, fileid) > :start
+    AND token(projectid, vaultid, fileid) <= :end
+'''
+
+CQL_BACKFILL_BLOCK_STORAGE = '''
+    INSERT INTO blockstorage (projectid, vaultid, storageid, blockid)
+    VALUES (:projectid, :vaultid, :storageid, :blockid)
+    USING TIMESTAMP :timestamp
+'''
+
+CQL_BACKFILL_BAD_BLOCK = '''
+    INSERT INTO badblocks (projectid, vaultid, blockid)
+    VALUES (:projectid, :vaultid, :blockid)
+    USING TIMESTAMP :timestamp
+'''
+
+CQL_BACKFILL_FINALIZED_FILE = '''
+    INSERT INTO finalizedfiles (projectid, vaultid, fileid)
+    VALUES (:projectid, :vaultid, :fileid)
+    USING TIMESTAMP :timestamp
+'''
+
+CQL_BACKFILL_UNFINALIZED_FILE = '''
+    INSERT INTO unfinalizedfiles (projectid, vaultid, fileid)
+    VALUES (:projectid, :vaultid, :fileid)
+    USING TIMESTAMP :timestamp
+'''
+
+CQL_BACKFILL_BLOCK_FILE = '''
+    INSERT INTO blockfiles (projectid, vaultid, fileid, blockid)
+    VALUES (:projectid, :vaultid, :fileid, :blockid)
+    USING TIMESTAMP :timestamp
+'''
+
+# The range of tokens of the Murmur3Partitioner
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+
+
+def token_ranges(splits):
+    """Splits the token range of the cluster into splits
+    contiguous (start, end] ranges"""
+    width = (MAX_TOKEN - MIN_TOKEN) // splits
+    bounds = [MIN_TOKEN + width * i for i in range(splits)] + [MAX_TOKEN]
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _lookup_rows(driver, start, end):
+    """Yields the (query, args) of the lookup table rows of the
+    blocks, files and fileblocks within a token range"""
+    token_args = dict(start=start, end=end)
+
+    blocks = driver._session.execute(driver._statement(CQL_SCAN_BLOCKS),
+                                     token_args)
+
+    for (projectid, vaultid, blockid, storageid, isinvalid,
+            storageid_time, isinvalid_time) in blocks:
+
+        args = dict(
+            projectid=projectid,
+            vaultid=vaultid,
+            blockid=blockid,
+            storageid=storageid
+        )
+
+        if storageid is not None:
+            yield CQL_BACKFILL_BLOCK_STORAGE, dict(args,
+                                                   timestamp=storageid_time)
+
+        if isinvalid:
+            yield CQL_BACKFILL_BAD_BLOCK, dict(args,
+                                               timestamp=isinvalid_time)
+
+    files = driver._session.execute(driver._statement(CQL_SCAN_FILES),
+                                    token_args)
+
+    for projectid, vaultid, fileid, finalized, finalized_time in files:
+        yield (CQL_BACKFILL_FINALIZED_FILE if finalized
+               else CQL_BACKFILL_UNFINALIZED_FILE), dict(
+            projectid=projectid,
+            vaultid=vaultid,
+            fileid=fileid,
+            timestamp=finalized_time
+        )
+
+    fileblocks = driver._session.execute(
+        driver._statement(CQL_SCAN_FILE_BLOCKS), token_args)
+
+    # A block assigned several times to a file is written as many
+    # times to the same row
+    for projectid, vaultid, fileid, blockid, blockid_time in fileblocks:
+        yield CQL_BACKFILL_BLOCK_FILE, dict(
+            projectid=projectid,
+            vaultid=vaultid,
+            fileid=fileid,
+            blockid=blockid,
+            timestamp=blockid_time
+        )
+
+
+def backfill_range(driver, start, end, concurrency):
+    """Backfills the lookup tables from the blocks, files and
+    fileblocks within a token range, with at most concurrency writes in
+    flight at any time
+
+    :returns: A Counter of the rows written per query"""
+    counts = collections.Counter()
+    futures = collections.deque()
+
+    for query, args in _lookup_rows(driver, start, end):
+        if len(futures) >= concurrency:
+            futures.popleft().result()
+
+        futures.append(driver._session.execute_async(
+            driver._statement(query), args))
+        counts[query] += 1
+
+    for future in futures:
+        future.result()
+
+    return counts
+
+
+def backfill(driver, splits=64, workers=8, concurrency=32):
+    """Backfills the lookup tables, scanning splits token ranges
+    with the given number of worker threads
+
+    :returns: The number of rows written to each lookup table"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda token_range: backfill_range(driver, token_range[0],
+                                               token_range[1], concurrency),
+            token_ranges(splits))
+
+        counts = sum(results, collections.Counter())
+
+    return dict(
+        blockstorage=counts[CQL_BACKFILL_BLOCK_STORAGE],
+        badblocks=counts[CQL_BACKFILL_BAD_BLOCK],
+        finalizedfiles=counts[CQL_BACKFILL_FINALIZED_FILE],
+        unfinalizedfiles=counts[CQL_BACKFILL_UNFINALIZED_FILE],
+        blockfiles=counts[CQL_BACKFILL_BLOCK_FILE]
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Backfills the lookup tables of the v2 Cassandra '
+                    'schema of Deuce')
+    parser.add_argument('--splits', type=int, default=64,
+                        help='Number of token ranges to scan')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Number of token ranges scanned at once')
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='Number of writes in flight per worker')
+    args = parser.parse_args(argv)
+
+    counts = backfill(CassandraStorageDriver(), args.splits, args.workers,
+                      args.concurrency)
+
+    for table, count in sorted(counts.items()):
+        print('{0}: {1} rows'.format(table, count))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
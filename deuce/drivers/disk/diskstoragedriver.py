@@ -149,6 +149,37 @@ class DiskStorageDriver(BlockStorageDriver):
 
         return (returnValue, returnStorageId)
 
+    def store_block_stream(self, vault_id, metadata_block_id, blockstream,
+                           block_length):
+        storage_id = self.storage_id(metadata_block_id)
+        path = self._get_block_path(vault_id, storage_id)
+
+        returnValue = False
+        returnStorageId = ''
+        outfile = None
+
+        try:
+            outfile = open(path, 'wb')
+            for chunk in iter(lambda: blockstream.read(self.stream_chunk_size),
+                              b''):
+                outfile.write(chunk)
+            outfile.flush()
+
+            returnValue = True
+            returnStorageId = storage_id
+
+        except:
+            returnValue = False
+            returnStorageId = ''
+
+        finally:  # pragma: no cover
+            if outfile is not None:
+                if not outfile.closed:
+                    outfile.close()
+                os.chmod(path, DiskStorageDriver.block_permission)
+
+        return (returnValue, returnStorageId)
+
     def store_async_block(self, vault_id, metadata_block_ids, blockdatas):
         storage_ids = [self.storage_id(metadata_block_id)
                        for metadata_block_id in metadata_block_ids]
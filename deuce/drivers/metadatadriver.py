@@ -1,4 +1,8 @@
 
+import bisect
+import itertools
+import json
+import operator
 import six
 from abc import ABCMeta, abstractmethod, abstractproperty
 
@@ -8,6 +12,19 @@ from abc import ABCMeta, abstractmethod, abstractproperty
 import deuce
 from deuce import conf
 
+# The coverage summary of a file that has no blocks assigned yet,
+# see MetadataStorageDriver._update_file_coverage()
+EMPTY_FILE_COVERAGE = json.dumps({'end': 0, 'pending': []})
+
+# The number of pending ranges the coverage summary of a file may
+# hold. Past it the coverage becomes unknown and finalize_file()
+# checks all the blocks of the file instead
+MAX_FILE_COVERAGE_RANGES = 1000
+
+# The statistics counted for each vault as its files and blocks
+# are created and removed
+VAULT_COUNTERS = ('files', 'blocks', 'bytes', 'badblocks')
+
 
 class OverlapError(Exception):
     """OverlapError is raised when finalizing
@@ -127,6 +144,18 @@ class MetadataStorageDriver(object):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def reconcile_vault_statistics(self, vault_id):
+        """Counts the files and blocks of the vault again and
+        corrects the counters behind get_vault_statistics() if they
+        drifted away from the actual numbers
+
+        :param vault_id: The ID of the vault to reconcile
+        :returns: A dict of the correction made to each of
+            VAULT_COUNTERS
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def vault_health(self, vault_id):
         """Return the aggregate number of bad blocks and bad files
@@ -191,16 +220,36 @@ class MetadataStorageDriver(object):
 
     @abstractmethod
     def create_file_block_generator(self, vault_id, file_id,
-            offset=None, limit=None):
+            offset=None, limit=None, with_storage=False):
         """Creates and returns a generator that will return
         the ID of each block contained in the specified
-        file. The file must previously have been finalized."""
+        file. The file must previously have been finalized.
+
+        :param with_storage: If True, (block_id, offset, storage_id,
+            size) is returned for each block instead of
+            (block_id, offset). The storage ID and size are None
+            for blocks that are not registered."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_file_manifest(self, vault_id, file_id):
+        """Returns the blocks of a finalized file as recorded in
+        its manifest when the file was finalized, as a list of
+        (block_id, offset, storage_id, size) tuples ordered by
+        offset. None is returned if the file does not exist, is
+        not finalized or any of its blocks is marked as bad. The
+        manifest of a file that was finalized through its coverage
+        summary, or whose manifest was dropped when one of its
+        blocks was marked as bad, is recorded again by the first
+        call that finds all of its blocks valid."""
         raise NotImplementedError
 
     @abstractmethod
     def mark_block_as_bad(self, vault_id, block_id):
         """Marks the block in the metadata driver as being a bad
-        block."""
+        block. The manifests and coverage summaries of the files
+        referencing the block are dropped, since the block may be
+        stored again under a new storage id."""
         raise NotImplementedError
 
     @abstractmethod
@@ -267,11 +316,43 @@ class MetadataStorageDriver(object):
         """Registers a block in the metadata driver."""
         raise NotImplementedError
 
+    @abstractmethod
+    def register_blocks(self, vault_id, blocks):
+        """Registers several blocks in the metadata driver at once.
+        Blocks that are already registered and valid are left as
+        they are, the same as for register_block.
+
+        :param vault_id: The ID of the vault containing the blocks
+        :param blocks: A list of (block_id, storage_id, size) tuples"""
+        raise NotImplementedError
+
     @abstractmethod
     def get_block_storage_id(self, vault_id, block_id):
         """Retrieve storage id for a given block id"""
         raise NotImplementedError
 
+    @abstractmethod
+    def get_block_storage_ids(self, vault_id, block_ids):
+        """Retrieve the storage ids for several block ids at once
+
+        :param vault_id: The ID of the vault containing the blocks
+        :param block_ids: list of block_id
+        :returns: list of storage ids in the same order as block_ids,
+            None for each block that is not registered"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_block_info(self, vault_id, block_id):
+        """Returns what is known about a block in a single lookup,
+        as a dict with the keys storageid, blocksize, refcount,
+        reftime and isinvalid. If the block does not exist, None
+        shall be returned.
+
+        :param vault_id: The ID of the vault containing the block
+        :param block_id: The ID of the block
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def get_block_metadata_id(self, vault_id, storage_id):
         """Retrieve block id for a given storage id"""
@@ -327,6 +408,170 @@ class MetadataStorageDriver(object):
                 "Constraint Error: Block {0} has references".format(block_id)
             )
 
+    def _verify_file_blocks(self, vault_id, file_id, blocks, file_size=None):
+        """Checks that the blocks assigned to a file cover it without
+        any gaps or overlaps, raising GapError or OverlapError for the
+        first one found.
+
+        :param blocks: An iterable of tuples starting with the
+            block_id, offset and size of each block of the file, in
+            any order. Blocks with a size of None are not registered
+            and are left out
+        :param file_size: The expected size of the file. The end of
+            the file is only checked if it is given
+        :returns: The list of blocks, ordered by offset
+        """
+        blocks = sorted((block for block in blocks if block[2] is not None),
+                        key=operator.itemgetter(1))
+
+        # Each block must start where the blocks before it end
+        starts = list(itertools.accumulate(itertools.chain(
+            [0], (block[2] for block in blocks))))
+
+        mismatch = next((index for index, (block, start)
+                         in enumerate(zip(blocks, starts))
+                         if block[1] != start), None)
+
+        if mismatch is not None:
+            block_id, offset = blocks[mismatch][:2]
+            start = starts[mismatch]
+
+            if offset < start:
+                raise OverlapError(deuce.context.project_id, vault_id,
+                                   file_id, block_id, startpos=offset,
+                                   endpos=start)
+
+            raise GapError(deuce.context.project_id, vault_id, file_id,
+                           startpos=start, endpos=offset)
+
+        # Now we must check that the last block completes the file
+        end = starts[-1]
+
+        if file_size and file_size != end:
+            if end < file_size:
+                raise GapError(deuce.context.project_id, vault_id, file_id,
+                               startpos=end, endpos=file_size)
+
+            # The last block overlaps the end of the file
+            raise OverlapError(deuce.context.project_id, vault_id, file_id,
+                               blocks[-1][0], startpos=file_size, endpos=end)
+
+        return blocks
+
+    def _rebuild_file_manifest(self, vault_id, file_id, file_size):
+        """Returns the packed manifest of a finalized file that has
+        none recorded, or None if the blocks of the file do not
+        cover it, f.e while any of them is still marked as bad"""
+        try:
+            return self._create_file_manifest(vault_id, file_id, file_size)
+
+        except (GapError, OverlapError):
+            return None
+
+    def _update_file_coverage(self, coverage, blocks):
+        """Adds newly assigned blocks to the coverage summary of a file.
+
+        The summary is a small JSON document holding the end of the
+        part of the file covered by contiguous blocks from offset 0,
+        and the contiguous [start, end] ranges of the blocks beyond
+        it. It lets finalize_file() skip checking all the blocks of
+        the file. A summary of None means the coverage is unknown,
+        f.e because a block overlaps another, its size was not known
+        when it was assigned or the blocks beyond the covered part
+        are scattered over more than MAX_FILE_COVERAGE_RANGES ranges,
+        and the blocks have to be checked.
+
+        :param coverage: The current summary of the file
+        :param blocks: The (offset, size) of each newly assigned
+            block, where size is None if the block is not registered
+        :returns: The updated summary
+        """
+        if coverage is None:
+            return None
+
+        summary = json.loads(coverage)
+        end, pending = summary['end'], summary['pending']
+
+        for offset, size in blocks:
+            if size is None:
+                return None
+
+            block = [offset, offset + size]
+            index = bisect.bisect_left(pending, block)
+
+            # A block that overlaps another, or was assigned twice,
+            # is left for finalize_file() to report
+            if offset < end or \
+                    (index > 0 and pending[index - 1][1] > offset) or \
+                    (index < len(pending) and pending[index][0] < block[1]):
+                return None
+
+            pending.insert(index, block)
+
+            # Adjacent ranges are merged, so blocks assigned in reverse
+            # or in batches keep the summary small
+            if index + 1 < len(pending) and \
+                    pending[index + 1][0] == block[1]:
+                block[1] = pending.pop(index + 1)[1]
+
+            if index > 0 and pending[index - 1][1] == block[0]:
+                pending[index - 1][1] = pending.pop(index)[1]
+
+            if pending and pending[0][0] == end:
+                end = pending.pop(0)[1]
+
+            if len(pending) > MAX_FILE_COVERAGE_RANGES:
+                return None
+
+        return json.dumps({'end': end, 'pending': pending})
+
+    def _file_is_covered(self, coverage, file_size=None):
+        """Returns True if the coverage summary of a file shows that
+        its blocks cover it without any gaps or overlaps"""
+        if coverage is None:
+            return False
+
+        summary = json.loads(coverage)
+
+        return not summary['pending'] and \
+            (not file_size or summary['end'] == file_size)
+
+    def _slice_file_manifest(self, manifest, offset=None, limit=None,
+                             with_storage=False):
+        """Returns the part of a file manifest that
+        create_file_block_generator() returns for the given arguments"""
+        start = bisect.bisect_left([block[1] for block in manifest],
+                                   offset or 0)
+
+        end = None if limit is None else \
+            start + self._determine_limit(limit)
+
+        if with_storage:
+            return manifest[start:end]
+
+        return [(block[0], block[1]) for block in manifest[start:end]]
+
+    def _build_vault_statistics(self, vault_id, counters):
+        """Builds the statistics of a vault from its counters. Bad
+        files are only looked for if the vault has bad blocks"""
+        bad_files = 0
+
+        if counters['badblocks'] > 0:
+            _, bad_files = self.vault_health(vault_id)
+
+        return {
+            'files': {
+                'count': counters['files'],
+                'bad': bad_files
+            },
+            'blocks': {
+                'count': counters['blocks'],
+                'bytes': counters['bytes'],
+                'bad': counters['badblocks']
+            },
+            'internal': {}
+        }
+
     def _determine_limit(self, limit):
         """ Determines the limit based on user input """
 
@@ -0,0 +1,87 @@
+"""
+Backfills the block reference counters of the MongoDB metadata
+driver from the fileblocks collection.
+
+The driver keeps the number of references to every block in the
+blockrefs collection, updated as blocks are assigned to files and
+files are deleted, so that reading it is a single lookup. To move
+an existing deployment over to it:
+
+  1. Pause the writes to Deuce
+  2. Deploy the version of Deuce that keeps the counters up to date
+  3. Run this tool to count the references of the existing blocks:
+
+        python -m deuce.drivers.mongodb.migrate
+
+  4. Resume the writes
+
+The counters of the projects backfilled are removed, then every
+counter is set to the number of fileblocks documents of its block,
+so the tool can be safely run again. Blocks assigned or files
+deleted while it runs would be miscounted, so it must only be run
+before the writes are resumed, or within a maintenance window.
+"""
+import argparse
+import itertools
+
+from deuce.drivers.mongodb.mongodbmetadatadriver import \
+    MongoDbStorageDriver
+
+
+def _block_key(fileblock):
+    return fileblock['projectid'], fileblock['vaultid'], fileblock['blockid']
+
+
+def backfill(driver, project_id=None):
+    """Sets the reference counter of every block assigned to a
+    file, only for the blocks of project_id when given. The
+    existing counters are removed first
+
+    :returns: The number of counters written"""
+    driver._blockrefs.ensure_index([('projectid', 1),
+        ('vaultid', 1), ('blockid', 1)], unique=True)
+
+    args = {}
+
+    if project_id is not None:
+        args['projectid'] = project_id
+
+    # Counters left from before, such as those of blocks that are
+    # no longer referenced, would otherwise be kept as they are
+    driver._blockrefs.remove(args)
+
+    fileblocks = driver._fileblocks.find(
+        args, {'_id': 0, 'projectid': 1, 'vaultid': 1, 'blockid': 1}).sort(
+        [('projectid', 1), ('vaultid', 1), ('blockid', 1)])
+
+    written = 0
+
+    for (projectid, vaultid, blockid), refs in itertools.groupby(
+            fileblocks, _block_key):
+
+        driver._blockrefs.update({
+            'projectid': projectid,
+            'vaultid': vaultid,
+            'blockid': blockid
+        }, {'$set': {'refcount': sum(1 for _ in refs)}}, upsert=True)
+
+        written += 1
+
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Backfills the block reference counters of the '
+                    'MongoDB metadata driver of Deuce')
+    parser.add_argument('--project',
+                        help='ID of the only project to backfill')
+    args = parser.parse_args(argv)
+
+    written = backfill(MongoDbStorageDriver(), args.project)
+
+    print('{0} block reference counters written'.format(written))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -10,9 +10,15 @@ import atexit
 import datetime
 
 
+import collections
 import itertools
 from deuce.drivers.metadatadriver import MetadataStorageDriver, \
-    GapError, OverlapError, ConstraintError
+    ConstraintError, EMPTY_FILE_COVERAGE, VAULT_COUNTERS
+from deuce.util import pack_manifest, unpack_manifest
+
+# The number of block ids given to each $in query of has_blocks
+# and vault_health
+MAX_IN_BLOCK_IDS = 1000
 
 
 class MongoDbStorageDriver(MetadataStorageDriver):
@@ -32,6 +38,8 @@ class MongoDbStorageDriver(MetadataStorageDriver):
         self._blocks = self._db.blocks
         self._files = self._db.files
         self._fileblocks = self._db.fileblocks
+        self._vaultstats = self._db.vaultstats
+        self._blockrefs = self._db.blockrefs
         # Maintain the document size less than the system maximun.
         self._docnum = int(conf.metadata_driver.mongodb.maxFileBlockSegNum)
 
@@ -75,48 +83,57 @@ class MongoDbStorageDriver(MetadataStorageDriver):
         """Return the statistics on the vault.
 
         "param vault_id: The ID of the vault to gather statistics for"""
-        res = {}
+        self._vaultstats.ensure_index([('projectid', 1),
+            ('vaultid', 1)])
 
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
         }
 
-        def __stats_get_vault_file_count():
-            self._files.ensure_index([('projectid', 1),
-                ('vaultid', 1), ('fileid', 1)])
-            result = self._files.find(args)
-            if result is None:
-                return 0  # pragma: no cover
-            else:
-                return result.count()
+        res = self._vaultstats.find_one(args) or {}
 
-        def __stats_get_vault_block_count():
-            self._blocks.ensure_index([('projectid', 1),
-                ('vaultid', 1), ('blockid', 1)])
-            result = self._blocks.find(args)
-            if result is None:
-                return 0  # pragma: no cover
-            else:
-                return result.count()
+        return self._build_vault_statistics(
+            vault_id, dict((name, res.get(name, 0))
+                           for name in VAULT_COUNTERS))
+
+    def reconcile_vault_statistics(self, vault_id):
+        self._vaultstats.ensure_index([('projectid', 1),
+            ('vaultid', 1)])
+
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+        }
+
+        actual = dict((name, 0) for name in VAULT_COUNTERS)
+        actual['files'] = self._files.find(args).count()
 
-        # Add any statistics regarding files
-        res['files'] = {}
-        res['files']['count'] = __stats_get_vault_file_count()
+        for block in self._blocks.find(args, {'blocksize': 1,
+                                              'isinvalid': 1}):
+            actual['blocks'] += 1
+            actual['bytes'] += block['blocksize']
+            actual['badblocks'] += int(block.get('isinvalid') or False)
 
-        # Add any statistics regarding blocks
-        res['blocks'] = {}
-        res['blocks']['count'] = __stats_get_vault_block_count()
+        current = self._vaultstats.find_one(args) or {}
 
-        # Add information about bad blocks and bad files
+        self._vaultstats.update(args, {'$set': actual}, upsert=True)
 
-        res['blocks']['bad'], res['files']['bad'] = \
-            self.vault_health(vault_id)
+        return dict((name, actual[name] - current.get(name, 0))
+                    for name in VAULT_COUNTERS)
 
-        # Add any statistics specific to the Mongo backend
-        res['internal'] = {}
+    def _inc_vault_statistics(self, vault_id, **deltas):
+        """Adds the given deltas to the counters of the vault"""
+        deltas = dict((name, delta) for name, delta in deltas.items()
+                      if delta != 0)
+
+        if deltas:
+            args = {
+                'projectid': deuce.context.project_id,
+                'vaultid': vault_id,
+            }
 
-        return res
+            self._vaultstats.update(args, {'$inc': deltas}, upsert=True)
 
     def vault_health(self, vault_id):
         '''Returns the number of bad blocks and bad files associated
@@ -128,25 +145,26 @@ class MongoDbStorageDriver(MetadataStorageDriver):
             isinvalid=True
         )
         self._blocks.ensure_index([('projectid', 1),
-                ('vaultid', 1)])
+                ('vaultid', 1), ('isinvalid', 1)])
 
-        results = self._blocks.find(args)
+        results = self._blocks.find(args, {'_id': 0, 'blockid': 1})
 
-        bad_blocks = ([res['blockid'] for res in results])
+        bad_blocks = [res['blockid'] for res in results]
         no_of_bad_blocks = len(bad_blocks)
         bad_files = set()
 
         self._fileblocks.ensure_index([('projectid', 1),
                 ('vaultid', 1), ('blockid', 1)])
 
-        for block_id in bad_blocks:
+        # The distinct files referencing the bad blocks are
+        # looked up on the server, a chunk of blocks at a time
+        for start in range(0, no_of_bad_blocks, MAX_IN_BLOCK_IDS):
             args = dict(
                 projectid=deuce.context.project_id,
                 vaultid=vault_id,
-                blockid=block_id,
+                blockid={'$in': bad_blocks[start:start + MAX_IN_BLOCK_IDS]}
             )
-            results = self._fileblocks.find(args)
-            bad_files.update([res['fileid'] for res in results])
+            bad_files.update(self._fileblocks.find(args).distinct('fileid'))
 
         no_of_bad_files = len(bad_files)
 
@@ -161,10 +179,12 @@ class MongoDbStorageDriver(MetadataStorageDriver):
             'finalized': False,
             'size': 0,
             'seq': 0,
-            'blocks': []
+            'blocks': [],
+            'coverage': EMPTY_FILE_COVERAGE
         }
 
         self._files.insert(args)
+        self._inc_vault_statistics(vault_id, files=1)
 
         return file_id
 
@@ -201,6 +221,61 @@ class MongoDbStorageDriver(MetadataStorageDriver):
         else:
             return None
 
+    def _get_blocks_storage(self, vault_id, block_ids, check_status=False):
+        """Returns a dict of block id to (storage id, size) for the
+        specified blocks that are registered, using a single query.
+        If check_status is set, blocks marked as bad are left out"""
+        self._blocks.ensure_index([('projectid', 1),
+                                  ('vaultid', 1), ('blockid', 1)])
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'blockid': {
+                '$in': list(set(block_ids))
+            }
+        }
+
+        if check_status:
+            args['isinvalid'] = False
+
+        project_args = {
+            '_id': 0,
+            'blockid': 1,
+            'storageid': 1,
+            'blocksize': 1
+        }
+
+        return dict((res['blockid'],
+                     (str(res['storageid']), res['blocksize']))
+                    for res in self._blocks.find(args, project_args))
+
+    def get_block_storage_ids(self, vault_id, block_ids):
+        blocks = self._get_blocks_storage(vault_id, block_ids)
+
+        return [blocks.get(block_id, (None, None))[0]
+                for block_id in block_ids]
+
+    def get_block_info(self, vault_id, block_id):
+        self._blocks.ensure_index([('projectid', 1),
+                                  ('vaultid', 1), ('blockid', 1)])
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'blockid': str(block_id)
+        }
+
+        res = self._blocks.find_one(args)
+        if res is None:
+            return None
+
+        return {
+            'storageid': str(res.get('storageid')),
+            'blocksize': res.get('blocksize'),
+            'reftime': res.get('reftime'),
+            'isinvalid': res.get('isinvalid') or False,
+            'refcount': self.get_block_ref_count(vault_id, block_id)
+        }
+
     def get_block_metadata_id(self, vault_id, storage_id):
         """Retrieve block id for a given storage id"""
         self._blocks.ensure_index([('projectid', 1),
@@ -256,24 +331,51 @@ class MongoDbStorageDriver(MetadataStorageDriver):
             'fileid': file_id
         }
 
-        results = self._fileblocks.find(args)
         block_args = args.copy()
         del block_args['fileid']
 
         self._blocks.ensure_index([('projectid', 1),
             ('vaultid', 1), ('blockid', 1)])
 
-        for result in results:
-            block_args['blockid'] = result['blockid']
-            update_args = {
+        result = self._files.remove(args)
+
+        # Only the fileblocks documents read are removed, so that the
+        # references taken off the blocks are exactly the ones removed
+        fileblocks = list(self._fileblocks.find(args, {'blockid': 1}))
+
+        if fileblocks:
+            self._fileblocks.remove({'_id': {'$in': [
+                fileblock['_id'] for fileblock in fileblocks]}})
+
+        refs = collections.Counter(fileblock['blockid']
+                                   for fileblock in fileblocks)
+
+        if refs:
+            block_args['blockid'] = {'$in': list(refs)}
+
+            self._blocks.update(block_args, {
                 '$set': {
                     'reftime': int(datetime.datetime.utcnow().timestamp())
                 }
-            }
-            self._blocks.update(block_args, update_args, upsert=False)
+            }, multi=True)
 
-        self._files.remove(args)
-        self._fileblocks.remove(args)
+        # The blocks referenced the same number of times are
+        # decremented together
+        blocks_per_count = collections.defaultdict(list)
+
+        for block_id, count in refs.items():
+            blocks_per_count[count].append(block_id)
+
+        self._blockrefs.ensure_index([('projectid', 1),
+            ('vaultid', 1), ('blockid', 1)], unique=True)
+
+        for count, block_ids in blocks_per_count.items():
+            block_args['blockid'] = {'$in': block_ids}
+            self._blockrefs.update(block_args,
+                                   {'$inc': {'refcount': -count}},
+                                   multi=True)
+
+        self._inc_vault_statistics(vault_id, files=-result['n'])
 
     def finalize_file(self, vault_id, file_id, file_size=None):
         """Updates FILES to set a file to finalized. This function
@@ -294,54 +396,63 @@ class MongoDbStorageDriver(MetadataStorageDriver):
         if resfile.count() < 1:
             return
 
-        # Check for gap and overlap.
-        fileblocks_list = list(self._fileblocks.
-            find(find_args).sort('offset', 1))
-        expected_offset = 0
-
-        for item in fileblocks_list:
-            offset = item['offset']
-            blockid = item['blockid']
-
-            blockdata = self.get_block_data(vault_id, blockid)
-
-            if blockdata is None:
-                continue
-
-            if offset == expected_offset:
-                expected_offset += int(blockdata['blocksize'])
-            elif offset < expected_offset:  # Overlap scenario
-                raise OverlapError(deuce.context.project_id, vault_id,
-                    file_id, blockid, startpos=offset, endpos=expected_offset)
-            else:
-                raise GapError(deuce.context.project_id, vault_id, file_id,
-                    startpos=expected_offset, endpos=offset)
-
-        # Now we must check the very last block
-        if file_size and file_size != expected_offset:
-            if expected_offset < file_size:
-                raise GapError(deuce.context.project_id, vault_id, file_id,
-                    expected_offset, file_size)
-            else:
-                assert expected_offset > file_size
+        filerec = list(resfile)[0]
 
-                raise OverlapError(deuce.context.project_id, vault_id, file_id,
-                    file_size, startpos=file_size, endpos=expected_offset)
+        if self._file_is_covered(filerec.get('coverage'), file_size):
+            # The blocks were checked for gaps and overlaps as they
+            # were assigned, the manifest is recorded when the file
+            # is first read
+            manifest = None
 
-        filerec_id = list(resfile)[0].get('_id')
+        else:
+            manifest = self._create_file_manifest(vault_id, file_id,
+                                                  file_size)
 
         # Save finalized state in Files Collection
         if file_size is None:
             file_size = 0
 
-        self._files.update({'_id': filerec_id}, {
+        self._files.update({'_id': filerec.get('_id')}, {
             '$set': {
                 'finalized': True,
-                'size': file_size
+                'size': file_size,
+                'manifest': manifest
             }
         },
             upsert=False)
 
+    def _create_file_manifest(self, vault_id, file_id, file_size):
+        """Checks the blocks of a file for gaps and overlaps and
+        returns its packed manifest"""
+        find_args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'fileid': file_id
+        }
+
+        # The sizes of all of the valid blocks of the
+        # file are looked up in a single query
+        fileblocks_list = list(self._fileblocks.find(find_args,
+            {'_id': 0, 'blockid': 1, 'offset': 1}))
+
+        storage = self._get_blocks_storage(vault_id,
+            [item['blockid'] for item in fileblocks_list],
+            check_status=True)
+
+        file_blocks = []
+
+        for item in fileblocks_list:
+            storageid, size = storage.get(item['blockid'], (None, None))
+            file_blocks.append((item['blockid'], item['offset'], size,
+                                storageid))
+
+        blocks = self._verify_file_blocks(vault_id, file_id, file_blocks,
+                                          file_size)
+
+        return pack_manifest([
+            (blockid, offset, storageid, size)
+            for blockid, offset, size, storageid in blocks])
+
     def get_file_data(self, vault_id, file_id):
         """Returns a tuple representing data for this file"""
         self._files.ensure_index([('projectid', 1),
@@ -359,6 +470,40 @@ class MongoDbStorageDriver(MetadataStorageDriver):
 
         return [res.get('finalized')]
 
+    def get_file_manifest(self, vault_id, file_id):
+        self._files.ensure_index([('projectid', 1),
+            ('vaultid', 1), ('fileid', 1)])
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'fileid': file_id,
+            'finalized': True
+        }
+
+        res = self._files.find_one(args, {'manifest': 1, 'size': 1})
+
+        if res is None:
+            return None
+
+        manifest = res.get('manifest')
+
+        if manifest is None:
+            # Files finalized through their coverage summary, and
+            # files that had a block marked as bad, have their
+            # manifest recorded on the first read that finds all of
+            # their blocks valid
+            manifest = self._rebuild_file_manifest(vault_id, file_id,
+                                                   res.get('size'))
+
+            if manifest is None:
+                return None
+
+            self._files.update({'_id': res['_id']},
+                               {'$set': {'manifest': manifest}},
+                               upsert=False)
+
+        return unpack_manifest(manifest)
+
     def mark_block_as_bad(self, vault_id, block_id):
         args = {
             'projectid': deuce.context.project_id, 'vaultid': vault_id,
@@ -371,7 +516,24 @@ class MongoDbStorageDriver(MetadataStorageDriver):
             }
         }
 
-        self._blocks.update(args, update_args, upsert=False)
+        # Only count the block as bad if it was not already
+        if self._blocks.find_and_modify(dict(args, isinvalid={'$ne': True}),
+                                        update_args) is not None:
+            self._inc_vault_statistics(vault_id, badblocks=1)
+
+        # Drop the manifests of the files referencing the block
+        file_ids = list(set(res['fileid'] for res in
+            self._fileblocks.find(args, {'_id': 0, 'fileid': 1})))
+
+        file_args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'fileid': {'$in': file_ids}
+        }
+
+        self._files.update(file_args,
+                           {'$unset': {'manifest': '', 'coverage': ''}},
+                           upsert=False, multi=True)
 
     @staticmethod
     def _block_exists(result, check_status):
@@ -387,7 +549,8 @@ class MongoDbStorageDriver(MetadataStorageDriver):
             args = {
                 'projectid': deuce.context.project_id,
                 'vaultid': vault_id,
-                'blockid': str(block_id)
+                'blockid': str(block_id),
+                'isinvalid': True
             }
 
             update_args = {
@@ -396,13 +559,13 @@ class MongoDbStorageDriver(MetadataStorageDriver):
                 }
             }
 
-            self._blocks.update(args, update_args, upsert=False)
+            return self._blocks.update(args, update_args, upsert=False)['n']
 
         blocks = self.create_block_generator(vault_id, marker,
                                              self._determine_limit(limit))
 
-        for block in blocks:
-            mark_block_as_good(vault_id, block)
+        reset = sum(mark_block_as_good(vault_id, block) for block in blocks)
+        self._inc_vault_statistics(vault_id, badblocks=-reset)
 
         return blocks[-1:][0] if len(blocks) == \
             self._determine_limit(limit) else None
@@ -424,26 +587,34 @@ class MongoDbStorageDriver(MetadataStorageDriver):
 
     # @lru_cache(maxsize=1024)
     def has_blocks(self, vault_id, block_ids, check_status=False):
-        # Query BLOCKS for the block
-        results = []
+        # Query BLOCKS for chunks of the blocks at a time
+        self._blocks.ensure_index([('projectid', 1),
+            ('vaultid', 1), ('blockid', 1)])
 
-        for block_id in block_ids:
-            self._blocks.ensure_index([('projectid', 1),
-                ('vaultid', 1), ('blockid', 1)])
+        unique_ids = list(set(str(block_id) for block_id in block_ids))
+        existing = set()
 
+        for start in range(0, len(unique_ids), MAX_IN_BLOCK_IDS):
             args = {
                 'projectid': deuce.context.project_id,
                 'vaultid': vault_id,
-                'blockid': str(block_id)
+                'blockid': {
+                    '$in': unique_ids[start:start + MAX_IN_BLOCK_IDS]
+                }
             }
 
-            result = self._blocks.find_one(args)
+            project_args = {
+                '_id': 0,
+                'blockid': 1,
+                'isinvalid': 1
+            }
 
-            if MongoDbStorageDriver._block_exists(result,
-                                                  check_status) is False:
-                results.append(block_id)
+            for result in self._blocks.find(args, project_args):
+                if MongoDbStorageDriver._block_exists(result, check_status):
+                    existing.add(result['blockid'])
 
-        return results
+        return [block_id for block_id in block_ids
+                if str(block_id) not in existing]
 
     def get_block_data(self, vault_id, block_id):
         """Returns the blocksize for this block"""
@@ -492,7 +663,13 @@ class MongoDbStorageDriver(MetadataStorageDriver):
             self._files.find(args).sort('fileid', 1).limit(limit))
 
     def create_file_block_generator(self, vault_id, file_id,
-            offset=None, limit=None):
+            offset=None, limit=None, with_storage=False):
+
+        manifest = self.get_file_manifest(vault_id, file_id)
+
+        if manifest is not None:
+            return self._slice_file_manifest(manifest, offset, limit,
+                                             with_storage)
 
         self._fileblocks.ensure_index([('projectid', 1),
             ('vaultid', 1), ('fileid', 1), ('offset', 1)])
@@ -531,8 +708,48 @@ class MongoDbStorageDriver(MetadataStorageDriver):
             resblocks = self._fileblocks.find(args,
                 project_args).sort('offset', 1)
 
+        if with_storage:
+            resblocks = list(resblocks)
+            blocks = self._get_blocks_storage(
+                vault_id, [res['blockid'] for res in resblocks])
+
+            return ((res['blockid'], res['offset']) +
+                    blocks.get(res['blockid'], (None, None))
+                    for res in resblocks)
+
         return ((res['blockid'], res['offset']) for res in resblocks)
 
+    def _add_file_coverage(self, vault_id, file_id, block_ids, offsets):
+        """Adds newly assigned blocks to the coverage summary of
+        the file"""
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'fileid': file_id
+        }
+
+        res = self._files.find_one(args, {'coverage': 1})
+
+        if res is None or res.get('coverage') is None:
+            return
+
+        sizes = self._get_blocks_storage(vault_id, block_ids,
+                                         check_status=True)
+
+        coverage = self._update_file_coverage(res['coverage'], [
+            (offset, sizes.get(block_id, (None, None))[1])
+            for block_id, offset in zip(block_ids, offsets)])
+
+        # The summary is only replaced if it has not been changed
+        # by a concurrent assignment, otherwise it is not known
+        result = self._files.update(
+            {'_id': res['_id'], 'coverage': res['coverage']},
+            {'$set': {'coverage': coverage}}, upsert=False)
+
+        if not result['updatedExisting']:
+            self._files.update({'_id': res['_id']},
+                               {'$set': {'coverage': None}}, upsert=False)
+
     def assign_block(self, vault_id, file_id, block_id, offset):
         # TODO(jdp): tweak this to support multiple assignments
         # TODO(jdp): check for overlaps in metadata
@@ -546,7 +763,14 @@ class MongoDbStorageDriver(MetadataStorageDriver):
             'offset': offset
         }
 
-        self._fileblocks.update(args, args, upsert=True)
+        result = self._fileblocks.update(args, args, upsert=True)
+        self._add_file_coverage(vault_id, file_id, [block_id], [offset])
+
+        # Assigning the same block at the same offset again does
+        # not add a reference
+        if not result['updatedExisting']:
+            self._inc_block_ref_count(vault_id, block_id)
+
         # Ordered in pymongo.ASCENDING.
         self._fileblocks.ensure_index([('projectid', 1),
             ('vaultid', 1),
@@ -567,6 +791,10 @@ class MongoDbStorageDriver(MetadataStorageDriver):
 
     def assign_blocks(self, vault_id, file_id, block_ids, offsets):
         # TODO(jdp): tweak this to support multiple assignments
+        self._add_file_coverage(vault_id, file_id, block_ids, offsets)
+
+        refs = collections.Counter()
+
         # TODO(jdp): check for overlaps in metadata
         for block_id, offset in zip(block_ids, offsets):
             self._files.ensure_index([('projectid', 1),
@@ -579,7 +807,11 @@ class MongoDbStorageDriver(MetadataStorageDriver):
                 'offset': offset
             }
 
-            self._fileblocks.update(args, args, upsert=True)
+            result = self._fileblocks.update(args, args, upsert=True)
+
+            if not result['updatedExisting']:
+                refs[block_id] += 1
+
             # Ordered in pymongo.ASCENDING.
             self._fileblocks.ensure_index([('projectid', 1),
                 ('vaultid', 1),
@@ -598,26 +830,95 @@ class MongoDbStorageDriver(MetadataStorageDriver):
 
             self._blocks.update(block_args, update_args, upsert=False)
 
+        for block_id, count in refs.items():
+            self._inc_block_ref_count(vault_id, block_id, count)
+
     def register_block(self, vault_id, block_id, storage_id, blocksize):
-        if not self.has_block(vault_id, block_id, check_status=True):
-            args = {
+        self.register_blocks(vault_id, [(block_id, storage_id, blocksize)])
+
+    def register_blocks(self, vault_id, blocks):
+        self._blocks.ensure_index([('projectid', 1),
+            ('vaultid', 1), ('blockid', 1)])
+
+        block_ids = [str(block_id) for block_id, _, _ in blocks]
+
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'blockid': {'$in': block_ids}
+        }
+
+        # Blocks that are already registered and valid are kept,
+        # any invalid registrations are replaced below
+        existing = self._blocks.find(args, {'blockid': 1, 'isinvalid': 1})
+
+        valid_ids = set()
+        invalid_ids = set()
+
+        for result in existing:
+            if MongoDbStorageDriver._block_exists(result, True):
+                valid_ids.add(result['blockid'])
+            else:
+                invalid_ids.add(result['blockid'])
+
+        reftime = int(datetime.datetime.utcnow().timestamp())
+
+        bulk = self._blocks.initialize_unordered_bulk_op()
+        new_sizes = []
+        replaced_blocks = 0
+        replaced_bytes = 0
+
+        for block_id, storage_id, blocksize in blocks:
+            block_id = str(block_id)
+
+            if block_id in valid_ids:
+                continue
+
+            # Guard against the same block appearing twice in the batch
+            valid_ids.add(block_id)
+
+            key = {
                 'projectid': deuce.context.project_id,
                 'vaultid': vault_id,
-                'blockid': str(block_id),
-                'blocksize': blocksize,
+                'blockid': block_id
             }
-            update_args = {
-                '$set': {
-                    'reftime': int(datetime.datetime.utcnow().timestamp()),
-                    'storageid': storage_id,
-                    'projectid': deuce.context.project_id,
-                    'vaultid': vault_id,
-                    'blockid': str(block_id),
-                    'blocksize': blocksize,
-                    'isinvalid': False
-                }
+
+            block = {
+                'reftime': reftime,
+                'storageid': storage_id,
+                'blocksize': blocksize,
+                'isinvalid': False
             }
-            self._blocks.update(args, update_args, upsert=True)
+
+            if block_id in invalid_ids:
+                # Only the upload that actually replaces the invalid
+                # registration counts it
+                old = self._blocks.find_and_modify(
+                    dict(key, isinvalid=True), {'$set': block})
+
+                if old is not None:
+                    replaced_blocks += 1
+                    replaced_bytes += blocksize - old['blocksize']
+
+                continue
+
+            # The blocks are upserted on their key, so concurrent
+            # uploads of the same block register it once, and only
+            # the upload that inserts it counts it
+            bulk.find(key).upsert().update_one({'$setOnInsert': block})
+            new_sizes.append(blocksize)
+
+        upserted = []
+
+        if new_sizes:
+            upserted = [new_sizes[op['index']]
+                        for op in bulk.execute()['upserted']]
+
+        self._inc_vault_statistics(
+            vault_id,
+            blocks=len(upserted),
+            bytes=sum(upserted) + replaced_bytes,
+            badblocks=-replaced_blocks)
 
     def unregister_block(self, vault_id, block_id):
 
@@ -631,13 +932,18 @@ class MongoDbStorageDriver(MetadataStorageDriver):
             'vaultid': vault_id,
             'blockid': str(block_id)
         }
-        self._blocks.remove(args)
 
-    def get_block_ref_count(self, vault_id, block_id):
+        block = self._blocks.find_and_modify(args, remove=True)
+        self._blockrefs.remove(args)
+
+        if block is not None:
+            self._inc_vault_statistics(
+                vault_id, blocks=-1, bytes=-block['blocksize'],
+                badblocks=-int(block.get('isinvalid') or False))
 
-        # Blocks can be in two places:
-        # 1) The fileblocks collection for unfinalized files
-        # 2) The files collection for finalized files
+    def get_block_ref_count(self, vault_id, block_id):
+        self._blockrefs.ensure_index([('projectid', 1),
+            ('vaultid', 1), ('blockid', 1)], unique=True)
 
         args = {
             'projectid': deuce.context.project_id,
@@ -645,24 +951,24 @@ class MongoDbStorageDriver(MetadataStorageDriver):
             'blockid': str(block_id)
         }
 
-        fileblocks_cnt = self._fileblocks.find(args).count()
+        res = self._blockrefs.find_one(args, {'_id': 0, 'refcount': 1})
+
+        return res['refcount'] if res is not None else 0
+
+    def _inc_block_ref_count(self, vault_id, block_id, cnt=1):
+        """Adds cnt to the count of the references to the block,
+        which is the number of fileblocks documents of the block"""
+        self._blockrefs.ensure_index([('projectid', 1),
+            ('vaultid', 1), ('blockid', 1)], unique=True)
 
-        # TODO: we currently count all documents. Let's
-        # optimize this query later
         args = {
             'projectid': deuce.context.project_id,
-            'vaultid': vault_id
+            'vaultid': vault_id,
+            'blockid': str(block_id)
         }
 
-        res = self._files.find(args)
-
-        files_cnt = 0
-
-        for doc in res:
-            docgen = (rec['blockid'] for rec in doc['blocks'])
-            files_cnt += sum(1 for _ in docgen)
-
-        return files_cnt + fileblocks_cnt
+        self._blockrefs.update(args, {'$inc': {'refcount': cnt}},
+                               upsert=True)
 
     def get_block_ref_modified(self, vault_id, block_id):
 
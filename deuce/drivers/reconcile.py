@@ -0,0 +1,74 @@
+"""
+Reconciles the statistics counters of the vaults of a project with
+the files and blocks they actually hold.
+
+The counters behind the vault statistics are updated as files and
+blocks are created and removed. Writes that fail halfway, or that
+race each other, can leave them off by a few. This tool counts the
+files and blocks of every vault again and corrects the counters of
+the configured metadata driver:
+
+    python -m deuce.drivers.reconcile --project <project id>
+"""
+import argparse
+import threading
+
+import deuce
+from deuce import conf
+from deuce.model import _load_metadata_driver
+
+
+def reconcile(driver, batch=100):
+    """Reconciles the counters of every vault of the project of
+    the current context, listing the vaults batch at a time
+
+    :returns: A list of (vault_id, corrections) for the vaults
+        whose counters had drifted"""
+    drifted = []
+    marker = None
+
+    while True:
+        # The listing starts at the marker, the last vault of the
+        # previous batch
+        vault_ids = [vault_id for vault_id in
+                     driver.create_vaults_generator(marker, batch)
+                     if vault_id != marker]
+
+        if not vault_ids:
+            return drifted
+
+        for vault_id in vault_ids:
+            corrections = driver.reconcile_vault_statistics(vault_id)
+
+            if any(corrections.values()):
+                drifted.append((vault_id, corrections))
+
+        marker = vault_ids[-1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Reconciles the vault statistics counters of Deuce')
+    parser.add_argument('--project', required=True,
+                        help='ID of the project whose vaults to reconcile')
+    parser.add_argument('--batch', type=int, default=100,
+                        help='Number of vaults listed at a time')
+    args = parser.parse_args(argv)
+
+    deuce.context = threading.local()
+    deuce.context.project_id = args.project
+
+    driver = _load_metadata_driver(conf.metadata_driver.driver)
+
+    drifted = reconcile(driver, args.batch)
+
+    for vault_id, corrections in drifted:
+        print('{0}: {1}'.format(vault_id, ', '.join(
+            '{0} {1:+d}'.format(name, count)
+            for name, count in sorted(corrections.items()) if count)))
+
+    print('{0} vaults corrected'.format(len(drifted)))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
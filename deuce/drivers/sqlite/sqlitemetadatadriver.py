@@ -1,4 +1,8 @@
+import binascii
+import contextlib
 from functools import lru_cache
+import re
+import uuid
 
 from deuce import conf
 import deuce
@@ -6,7 +10,49 @@ import importlib
 
 
 from deuce.drivers.metadatadriver import MetadataStorageDriver,\
-    OverlapError, GapError, ConstraintError
+    ConstraintError, EMPTY_FILE_COVERAGE, VAULT_COUNTERS
+from deuce.util import pack_manifest, unpack_manifest
+
+# Block ids that are SHA-1 hex digests and file ids that are UUIDs,
+# as the API hands them out, are stored as 20 and 16 byte BLOBs.
+# Any other id is stored as the TEXT it is
+BLOCK_ID_REGEX = re.compile('^[0-9a-f]{40}$')
+
+
+def _pack_block_id(block_id):
+    if isinstance(block_id, str) and BLOCK_ID_REGEX.match(block_id):
+        return binascii.unhexlify(block_id)
+
+    return block_id
+
+
+def _unpack_block_id(block_id):
+    if isinstance(block_id, bytes):
+        return binascii.hexlify(block_id).decode('ascii')
+
+    return block_id
+
+
+def _pack_file_id(file_id):
+    if isinstance(file_id, str):
+        try:
+            packed = uuid.UUID(file_id)
+        except ValueError:
+            return file_id
+
+        # Only the canonical form of a UUID can be given back as is
+        if str(packed) == file_id:
+            return packed.bytes
+
+    return file_id
+
+
+def _unpack_file_id(file_id):
+    if isinstance(file_id, bytes):
+        return str(uuid.UUID(bytes=file_id))
+
+    return file_id
+
 
 # SQL schemas. Note: the schema is versions
 # in such a way that new instances always start
@@ -61,6 +107,186 @@ schemas.append([
     """
 ])  # Version 1
 
+schemas.append([
+    """
+    ALTER TABLE files ADD COLUMN manifest BLOB
+    """
+])  # Version 2
+
+schemas.append([
+    """
+    ALTER TABLE files ADD COLUMN coverage TEXT
+    """
+])  # Version 3
+
+# Counts the files, blocks, bytes and bad blocks of the vaults
+# matching the condition filled in
+SQL_COUNT_VAULT_STATISTICS = '''
+    SELECT projectid, vaultid, SUM(files), SUM(blocks), SUM(bytes),
+    SUM(badblocks)
+    FROM (
+        SELECT projectid, vaultid, COUNT(*) AS files, 0 AS blocks,
+        0 AS bytes, 0 AS badblocks
+        FROM files
+        WHERE {0}
+        GROUP BY projectid, vaultid
+        UNION ALL
+        SELECT projectid, vaultid, 0, COUNT(*), SUM(size),
+        SUM(isinvalid != 0)
+        FROM blocks
+        WHERE {0}
+        GROUP BY projectid, vaultid
+    )
+    GROUP BY projectid, vaultid
+'''
+
+# The statistics of each vault are kept up to date by triggers.
+# The triggers on blocks rely on recursive triggers being enabled,
+# so that the rows replaced by INSERT OR REPLACE are accounted for.
+# The counters row is created with INSERT ... WHERE NOT EXISTS, as
+# an INSERT OR IGNORE would take on the OR REPLACE of the statement
+# firing the trigger and reset the counters
+schemas.append([
+    """
+    CREATE TABLE vaultstats
+    (
+        projectid TEXT NOT NULL,
+        vaultid TEXT NOT NULL,
+        files INTEGER NOT NULL DEFAULT 0,
+        blocks INTEGER NOT NULL DEFAULT 0,
+        bytes INTEGER NOT NULL DEFAULT 0,
+        badblocks INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(projectid, vaultid)
+    )
+    """,
+    """
+    INSERT INTO vaultstats
+    (projectid, vaultid, files, blocks, bytes, badblocks)
+    """ + SQL_COUNT_VAULT_STATISTICS.format('1'),
+    """
+    CREATE TRIGGER vaultstats_insert_file AFTER INSERT ON files
+    BEGIN
+        INSERT INTO vaultstats (projectid, vaultid)
+        SELECT NEW.projectid, NEW.vaultid
+        WHERE NOT EXISTS (SELECT 1 FROM vaultstats
+            WHERE projectid = NEW.projectid AND vaultid = NEW.vaultid);
+        UPDATE vaultstats SET files = files + 1
+        WHERE projectid = NEW.projectid AND vaultid = NEW.vaultid;
+    END
+    """,
+    """
+    CREATE TRIGGER vaultstats_delete_file AFTER DELETE ON files
+    BEGIN
+        UPDATE vaultstats SET files = files - 1
+        WHERE projectid = OLD.projectid AND vaultid = OLD.vaultid;
+    END
+    """,
+    """
+    CREATE TRIGGER vaultstats_insert_block AFTER INSERT ON blocks
+    BEGIN
+        INSERT INTO vaultstats (projectid, vaultid)
+        SELECT NEW.projectid, NEW.vaultid
+        WHERE NOT EXISTS (SELECT 1 FROM vaultstats
+            WHERE projectid = NEW.projectid AND vaultid = NEW.vaultid);
+        UPDATE vaultstats SET blocks = blocks + 1,
+        bytes = bytes + NEW.size,
+        badblocks = badblocks + (NEW.isinvalid != 0)
+        WHERE projectid = NEW.projectid AND vaultid = NEW.vaultid;
+    END
+    """,
+    """
+    CREATE TRIGGER vaultstats_delete_block AFTER DELETE ON blocks
+    BEGIN
+        UPDATE vaultstats SET blocks = blocks - 1,
+        bytes = bytes - OLD.size,
+        badblocks = badblocks - (OLD.isinvalid != 0)
+        WHERE projectid = OLD.projectid AND vaultid = OLD.vaultid;
+    END
+    """,
+    """
+    CREATE TRIGGER vaultstats_update_block
+    AFTER UPDATE OF size, isinvalid ON blocks
+    BEGIN
+        UPDATE vaultstats SET bytes = bytes - OLD.size + NEW.size,
+        badblocks = badblocks - (OLD.isinvalid != 0) +
+        (NEW.isinvalid != 0)
+        WHERE projectid = NEW.projectid AND vaultid = NEW.vaultid;
+    END
+    """
+])  # Version 4
+
+# Indexes leading with the block id, so the files referencing a
+# block and the bad blocks of a vault are found without a scan
+schemas.append([
+    """
+    CREATE INDEX fileblocks_blockid
+    ON fileblocks (projectid, vaultid, blockid, fileid)
+    """,
+    """
+    CREATE INDEX blocks_isinvalid
+    ON blocks (projectid, vaultid, isinvalid)
+    """
+])  # Version 5
+
+# The number of rows rewritten at a time by _migrate_binary_ids()
+SQL_MIGRATE_BATCH_SIZE = 10000
+
+
+def _migrate_binary_ids(conn):
+    """Rewrites the block and file ids of the existing rows in
+    their binary form. Each table is rewritten in batches of rows,
+    with a commit after each batch so the migration never holds
+    a long running transaction. Packing an id that is already
+    packed leaves it as it is, an interrupted migration can be
+    run again"""
+    conn.create_function('pack_block_id', 1, _pack_block_id)
+    conn.create_function('pack_file_id', 1, _pack_file_id)
+
+    tables = (
+        ('blocks', 'blockid = pack_block_id(blockid)'),
+        ('files', 'fileid = pack_file_id(fileid)'),
+        ('fileblocks', 'blockid = pack_block_id(blockid), '
+                       'fileid = pack_file_id(fileid)')
+    )
+
+    for table, assignments in tables:
+        last_rowid = 0
+
+        while True:
+            res = conn.execute('''
+                SELECT MAX(rowid) FROM (SELECT rowid FROM {0}
+                WHERE rowid > ? ORDER BY rowid LIMIT ?)
+            '''.format(table), (last_rowid, SQL_MIGRATE_BATCH_SIZE))
+
+            end_rowid = next(res)[0]
+
+            if end_rowid is None:
+                break
+
+            conn.execute('''
+                UPDATE {0} SET {1}
+                WHERE rowid > ? AND rowid <= ?
+            '''.format(table, assignments), (last_rowid, end_rowid))
+            conn.commit()
+
+            last_rowid = end_rowid
+
+
+# Binary ids, and covering indexes for the lookup of blocks by their
+# storage id and for reading the blocks of a file in offset order.
+# The block reference counts are served by fileblocks_blockid above
+schemas.append([
+    _migrate_binary_ids,
+    """
+    CREATE INDEX blocks_storageid
+    ON blocks (projectid, vaultid, storageid, blockid)
+    """,
+    """
+    CREATE INDEX fileblocks_offset
+    ON fileblocks (projectid, vaultid, fileid, offset, blockid)
+    """
+])  # Version 6
+
 CURRENT_DB_VERSION = len(schemas)
 
 SQL_CREATE_VAULT = '''
@@ -85,8 +311,8 @@ SQL_GET_ALL_VAULT = '''
 '''
 
 SQL_CREATE_FILE = '''
-    INSERT INTO files (projectid, vaultid, fileid)
-    VALUES (:projectid, :vaultid, :fileid)
+    INSERT INTO files (projectid, vaultid, fileid, coverage)
+    VALUES (:projectid, :vaultid, :fileid, :coverage)
 '''
 
 SQL_GET_BLOCK = '''
@@ -106,6 +332,51 @@ SQL_GET_FILE = '''
     AND fileid = :fileid
 '''
 
+SQL_GET_FILE_MANIFEST = '''
+    SELECT manifest, size
+    FROM files
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+    AND finalized = 1
+'''
+
+SQL_SET_FILE_MANIFEST = '''
+    UPDATE files
+    SET manifest = :manifest
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+'''
+
+SQL_GET_FILE_COVERAGE = '''
+    SELECT coverage
+    FROM files
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+'''
+
+SQL_SET_FILE_COVERAGE = '''
+    UPDATE files
+    SET coverage = :coverage
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid = :fileid
+'''
+
+SQL_DROP_FILE_MANIFESTS_FOR_BLOCK = '''
+    UPDATE files
+    SET manifest = NULL, coverage = NULL
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND fileid IN (SELECT fileid
+    FROM fileblocks
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid)
+'''
+
 SQL_GET_FILE_SIZE = '''
     SELECT size
     FROM files
@@ -129,20 +400,31 @@ SQL_GET_ALL_FILE_BLOCKS = '''
     AND fileid = :fileid
     ORDER BY offset
 '''
-SQL_GET_BAD_BLOCKS = '''
-    SELECT blockid
-    FROM blocks
+
+SQL_GET_VAULT_STATISTICS = '''
+    SELECT files, blocks, bytes, badblocks
+    FROM vaultstats
     WHERE projectid = :projectid
     AND vaultid = :vaultid
-    AND isinvalid = 1
 '''
 
-SQL_GET_FILE_PER_BLOCK = '''
-    SELECT fileid
-    FROM fileblocks
-    WHERE projectid = :projectid
-    AND vaultid = :vaultid
-    AND blockid = :blockid
+SQL_SET_VAULT_STATISTICS = '''
+    INSERT OR REPLACE INTO vaultstats
+    (projectid, vaultid, files, blocks, bytes, badblocks)
+    VALUES (:projectid, :vaultid, :files, :blocks, :bytes, :badblocks)
+'''
+
+SQL_GET_VAULT_HEALTH = '''
+    SELECT COUNT(DISTINCT blocks.blockid),
+    COUNT(DISTINCT fileblocks.fileid)
+    FROM blocks
+    LEFT JOIN fileblocks
+    ON fileblocks.projectid = blocks.projectid
+    AND fileblocks.vaultid = blocks.vaultid
+    AND fileblocks.blockid = blocks.blockid
+    WHERE blocks.projectid = :projectid
+    AND blocks.vaultid = :vaultid
+    AND blocks.isinvalid = 1
 '''
 
 SQL_UPDATE_REF_TIME_BLOCKS_IN_FILE = '''
@@ -175,6 +457,36 @@ SQL_GET_FILE_BLOCKS = '''
     LIMIT :limit
 '''
 
+SQL_GET_ALL_FILE_BLOCKS_W_STORAGE = '''
+    SELECT fileblocks.blockid, fileblocks.offset,
+    blocks.storageid, blocks.size
+    FROM fileblocks
+    LEFT JOIN blocks
+    ON blocks.projectid = fileblocks.projectid
+    AND blocks.vaultid = fileblocks.vaultid
+    AND blocks.blockid = fileblocks.blockid
+    WHERE fileblocks.projectid = :projectid
+    AND fileblocks.vaultid = :vaultid
+    AND fileblocks.fileid = :fileid
+    ORDER BY fileblocks.offset
+'''
+
+SQL_GET_FILE_BLOCKS_W_STORAGE = '''
+    SELECT fileblocks.blockid, fileblocks.offset,
+    blocks.storageid, blocks.size
+    FROM fileblocks
+    LEFT JOIN blocks
+    ON blocks.projectid = fileblocks.projectid
+    AND blocks.vaultid = fileblocks.vaultid
+    AND blocks.blockid = fileblocks.blockid
+    WHERE fileblocks.projectid = :projectid
+    AND fileblocks.vaultid = :vaultid
+    AND fileblocks.fileid = :fileid
+    AND fileblocks.offset >= :offset
+    ORDER BY fileblocks.offset
+    LIMIT :limit
+'''
+
 SQL_DELETE_FILE_BLOCKS_FOR_FILE = '''
     DELETE FROM fileblocks
     WHERE projectid = :projectid
@@ -200,19 +512,56 @@ SQL_GET_STORAGE_ID = '''
     AND blockid = :blockid
 '''
 
-SQL_GET_BLOCK_ID = '''
-    SELECT blockid
+# Note: The list of block ids is filled in with one
+# parameter per block, see _query_block_ids()
+SQL_GET_STORAGE_IDS = '''
+    SELECT blockid, storageid
     FROM blocks
+    WHERE projectid = ?
+    AND vaultid = ?
+    AND blockid IN ({0})
+'''
+
+SQL_GET_BLOCK_SIZES = '''
+    SELECT blockid, size
+    FROM blocks
+    WHERE projectid = ?
+    AND vaultid = ?
+    AND isinvalid = 0
+    AND blockid IN ({0})
+'''
+
+SQL_GET_BLOCK_STATUSES = '''
+    SELECT blockid, isinvalid
+    FROM blocks
+    WHERE projectid = ?
+    AND vaultid = ?
+    AND blockid IN ({0})
+'''
+
+# The number of block ids given to each of the queries above,
+# which keeps them below SQLITE_MAX_VARIABLE_NUMBER
+SQL_MAX_IN_BLOCK_IDS = 500
+
+SQL_GET_BLOCK_INFO = '''
+    SELECT storageid, size, reftime, isinvalid,
+    (SELECT count(*)
+    FROM fileblocks
     WHERE projectid = :projectid
     AND vaultid = :vaultid
-    AND storageid = :storageid
+    AND blockid = :blockid)
+    FROM blocks
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
 '''
 
-SQL_GET_COUNT_ALL_BLOCKS = '''
-    SELECT COUNT(DISTINCT(blockid))
+SQL_GET_BLOCK_ID = '''
+    SELECT blockid
     FROM blocks
     WHERE projectid = :projectid
     AND vaultid = :vaultid
+    AND storageid = :storageid
 '''
 
 SQL_GET_ALL_FILES = '''
@@ -226,19 +575,14 @@ SQL_GET_ALL_FILES = '''
     LIMIT :limit
 '''
 
-SQL_GET_COUNT_ALL_FILES = '''
-    SELECT COUNT(DISTINCT(fileid))
-    FROM files
-    WHERE projectid = :projectid
-    AND vaultid = :vaultid
-'''
-
 
 SQL_CREATE_FILEBLOCK_LIST = '''
-    SELECT blocks.blockid, fileblocks.offset, blocks.size
+    SELECT blocks.blockid, fileblocks.offset, blocks.size,
+    blocks.storageid
     FROM blocks, fileblocks
     WHERE fileblocks.blockid = blocks.blockid
     AND fileblocks.vaultid = blocks.vaultid
+    AND fileblocks.projectid = blocks.projectid
     AND fileblocks.projectid = :projectid
     AND fileblocks.vaultid = :vaultid
     AND fileblocks.fileid = :fileid
@@ -248,7 +592,7 @@ SQL_CREATE_FILEBLOCK_LIST = '''
 
 SQL_FINALIZE_FILE = '''
     UPDATE files
-    SET finalized=1, size=:file_size
+    SET finalized=1, size=:file_size, manifest=:manifest
     WHERE projectid=:projectid
     AND fileid=:fileid
     AND vaultid=:vaultid
@@ -267,6 +611,19 @@ SQL_REGISTER_BLOCK = '''
     strftime('%s', 'now'), 0)
 '''
 
+SQL_REGISTER_BLOCK_IF_MISSING = '''
+    INSERT OR REPLACE INTO blocks
+    (projectid, vaultid, blockid, storageid, size, reftime, isinvalid)
+    SELECT :projectid, :vaultid, :blockid, :storageid, :blocksize,
+    strftime('%s', 'now'), 0
+    WHERE NOT EXISTS (SELECT 1
+    FROM blocks
+    WHERE projectid = :projectid
+    AND vaultid = :vaultid
+    AND blockid = :blockid
+    AND isinvalid = 0)
+'''
+
 SQL_UNREGISTER_BLOCK = '''
     DELETE FROM blocks
     WHERE projectid=:projectid AND blockid=:blockid
@@ -331,6 +688,10 @@ class SqliteStorageDriver(MetadataStorageDriver):
             conf.metadata_driver.sqlite.db_module)
         self._conn = getattr(deuce.db_pack, 'Connection')(self._dbfile)
 
+        # The triggers maintaining the vault statistics need to see
+        # the rows deleted by INSERT OR REPLACE
+        self._conn.execute('pragma recursive_triggers = ON')
+
         self._do_migrate()
 
     def _get_user_version(self):
@@ -352,11 +713,30 @@ class SqliteStorageDriver(MetadataStorageDriver):
             schema = schemas[db_ver]
 
             for query in schema:
-                self._conn.execute(query)
+                # Migrations that cannot be written in SQL alone
+                # are functions of the connection
+                if callable(query):
+                    query(self._conn)
+                else:
+                    self._conn.execute(query)
 
             db_ver = db_ver + 1
             self._set_user_version(db_ver)
 
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Groups the statements executed within it into a single
+        transaction. The transaction is committed once the block
+        completes and rolled back if it raises"""
+        try:
+            yield self._conn
+
+        except Exception:
+            self._conn.rollback()
+            raise
+
+        self._conn.commit()
+
     def _determine_marker(self, marker):
         """Determines the default marker to use if
         the passed marker is None, empty string, etc
@@ -369,8 +749,8 @@ class SqliteStorageDriver(MetadataStorageDriver):
             'projectid': deuce.context.project_id,
             'vaultid': vault_id
         }
-        self._conn.execute(SQL_CREATE_VAULT, args)
-        self._conn.commit()
+        with self._transaction() as conn:
+            conn.execute(SQL_CREATE_VAULT, args)
         # TODO: check that one row was inserted
         return
 
@@ -381,8 +761,8 @@ class SqliteStorageDriver(MetadataStorageDriver):
             'vaultid': vault_id
         }
 
-        self._conn.execute(SQL_DELETE_VAULT, args)
-        self._conn.commit()
+        with self._transaction() as conn:
+            conn.execute(SQL_DELETE_VAULT, args)
         return
 
     def create_vaults_generator(self, marker=None, limit=None):
@@ -403,48 +783,39 @@ class SqliteStorageDriver(MetadataStorageDriver):
         """Return the statistics on the vault.
 
         "param vault_id: The ID of the vault to gather statistics for"""
-        res = {}
-
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id
         }
 
-        def __stats_query(sql_statement, default_value):
-            result = self._conn.execute(sql_statement, args)
-
-            try:
-                row = next(result)
-                return row[0]
-
-            except StopIteration:  # pragma: no cover
-                return default_value
-
-            except IndexError:  # pragma: no cover
-                return default_value
+        res = list(self._conn.execute(SQL_GET_VAULT_STATISTICS, args))
+        counters = res[0] if len(res) > 0 else (0,) * len(VAULT_COUNTERS)
 
-        def __stats_get_vault_file_count():
-            return __stats_query(SQL_GET_COUNT_ALL_FILES, 0)
+        return self._build_vault_statistics(
+            vault_id, dict(zip(VAULT_COUNTERS, counters)))
 
-        def __stats_get_vault_block_count():
-            return __stats_query(SQL_GET_COUNT_ALL_BLOCKS, 0)
+    def reconcile_vault_statistics(self, vault_id):
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id
+        }
 
-        # Add any statistics regarding files
-        res['files'] = {}
-        res['files']['count'] = __stats_get_vault_file_count()
+        query = SQL_COUNT_VAULT_STATISTICS.format(
+            'projectid = :projectid AND vaultid = :vaultid')
 
-        # Add any statistics regarding blocks
-        res['blocks'] = {}
-        res['blocks']['count'] = __stats_get_vault_block_count()
+        with self._transaction() as conn:
+            res = list(conn.execute(SQL_GET_VAULT_STATISTICS, args))
+            current = res[0] if len(res) > 0 else (0,) * len(VAULT_COUNTERS)
 
-        # Add information about bad blocks and bad files
+            res = list(conn.execute(query, args))
+            actual = res[0][2:] if len(res) > 0 else \
+                (0,) * len(VAULT_COUNTERS)
 
-        res['blocks']['bad'], res['files']['bad'] = \
-            self.vault_health(vault_id)
-        # Add any statistics specific to the Sqlite backend
-        res['internal'] = {}
+            args.update(zip(VAULT_COUNTERS, actual))
+            conn.execute(SQL_SET_VAULT_STATISTICS, args)
 
-        return res
+        return dict((name, count - current_count) for name, count,
+                    current_count in zip(VAULT_COUNTERS, actual, current))
 
     def vault_health(self, vault_id):
         '''Returns the number of bad blocks and bad files associated
@@ -455,28 +826,11 @@ class SqliteStorageDriver(MetadataStorageDriver):
             vaultid=vault_id,
         )
 
-        res = self._conn.execute(SQL_GET_BAD_BLOCKS, args)
+        # The bad blocks and the files referencing them are
+        # counted at once
+        res = self._conn.execute(SQL_GET_VAULT_HEALTH, args)
 
-        bad_blocks = [row[0] for row in res]
-
-        no_of_bad_blocks = len(bad_blocks)
-
-        bad_files = set()
-
-        for block_id in bad_blocks:
-            args = dict(
-                projectid=deuce.context.project_id,
-                vaultid=vault_id,
-                blockid=block_id,
-            )
-            result = self._conn.execute(SQL_GET_FILE_PER_BLOCK, args)
-            bad_file = [row[0] for row in result]
-            try:
-                bad_files.add(bad_file[0])
-            except IndexError:
-                pass
-
-        no_of_bad_files = len(bad_files)
+        no_of_bad_blocks, no_of_bad_files = next(res)
 
         return (no_of_bad_blocks, no_of_bad_files)
 
@@ -485,11 +839,12 @@ class SqliteStorageDriver(MetadataStorageDriver):
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'fileid': file_id
+            'fileid': _pack_file_id(file_id),
+            'coverage': EMPTY_FILE_COVERAGE
         }
 
-        self._conn.execute(SQL_CREATE_FILE, args)
-        self._conn.commit()
+        with self._transaction() as conn:
+            conn.execute(SQL_CREATE_FILE, args)
 
         # TODO: check that one row was inserted
         return file_id
@@ -499,7 +854,7 @@ class SqliteStorageDriver(MetadataStorageDriver):
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'fileid': file_id
+            'fileid': _pack_file_id(file_id)
         }
 
         res = self._conn.execute(SQL_GET_FILE_SIZE, args)
@@ -515,7 +870,7 @@ class SqliteStorageDriver(MetadataStorageDriver):
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'blockid': block_id
+            'blockid': _pack_block_id(block_id)
         }
 
         res = self._conn.execute(SQL_GET_STORAGE_ID, args)
@@ -525,6 +880,50 @@ class SqliteStorageDriver(MetadataStorageDriver):
         except StopIteration:
             return None
 
+    def _query_block_ids(self, query, vault_id, block_ids):
+        """Runs a query taking a list of block ids over chunks of
+        at most SQL_MAX_IN_BLOCK_IDS of the block ids, and returns
+        the rows of all of them. The block id must be the first
+        column of the rows"""
+        unique_ids = list(set(_pack_block_id(block_id)
+                              for block_id in block_ids))
+
+        for start in range(0, len(unique_ids), SQL_MAX_IN_BLOCK_IDS):
+            chunk = unique_ids[start:start + SQL_MAX_IN_BLOCK_IDS]
+            args = [deuce.context.project_id, vault_id] + chunk
+
+            for row in self._conn.execute(
+                    query.format(', '.join('?' * len(chunk))), args):
+                yield (_unpack_block_id(row[0]),) + row[1:]
+
+    def get_block_storage_ids(self, vault_id, block_ids):
+        storage_ids = dict(
+            (row[0], str(row[1])) for row in
+            self._query_block_ids(SQL_GET_STORAGE_IDS, vault_id, block_ids))
+
+        return [storage_ids.get(block_id) for block_id in block_ids]
+
+    def get_block_info(self, vault_id, block_id):
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'blockid': _pack_block_id(block_id)
+        }
+
+        res = self._conn.execute(SQL_GET_BLOCK_INFO, args)
+        try:
+            row = next(res)
+        except StopIteration:
+            return None
+
+        return {
+            'storageid': str(row[0]),
+            'blocksize': row[1],
+            'reftime': row[2],
+            'isinvalid': bool(row[3]),
+            'refcount': row[4]
+        }
+
     def get_block_metadata_id(self, vault_id, storage_id):
         """Retrieve block id for a given storage id"""
         args = {
@@ -536,7 +935,7 @@ class SqliteStorageDriver(MetadataStorageDriver):
         res = self._conn.execute(SQL_GET_BLOCK_ID, args)
         try:
             row = next(res)
-            return str(row[0])
+            return _unpack_block_id(row[0])
         except StopIteration:
             return None
 
@@ -544,7 +943,7 @@ class SqliteStorageDriver(MetadataStorageDriver):
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'fileid': file_id
+            'fileid': _pack_file_id(file_id)
         }
 
         res = self._conn.execute(SQL_GET_FILE, args)
@@ -559,7 +958,7 @@ class SqliteStorageDriver(MetadataStorageDriver):
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'fileid': file_id
+            'fileid': _pack_file_id(file_id)
         }
 
         res = self._conn.execute(SQL_GET_FILE, args)
@@ -574,16 +973,12 @@ class SqliteStorageDriver(MetadataStorageDriver):
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'fileid': file_id
+            'fileid': _pack_file_id(file_id)
         }
-        res = self._conn.execute(SQL_UPDATE_REF_TIME_BLOCKS_IN_FILE, args)
-        self._conn.commit()
-
-        res = self._conn.execute(SQL_DELETE_FILE, args)
-        self._conn.commit()
-
-        res = self._conn.execute(SQL_DELETE_FILE_BLOCKS_FOR_FILE, args)
-        self._conn.commit()
+        with self._transaction() as conn:
+            conn.execute(SQL_UPDATE_REF_TIME_BLOCKS_IN_FILE, args)
+            conn.execute(SQL_DELETE_FILE, args)
+            conn.execute(SQL_DELETE_FILE_BLOCKS_FOR_FILE, args)
 
     def finalize_file(self, vault_id, file_id, file_size=None):
         """Updates the files table to set a file to finalized and record
@@ -594,48 +989,49 @@ class SqliteStorageDriver(MetadataStorageDriver):
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'fileid': file_id,
+            'fileid': _pack_file_id(file_id),
             'file_size': file_size
         }
 
-        # Check for gaps and overlaps.
-        expected_offset = 0
+        res = list(self._conn.execute(SQL_GET_FILE_COVERAGE, args))
 
-        res = self._conn.execute(SQL_CREATE_FILEBLOCK_LIST, args)
+        if len(res) > 0 and self._file_is_covered(res[0][0], file_size):
+            # The blocks were checked for gaps and overlaps as they
+            # were assigned, the manifest is recorded when the file
+            # is first read
+            args['manifest'] = None
 
-        for blockid, offset, size in res:
-            if offset == expected_offset:
-                expected_offset += size
-            elif offset < expected_offset:  # Overlap scenario
-                raise OverlapError(deuce.context.project_id, vault_id, file_id,
-                    blockid, startpos=offset, endpos=expected_offset)
-            else:
-                raise GapError(deuce.context.project_id, vault_id, file_id,
-                    startpos=expected_offset, endpos=offset)
-
-        # Now we must check the very last block
-        if file_size and file_size != expected_offset:
+        else:
+            args['manifest'] = self._create_file_manifest(
+                vault_id, file_id, file_size)
 
-            if expected_offset < file_size:
-                raise GapError(deuce.context.project_id, vault_id, file_id,
-                    expected_offset, file_size)
+        with self._transaction() as conn:
+            conn.execute(SQL_FINALIZE_FILE, args)
+        return None
 
-            else:
-                assert expected_offset > file_size
+    def _create_file_manifest(self, vault_id, file_id, file_size):
+        """Checks the blocks of a file for gaps and overlaps and
+        returns its packed manifest"""
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'fileid': _pack_file_id(file_id)
+        }
 
-                raise OverlapError(deuce.context.project_id, vault_id, file_id,
-                    file_size, startpos=file_size, endpos=expected_offset)
+        res = ((_unpack_block_id(row[0]),) + row[1:] for row in
+               self._conn.execute(SQL_CREATE_FILEBLOCK_LIST, args))
+        blocks = self._verify_file_blocks(vault_id, file_id, res, file_size)
 
-        res = self._conn.execute(SQL_FINALIZE_FILE, args)
-        self._conn.commit()
-        return None
+        return pack_manifest([
+            (blockid, offset, str(storageid), size)
+            for blockid, offset, size, storageid in blocks])
 
     def get_block_data(self, vault_id, block_id):
         """Returns the blocksize for this block"""
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'blockid': block_id
+            'blockid': _pack_block_id(block_id)
         }
 
         res = self._conn.execute(SQL_GET_BLOCK, args)
@@ -654,7 +1050,7 @@ class SqliteStorageDriver(MetadataStorageDriver):
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'fileid': file_id
+            'fileid': _pack_file_id(file_id)
         }
 
         res = self._conn.execute(SQL_GET_FILE, args)
@@ -666,15 +1062,47 @@ class SqliteStorageDriver(MetadataStorageDriver):
 
         return row
 
+    def get_file_manifest(self, vault_id, file_id):
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'fileid': _pack_file_id(file_id)
+        }
+
+        res = list(self._conn.execute(SQL_GET_FILE_MANIFEST, args))
+
+        if len(res) == 0:
+            return None
+
+        manifest, file_size = res[0]
+
+        if manifest is None:
+            # Files finalized through their coverage summary, and
+            # files that had a block marked as bad, have their
+            # manifest recorded on the first read that finds all of
+            # their blocks valid
+            manifest = self._rebuild_file_manifest(vault_id, file_id,
+                                                   file_size)
+
+            if manifest is None:
+                return None
+
+            args['manifest'] = manifest
+            with self._transaction() as conn:
+                conn.execute(SQL_SET_FILE_MANIFEST, args)
+
+        return unpack_manifest(manifest)
+
     def mark_block_as_bad(self, vault_id, block_id,):
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'blockid': block_id
+            'blockid': _pack_block_id(block_id)
         }
 
-        self._conn.execute(SQL_MARK_BLOCK_AS_BAD, args)
-        self._conn.commit()
+        with self._transaction() as conn:
+            conn.execute(SQL_MARK_BLOCK_AS_BAD, args)
+            conn.execute(SQL_DROP_FILE_MANIFESTS_FOR_BLOCK, args)
 
     @staticmethod
     def _block_exists(res, check_status):
@@ -696,18 +1124,14 @@ class SqliteStorageDriver(MetadataStorageDriver):
         blocks = self.create_block_generator(vault_id, marker,
                                              self._determine_limit(limit))
 
-        def mark_block_as_good(vault_id, block_id):
-            args = {
-                'projectid': deuce.context.project_id,
-                'vaultid': vault_id,
-                'blockid': block_id
-            }
-
-            self._conn.execute(SQL_MARK_BLOCK_AS_GOOD, args)
-            self._conn.commit()
+        args = [{
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'blockid': _pack_block_id(block_id)
+        } for block_id in blocks]
 
-        for block in blocks:
-            mark_block_as_good(vault_id, block)
+        with self._transaction() as conn:
+            conn.executemany(SQL_MARK_BLOCK_AS_GOOD, args)
 
         return blocks[-1:][0] if len(blocks) == \
             self._determine_limit(limit) else None
@@ -719,7 +1143,7 @@ class SqliteStorageDriver(MetadataStorageDriver):
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'blockid': block_id
+            'blockid': _pack_block_id(block_id)
         }
 
         # This query should only ever return zero or 1 row, so
@@ -729,21 +1153,14 @@ class SqliteStorageDriver(MetadataStorageDriver):
         return SqliteStorageDriver._block_exists(res, check_status)
 
     def has_blocks(self, vault_id, block_ids, check_status=False):
-        results = []
+        existing = set(
+            block_id for block_id, isinvalid in
+            self._query_block_ids(SQL_GET_BLOCK_STATUSES, vault_id,
+                                  block_ids)
+            if not (check_status and isinvalid == 1))
 
-        for block_id in block_ids:
-            args = {
-                'projectid': deuce.context.project_id,
-                'vaultid': vault_id,
-                'blockid': block_id
-            }
-
-            res = list(self._conn.execute(SQL_GET_BLOCK_STATUS, args))
-
-            if SqliteStorageDriver._block_exists(res, check_status) is False:
-                results.append(block_id)
-
-        return results
+        return [block_id for block_id in block_ids
+                if block_id not in existing]
 
     def create_block_generator(self, vault_id, marker=None,
             limit=None):
@@ -752,12 +1169,12 @@ class SqliteStorageDriver(MetadataStorageDriver):
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
             'limit': self._determine_limit(limit),
-            'marker': self._determine_marker(marker)
+            'marker': _pack_block_id(self._determine_marker(marker))
         }
 
         res = self._conn.execute(SQL_GET_ALL_BLOCKS, args)
 
-        return [row[0] for row in res]
+        return [_unpack_block_id(row[0]) for row in res]
 
     def create_file_generator(self, vault_id,
                               marker=None, limit=None, finalized=True):
@@ -766,27 +1183,36 @@ class SqliteStorageDriver(MetadataStorageDriver):
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
             'limit': self._determine_limit(limit),
-            'marker': self._determine_marker(marker),
+            'marker': _pack_file_id(self._determine_marker(marker)),
             'finalized': finalized
         }
 
         res = self._conn.execute(SQL_GET_ALL_FILES, args)
-        return [row[0] for row in res]
+        return [_unpack_file_id(row[0]) for row in res]
 
     def create_file_block_generator(self, vault_id, file_id,
-                                    offset=None, limit=None):
+                                    offset=None, limit=None,
+                                    with_storage=False):
+
+        manifest = self.get_file_manifest(vault_id, file_id)
+
+        if manifest is not None:
+            return self._slice_file_manifest(manifest, offset, limit,
+                                             with_storage)
 
         args = {
-            'fileid': file_id,
+            'fileid': _pack_file_id(file_id),
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
         }
 
         if limit is None:
-            query = SQL_GET_ALL_FILE_BLOCKS
+            query = SQL_GET_ALL_FILE_BLOCKS_W_STORAGE if with_storage \
+                else SQL_GET_ALL_FILE_BLOCKS
 
         else:
-            query = SQL_GET_FILE_BLOCKS
+            query = SQL_GET_FILE_BLOCKS_W_STORAGE if with_storage \
+                else SQL_GET_FILE_BLOCKS
 
             args.update({
                 'limit': self._determine_limit(limit),
@@ -795,58 +1221,98 @@ class SqliteStorageDriver(MetadataStorageDriver):
 
         query_res = self._conn.execute(query, args)
 
-        return [(row[0], row[1]) for row in query_res]
+        if with_storage:
+            return [(_unpack_block_id(row[0]), row[1],
+                     None if row[2] is None else str(row[2]), row[3])
+                    for row in query_res]
 
-    def assign_block(self, vault_id, file_id, block_id, offset):
-        # TODO(jdp): tweak this to support multiple assignments
+        return [(_unpack_block_id(row[0]), row[1]) for row in query_res]
+
+    def _add_file_coverage(self, vault_id, file_id, block_ids, offsets):
+        """Adds newly assigned blocks to the coverage summary of
+        the file"""
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'fileid': file_id,
-            'blockid': block_id,
-            'offset': offset
+            'fileid': _pack_file_id(file_id)
         }
 
-        self._conn.execute(SQL_ASSIGN_BLOCK_TO_FILE, args)
+        res = list(self._conn.execute(SQL_GET_FILE_COVERAGE, args))
 
-        del args['fileid']
-        del args['offset']
-        self._conn.execute(SQL_UPDATE_REF_TIME, args)
+        if len(res) == 0 or res[0][0] is None:
+            return
 
-        self._conn.commit()
+        sizes = dict(self._query_block_ids(SQL_GET_BLOCK_SIZES, vault_id,
+                                           block_ids))
 
-    def assign_blocks(self, vault_id, file_id, block_ids, offsets):
-        # TODO(jdp): tweak this to support multiple assignments
+        args['coverage'] = self._update_file_coverage(res[0][0], [
+            (offset, sizes.get(block_id))
+            for block_id, offset in zip(block_ids, offsets)])
 
-        for block_id, offset in zip(block_ids, offsets):
-            args = {
-                'projectid': deuce.context.project_id,
-                'vaultid': vault_id,
-                'fileid': file_id,
-                'blockid': block_id,
-                'offset': offset
-            }
+        self._conn.execute(SQL_SET_FILE_COVERAGE, args)
+
+    def assign_block(self, vault_id, file_id, block_id, offset):
+        # TODO(jdp): tweak this to support multiple assignments
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'fileid': _pack_file_id(file_id),
+            'blockid': _pack_block_id(block_id),
+            'offset': offset
+        }
 
-            self._conn.execute(SQL_ASSIGN_BLOCK_TO_FILE, args)
+        with self._transaction() as conn:
+            conn.execute(SQL_ASSIGN_BLOCK_TO_FILE, args)
+            self._add_file_coverage(vault_id, file_id, [block_id], [offset])
 
             del args['fileid']
             del args['offset']
-            self._conn.execute(SQL_UPDATE_REF_TIME, args)
+            conn.execute(SQL_UPDATE_REF_TIME, args)
 
-            self._conn.commit()
+    def assign_blocks(self, vault_id, file_id, block_ids, offsets):
+        packed_file_id = _pack_file_id(file_id)
+
+        args = [{
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'fileid': packed_file_id,
+            'blockid': _pack_block_id(block_id),
+            'offset': offset
+        } for block_id, offset in zip(block_ids, offsets)]
+
+        # All the assignments and reference time updates of the
+        # manifest are written in a single transaction
+        with self._transaction() as conn:
+            conn.executemany(SQL_ASSIGN_BLOCK_TO_FILE, args)
+            conn.executemany(SQL_UPDATE_REF_TIME, args)
+            self._add_file_coverage(vault_id, file_id, block_ids, offsets)
 
     def register_block(self, vault_id, block_id, storage_id, blocksize):
         if not self.has_block(vault_id, block_id, check_status=True):
             args = {
                 'projectid': deuce.context.project_id,
                 'vaultid': vault_id,
-                'blockid': block_id,
+                'blockid': _pack_block_id(block_id),
                 'blocksize': int(blocksize),
                 'storageid': storage_id
             }
 
-            self._conn.execute(SQL_REGISTER_BLOCK, args)
-            self._conn.commit()
+            with self._transaction() as conn:
+                conn.execute(SQL_REGISTER_BLOCK, args)
+
+    def register_blocks(self, vault_id, blocks):
+        # The check for an existing valid block is folded into the
+        # insert, so the whole batch is a single transaction
+        args = [{
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'blockid': _pack_block_id(block_id),
+            'blocksize': int(blocksize),
+            'storageid': storage_id
+        } for block_id, storage_id, blocksize in blocks]
+
+        with self._transaction() as conn:
+            conn.executemany(SQL_REGISTER_BLOCK_IF_MISSING, args)
 
     def unregister_block(self, vault_id, block_id):
 
@@ -855,18 +1321,18 @@ class SqliteStorageDriver(MetadataStorageDriver):
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'blockid': block_id
+            'blockid': _pack_block_id(block_id)
         }
 
-        self._conn.execute(SQL_UNREGISTER_BLOCK, args)
-        self._conn.commit()
+        with self._transaction() as conn:
+            conn.execute(SQL_UNREGISTER_BLOCK, args)
 
     def get_block_ref_count(self, vault_id, block_id):
 
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'blockid': block_id
+            'blockid': _pack_block_id(block_id)
         }
 
         query_res = self._conn.execute(SQL_GET_BLOCK_REF_COUNT, args)
@@ -880,14 +1346,14 @@ class SqliteStorageDriver(MetadataStorageDriver):
         args = {
             'projectid': deuce.context.project_id,
             'vaultid': vault_id,
-            'blockid': block_id
+            'blockid': _pack_block_id(block_id)
         }
 
         query_res = self._conn.execute(SQL_GET_REF_TIME, args)
 
         try:
             return next(query_res)[0]
-        except:
+        except Exception:
             return 0
 
     def get_health(self):
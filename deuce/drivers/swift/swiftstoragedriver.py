@@ -11,8 +11,6 @@ from deuce.util import log
 logger = log.getLogger(__name__)
 from swiftclient.exceptions import ClientException
 
-from six import BytesIO
-
 import deuce
 
 
@@ -136,6 +134,36 @@ class SwiftStorageDriver(BlockStorageDriver):
         except ClientException:
             return (False, '')
 
+    def store_block_stream(self, vault_id, metadata_block_id, blockstream,
+                           block_length):
+        mdhash = hashlib.md5()
+
+        # NOTE: The MD5 cannot be known before the upload starts, so
+        # the Etag Swift returns is compared against the hash of the
+        # chunks that were actually sent instead
+        def chunks():
+            for chunk in iter(lambda: blockstream.read(self.stream_chunk_size),
+                              b''):
+                mdhash.update(chunk)
+                yield chunk
+
+        try:
+            response = dict()
+            storage_id = self.storage_id(metadata_block_id)
+            ret_etag = self.Conn.put_object(
+                url=deuce.context.openstack.swift.storage_url,
+                token=deuce.context.openstack.auth_token,
+                container=vault_id,
+                name=storage_id,
+                contents=chunks(),
+                content_length=str(block_length),
+                etag=None,
+                response_dict=response)
+            return (response['status'] == 201
+                    and ret_etag == mdhash.hexdigest(), storage_id)
+        except ClientException:
+            return (False, '')
+
     def store_async_block(self, vault_id, metadata_block_ids, blockdatas):
         try:
             response = dict()
@@ -184,45 +212,43 @@ class SwiftStorageDriver(BlockStorageDriver):
 
     def get_block_obj(self, vault_id, storage_block_id):
 
-        buff = BytesIO()
-        response = dict()
-
         try:
-            # NOTE(TheSriram): block is a tuple of
-            # headers and response body.
-            block = self.Conn.get_object(
+            # NOTE: The object is streamed from Swift as it is read,
+            # the caller must close it to release the connection
+            return self.Conn.get_object_stream(
                 url=deuce.context.openstack.swift.storage_url,
                 token=deuce.context.openstack.auth_token,
                 container=vault_id,
                 name=str(storage_block_id),
-                response_dict=response)
-
-            if response['status'] >= 200 and response['status'] < 300:
-                buff.write(block[1])
-                buff.seek(0)
-                return buff
-            else:
-                return None
+                chunk_size=self.stream_chunk_size)
 
         except ClientException:
             return None
 
+    def get_blocks_data(self, vault_id, storage_block_ids):
+
+        try:
+            # NOTE: The blocks are all fetched from Swift concurrently
+            return self.Conn.get_async_object(
+                url=deuce.context.openstack.swift.storage_url,
+                token=deuce.context.openstack.auth_token,
+                container=vault_id,
+                names=[str(storage_block_id)
+                       for storage_block_id in storage_block_ids])
+
+        except ClientException:
+            return [None] * len(storage_block_ids)
+
     def get_block_object_length(self, vault_id, storage_block_id):
         """Returns the length of an object"""
-        response = dict()
         try:
-            # NOTE(TheSriram): block is a tuple of
-            # headers and response body
-            block = \
-                self.Conn.get_object(
-                    url=deuce.context.openstack.swift.storage_url,
-                    token=deuce.context.openstack.auth_token,
-                    container=vault_id,
-                    name=str(storage_block_id),
-                    response_dict=response)
-
-            return len(block[1]) if (response['status'] >= 200
-                                     and response['status'] < 300) else 0
+            # NOTE: Only the object's headers are retrieved,
+            # not the object itself
+            return self.Conn.head_object_length(
+                url=deuce.context.openstack.swift.storage_url,
+                token=deuce.context.openstack.auth_token,
+                container=vault_id,
+                name=str(storage_block_id))
 
         except ClientException:
             return 0
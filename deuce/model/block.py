@@ -36,8 +36,16 @@ class Block(object):
             self.vault_id, self.metadata_block_id)
 
     def get_block_length(self):
-        """Returns the length of this block from storage
+        """Returns the length of this block. The length recorded in
+        metadata is used when there is one, only blocks unknown to
+        metadata are measured in storage
         """
+        if self.metadata_block_id is not None:
+            info = deuce.metadata_driver.get_block_info(
+                self.vault_id, self.metadata_block_id)
+            if info is not None:
+                return info['blocksize']
+
         storage_id = self.get_storage_id()
         return deuce.storage_driver.get_block_object_length(
             self.vault_id, storage_id)
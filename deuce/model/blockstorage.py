@@ -53,11 +53,9 @@ class BlockStorage(object):
 
     def head_block(self, storage_block_id):
 
-        # this gets the block from storage so it's verified there
-        block = self.get_block(storage_block_id)
-
         # Block doesn't exist in storage
-        if block is None:
+        if not deuce.storage_driver.block_exists(self.vault_id,
+                                                 storage_block_id):
             logger.debug('Unable to locate block {0}'.format(
                 storage_block_id))
             return None
@@ -76,15 +74,17 @@ class BlockStorage(object):
             'orphaned': True,
         }
 
+        metadata_block_id = self.get_metadata_id(storage_block_id)
+        info = self.Vault.get_block_info(metadata_block_id) \
+            if metadata_block_id is not None else None
+
         # Block exists in some form...
-        if block.metadata_block_id is not None:
+        if info is not None:
             # Block Exists in Metadata and storage
-            storage_block_info['reference']['count'] = \
-                block.get_ref_count()
-            storage_block_info['reference']['modified'] = \
-                block.get_ref_modified()
-            storage_block_info['id']['metadata'] = block.metadata_block_id
-            storage_block_info['length'] = block.get_block_length()
+            storage_block_info['reference']['count'] = info['refcount']
+            storage_block_info['reference']['modified'] = info['reftime']
+            storage_block_info['id']['metadata'] = metadata_block_id
+            storage_block_info['length'] = info['blocksize']
             storage_block_info['orphaned'] = False
 
         else:
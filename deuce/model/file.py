@@ -1,3 +1,10 @@
+import collections
+
+
+# The length and the blocks of a finalized file. The blocks are
+# (block_id, offset, storage_id, size) in offset order
+FileManifest = collections.namedtuple('FileManifest', ['length', 'blocks'])
+
 
 class File(object):
 
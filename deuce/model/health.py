@@ -1,8 +1,13 @@
 import deuce
+from deuce.model.vault import manifest_cache
 
 
 class Health(object):
 
     @staticmethod
     def health():
-        return deuce.metadata_driver.get_health()
+        stats = manifest_cache.stats()
+
+        return deuce.metadata_driver.get_health() + [
+            'manifest cache: {0} hits, {1} misses, {2} files'.format(
+                stats['hits'], stats['misses'], stats['entries'])]
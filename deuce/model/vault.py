@@ -1,17 +1,36 @@
 from deuce.model.block import Block
-from deuce.model.file import File
+from deuce.model.file import File, FileManifest
 from deuce.model.exceptions import ConsistencyError
 from deuce.util import log as logging
+from deuce.util import DigestStream
+from deuce.util import FileCat
+from deuce.util import LRUCache
+from deuce.util import executors
 from deuce import conf
 
 import deuce
 import uuid
 import hashlib
+import threading
 
 
 logger = logging.getLogger(__name__)
 
 
+def _sha1_hexdigest(blockdata):
+    return hashlib.sha1(blockdata).hexdigest()
+
+
+# The blocks of a finalized file never change, so the manifests
+# recorded for recently read files are kept in memory. The cache
+# is bounded by the total number of blocks held. It is local to
+# each process, so a file deleted through another process is still
+# served until its manifest expires
+manifest_cache = LRUCache(conf.api_configuration.manifest_cache_blocks,
+                          sizeof=lambda manifest: len(manifest.blocks) + 1,
+                          ttl=conf.api_configuration.manifest_cache_ttl)
+
+
 class Vault(object):
 
     @staticmethod
@@ -58,36 +77,108 @@ class Vault(object):
 
         return vault_stats
 
-    def put_block(self, block_id, blockdata, data_len):
-
+    def _verify_block(self, block_id, reader, data_len):
         # Validate the hash of the block data against block_id
-        if hashlib.sha1(blockdata).hexdigest() != block_id:
+        if reader.hexdigest() != block_id:
             raise ValueError('Invalid Hash Value in the block ID')
 
-        actual_block_length = len(blockdata)
-        if actual_block_length != data_len:
+        if reader.bytes_read != data_len:
             raise BufferError(
                 'Specified block length ({0}) does not match '
                 'actual block length ({1})'.format(
-                    data_len, actual_block_length))
+                    data_len, reader.bytes_read))
 
-        retval, storage_id = deuce.storage_driver.store_block(
-            self.id, block_id, blockdata)
+    def put_block(self, block_id, blockstream, data_len):
 
-        if retval:
-            deuce.metadata_driver.register_block(
-                self.id, block_id, storage_id, data_len)
+        # The block data is hashed as it is streamed through to
+        # storage so that only a single chunk of it is ever in memory
+        reader = DigestStream(blockstream, limit=data_len)
+
+        # If the vault already has a valid copy of the block then the
+        # data is only verified, and not written to storage again
+        if self.has_valid_block(block_id):
+            chunk_size = deuce.storage_driver.stream_chunk_size
+            for _ in iter(lambda: reader.read(chunk_size), b''):
+                pass
+
+            self._verify_block(block_id, reader, data_len)
+
+            return (True, self._get_storage_id(block_id), True)
 
-        return (retval, storage_id)
+        retval, storage_id = deuce.storage_driver.store_block_stream(
+            self.id, block_id, reader, data_len)
+
+        if not retval:
+            return (retval, storage_id, False)
+
+        try:
+            self._verify_block(block_id, reader, data_len)
+
+        except (ValueError, BufferError):
+            # The data has already been written, so roll it back
+            deuce.storage_driver.delete_block(self.id, storage_id)
+            raise
+
+        deuce.metadata_driver.register_block(
+            self.id, block_id, storage_id, data_len)
+
+        return (retval, storage_id, False)
 
     def put_async_block(self, block_ids, blockdatas):
+        """Stores a batch of blocks. Blocks the vault already has a
+        valid copy of are not written to storage again, their IDs
+        are returned alongside the status of the batch"""
         block_ids = [block_id.decode() for block_id in block_ids]
-        block_sizes = [len(block_data) for block_data in blockdatas]
 
-        # Validate the hash of the block data against block_id
-        for block_id, blockdata in zip(block_ids, blockdatas):
-            if hashlib.sha1(blockdata).hexdigest() != block_id:
-                raise ValueError('Invalid Hash Value in the block ID')
+        # Validate the hash of the block data against block_id. The
+        # blocks are hashed in parallel on the shared hashing executor
+        executor = executors.get_executor(
+            'hashing', conf.api_configuration.hashing_workers)
+        digests = [executor.submit(_sha1_hexdigest, blockdata)
+                   for blockdata in blockdatas]
+
+        missing_ids = set(deuce.metadata_driver.has_blocks(
+            self.id, block_ids, check_status=True))
+
+        verified_ids = []
+        verified_datas = []
+        deduplicated_ids = []
+
+        try:
+            for index, (block_id, blockdata, digest) in enumerate(
+                    zip(block_ids, blockdatas, digests)):
+
+                # Note: Any blocks already stored are left to the
+                # Validation and Clean-Up Service, see _store_blocks()
+                if digest.result() != block_id:
+                    raise ValueError('Invalid Hash Value in the block ID')
+
+                if block_id in missing_ids:
+                    verified_ids.append(block_id)
+                    verified_datas.append(blockdata)
+                else:
+                    deduplicated_ids.append(block_id)
+
+                # Store the blocks verified so far while the
+                # remaining blocks are still being hashed
+                if verified_ids and (index + 1 == len(digests) or
+                                     not digests[index + 1].done()):
+
+                    if not self._store_blocks(verified_ids,
+                                              verified_datas):
+                        return (False, deduplicated_ids)
+
+                    verified_ids = []
+                    verified_datas = []
+
+        finally:
+            for digest in digests:
+                digest.cancel()
+
+        return (True, deduplicated_ids)
+
+    def _store_blocks(self, block_ids, blockdatas):
+        block_sizes = [len(block_data) for block_data in blockdatas]
 
         retval, storage_ids = deuce.storage_driver.store_async_block(
             self.id,
@@ -104,18 +195,54 @@ class Vault(object):
             # because '1' failed to be stored, then the entire list is
             # improperly shifted and we incorrectly report which blocks were
             # saved, thus corrupting the data
-            for block_id, storageid, blockdata, block_size in zip(block_ids,
-                                                                  storage_ids,
-                                                                  blockdatas,
-                                                                  block_sizes):
-                deuce.metadata_driver.register_block(
-                    self.id,
-                    block_id,
-                    storageid,
-                    block_size)
+            deuce.metadata_driver.register_blocks(
+                self.id,
+                list(zip(block_ids, storage_ids, block_sizes)))
 
         return retval
 
+    def put_async_block_stream(self, blocks):
+        """Stores blocks from an iterable of (block_id, blockdata)
+        pairs. Blocks are handed to storage in batches as soon as
+        max_inflight_bytes worth of them have been received, so
+        the upload as a whole is never held in memory
+
+        :returns: The status of the upload and the IDs of the blocks
+            that were deduplicated rather than stored
+        """
+        max_inflight_bytes = conf.api_configuration.max_inflight_bytes
+
+        block_ids = []
+        blockdatas = []
+        inflight_bytes = 0
+        deduplicated_ids = []
+
+        for block_id, blockdata in blocks:
+            block_ids.append(block_id)
+            blockdatas.append(blockdata)
+            inflight_bytes += len(blockdata)
+
+            if inflight_bytes >= max_inflight_bytes:
+                retval, batch_deduplicated_ids = self.put_async_block(
+                    block_ids, blockdatas)
+                deduplicated_ids.extend(batch_deduplicated_ids)
+
+                if not retval:
+                    return (False, deduplicated_ids)
+
+                block_ids = []
+                blockdatas = []
+                inflight_bytes = 0
+
+        if block_ids:
+            retval, batch_deduplicated_ids = self.put_async_block(
+                block_ids, blockdatas)
+            deduplicated_ids.extend(batch_deduplicated_ids)
+
+            return (retval, deduplicated_ids)
+
+        return (True, deduplicated_ids)
+
     def get_blocks(self, marker, limit):
         gen = deuce.metadata_driver.create_block_generator(
             self.id, marker=marker, limit=limit)
@@ -129,19 +256,49 @@ class Vault(object):
         if self._meta_has_block(block_id):
             if check_storage:
                 if not self._storage_has_block(block_id):
-
-                    # Record in metadata that the block is bad
-                    deuce.metadata_driver.mark_block_as_bad(
-                        self.id, block_id)
-
-                    raise ConsistencyError(deuce.context.project_id,
-                                           self.id, block_id,
-                                           msg='Block does not exist'
-                                               ' in Block Storage')
+                    self._missing_from_storage(block_id)
             return True
         else:
             return False
 
+    def get_block_info(self, block_id, check_storage=False):
+        """Returns the metadata of a block, see
+        MetadataStorageDriver.get_block_info(). If the block
+        does not exist, None is returned
+
+        :param check_storage: Also check that the block exists
+            in block storage
+        :raises ConsistencyError: if check_storage is set and the
+            block is missing from block storage
+        """
+        info = deuce.metadata_driver.get_block_info(self.id, block_id)
+
+        if info is not None and check_storage:
+            if not self._storage_has_block(block_id, info['storageid']):
+                self._missing_from_storage(block_id)
+
+        return info
+
+    def _missing_from_storage(self, block_id):
+        # Record in metadata that the block is bad
+        deuce.metadata_driver.mark_block_as_bad(self.id, block_id)
+
+        project_id = deuce.context.project_id
+        manifest_cache.invalidate_if(
+            lambda key, manifest: key[:2] == (project_id, self.id) and
+            any(block[0] == block_id for block in manifest.blocks))
+
+        raise ConsistencyError(deuce.context.project_id,
+                               self.id, block_id,
+                               msg='Block does not exist'
+                                   ' in Block Storage')
+
+    def has_valid_block(self, block_id):
+        """Returns True if the block is registered in metadata
+        and has not been marked as bad"""
+        return deuce.metadata_driver.has_block(self.id, block_id,
+                                               check_status=True)
+
     def reset_block_status_marker(self, marker):
         return deuce.metadata_driver.reset_block_status(self.id,
                 marker=marker)
@@ -155,24 +312,139 @@ class Vault(object):
             else:
                 break
 
-    def _storage_has_block(self, block_id):
+    def _storage_has_block(self, block_id, storage_id=None):
         return deuce.storage_driver.block_exists(self.id,
-            self._get_storage_id(block_id))
+            storage_id or self._get_storage_id(block_id))
 
     def _meta_has_block(self, block_id):
         return deuce.metadata_driver.has_block(self.id, block_id)
 
-    def get_block(self, block_id):
-        storage_id = self._get_storage_id(block_id)
+    def get_block(self, block_id, storage_id=None):
+        storage_id = storage_id or self._get_storage_id(block_id)
         obj = deuce.storage_driver.get_block_obj(self.id, storage_id)
 
         return Block(self.id, block_id, obj) if obj else None
 
-    def get_blocks_generator(self, block_ids):
-        storage_ids = [
-            self._get_storage_id(block_id) for block_id in block_ids]
-        return deuce.storage_driver.create_blocks_generator(
-            self.id, storage_ids)
+    def get_blocks_generator(self, block_ids, storage_ids=None,
+                             block_sizes=None):
+        """Returns a generator of (storage_id, data) for each of the
+        blocks, in order. The data is None for blocks missing from
+        storage.
+
+        Blocks are read from storage in windows, and the next window
+        is already being read while the blocks of the current one are
+        yielded. The two windows together hold at most prefetch_depth
+        blocks and, where the sizes of the blocks are known,
+        prefetch_max_bytes bytes. The storage ids are resolved in a
+        single batch unless the caller already has them"""
+        if storage_ids is None:
+            storage_ids = deuce.metadata_driver.get_block_storage_ids(
+                self.id, block_ids)
+
+        if block_sizes is None:
+            block_sizes = [0] * len(storage_ids)
+
+        executor = executors.get_executor(
+            'prefetch', conf.api_configuration.prefetch_workers)
+
+        # deuce.context is local to the request thread, the executor
+        # threads are handed a copy of it
+        context = dict(vars(deuce.context))
+
+        pending = None
+        fetching = None
+
+        try:
+            for window in self._block_windows(storage_ids, block_sizes):
+                fetching = executor.submit(self._read_blocks_in_context,
+                                           context, window)
+
+                if pending is not None:
+                    for item in pending.result():
+                        yield item
+
+                pending, fetching = fetching, None
+
+            if pending is not None:
+                for item in pending.result():
+                    yield item
+
+        finally:
+            # The client may stop reading before the end of the file,
+            # while the next window is already being read
+            for future in (pending, fetching):
+                if future is not None:
+                    future.cancel()
+
+    def _block_windows(self, storage_ids, block_sizes):
+        """Splits the storage ids into the windows read by
+        get_blocks_generator(), each holding half of the blocks and
+        bytes allowed in flight. A window always holds at least one
+        block, however large"""
+        window_depth = max(conf.api_configuration.prefetch_depth // 2, 1)
+        window_max_bytes = conf.api_configuration.prefetch_max_bytes // 2
+
+        window = []
+        window_bytes = 0
+
+        for storage_id, block_size in zip(storage_ids, block_sizes):
+            block_size = block_size or 0
+
+            if window and (len(window) == window_depth or
+                           window_bytes + block_size > window_max_bytes):
+                yield window
+
+                window = []
+                window_bytes = 0
+
+            window.append(storage_id)
+            window_bytes += block_size
+
+        if window:
+            yield window
+
+    def open_file_blocks(self, blocks):
+        """Returns a seekable file-like object over the blocks of a
+        file, given as (block_id, offset, storage_id, size) in offset
+        order. Only the blocks that are actually read from are
+        fetched from storage
+
+        :raises ValueError: if the size of a block is unknown
+        :raises IOError: on read, if a block is missing from storage
+        """
+        def opener(storage_id):
+            def open_block():
+                obj = deuce.storage_driver.get_block_obj(self.id, storage_id)
+                if obj is None:
+                    raise IOError('Storage block {0} is missing '
+                                  'from storage'.format(storage_id))
+                return obj
+            return open_block
+
+        segments = []
+
+        for block_id, offset, storage_id, size in blocks:
+            # Without its size the block cannot be placed in the file
+            if size is None:
+                raise ValueError('Size of block {0} is '
+                                 'unknown'.format(block_id))
+
+            segments.append((offset, size, opener(storage_id)))
+
+        return FileCat(segments)
+
+    def _read_blocks(self, storage_ids):
+        datas = deuce.storage_driver.get_blocks_data(self.id, storage_ids)
+        return zip(storage_ids, datas)
+
+    def _read_blocks_in_context(self, context, storage_ids):
+        """Reads the blocks on an executor thread, within a copy
+        of the context of the request"""
+        if isinstance(deuce.context, threading.local):
+            vars(deuce.context).clear()
+            vars(deuce.context).update(context)
+
+        return list(self._read_blocks(storage_ids))
 
     def delete_block(self, vault_id, block_id):
         storage_id = self._get_storage_id(block_id)
@@ -206,6 +478,42 @@ class Vault(object):
 
         return File(self.id, file_id, finalized=data[0])
 
+    def _manifest_key(self, file_id):
+        return (deuce.context.project_id, self.id, file_id)
+
+    def get_file_manifest(self, file_id):
+        """Returns the FileManifest of a finalized file, from the
+        manifest cache when possible. None is returned if the file
+        does not exist or has not been finalized"""
+        key = self._manifest_key(file_id)
+        manifest = manifest_cache.get(key)
+
+        if manifest is not None:
+            return manifest
+
+        blocks = deuce.metadata_driver.get_file_manifest(self.id, file_id)
+
+        if blocks is not None:
+            manifest = FileManifest(length=self.get_file_length(file_id),
+                                    blocks=blocks)
+            manifest_cache.put(key, manifest)
+            return manifest
+
+        # Some of the blocks of the file are marked as bad, they are
+        # looked up but not cached as their storage ids may change
+        # once they are stored again
+        f = self.get_file(file_id)
+
+        if f is None or not f.finalized:
+            return None
+
+        block_gen = deuce.metadata_driver.create_file_block_generator(
+            self.id, file_id, with_storage=True)
+
+        return FileManifest(
+            length=self.get_file_length(file_id),
+            blocks=sorted(block_gen, key=lambda block: block[1]))
+
     def get_file_length(self, file_id):
         return deuce.metadata_driver.file_length(self.id, file_id)
 
@@ -213,7 +521,12 @@ class Vault(object):
         succ = deuce.storage_driver.delete_vault(self.id)
         if succ:
             deuce.metadata_driver.delete_vault(self.id)
+
+            project_id = deuce.context.project_id
+            manifest_cache.invalidate_if(
+                lambda key, manifest: key[:2] == (project_id, self.id))
         return succ
 
     def delete_file(self, file_id):
+        manifest_cache.invalidate(self._manifest_key(file_id))
         return deuce.metadata_driver.delete_file(self.id, file_id)
@@ -5,6 +5,7 @@
 #
 # Or from a mocking package...
 
+from mongomock.collection import Collection
 from mongomock.connection import Connection
 
 
@@ -23,3 +24,52 @@ class Mock_Connection(Connection):
 
 def MongoClient(url):
     return Mock_Connection()
+
+
+class Mock_BulkOperationBuilder(object):
+    """The unordered bulk upserts of pymongo 2.7, which mongomock
+    lacks. Only the $setOnInsert updates the driver makes are
+    supported"""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._upserts = []
+
+    def find(self, selector):
+        return Mock_BulkUpsertOperation(self, selector)
+
+    def execute(self):
+        upserted = []
+
+        for index, (selector, document) in enumerate(self._upserts):
+            if self._collection.find_one(selector) is None:
+                doc = dict(selector)
+                doc.update(document['$setOnInsert'])
+                upserted.append({'index': index,
+                                 '_id': self._collection.insert(doc)})
+
+        return {
+            'nInserted': 0,
+            'nUpserted': len(upserted),
+            'nMatched': len(self._upserts) - len(upserted),
+            'nModified': 0,
+            'nRemoved': 0,
+            'upserted': upserted
+        }
+
+
+class Mock_BulkUpsertOperation(object):
+
+    def __init__(self, bulk, selector):
+        self._bulk = bulk
+        self._selector = selector
+
+    def upsert(self):
+        return self
+
+    def update_one(self, document):
+        self._bulk._upserts.append((self._selector, document))
+
+
+Collection.initialize_unordered_bulk_op = \
+    lambda self: Mock_BulkOperationBuilder(self)
@@ -181,11 +181,17 @@ def put_object(url,
 
     path = _get_block_path(container, name)
 
-    with open(path, 'wb') as outfile:
-        outfile.write(contents)
+    # contents may either be the block data or
+    # a generator of chunks of the block data
+    if isinstance(contents, bytes):
+        contents = [contents]
 
     mdhash = hashlib.md5()
-    mdhash.update(contents)
+    with open(path, 'wb') as outfile:
+        for chunk in contents:
+            outfile.write(chunk)
+            mdhash.update(chunk)
+
     response_dict['status'] = 201
     return mdhash.hexdigest()
 
@@ -228,6 +234,18 @@ def head_object(url,
     return 'mocking_ret'
 
 
+# Block Length
+def head_object_length(url,
+            token,
+            container,
+            name):
+
+    path = _get_block_path(container, name)
+    if not os.path.exists(path):
+        raise ClientException('mocking')
+    return os.path.getsize(path)
+
+
 # Delete Block
 def delete_object(url,
             token,
@@ -283,6 +301,47 @@ def get_object(url,
     return hdrs, buff
 
 
+def get_object_stream(url,
+            token,
+            container,
+            name,
+            chunk_size):
+
+    path = _get_block_path(container, name)
+
+    if not os.path.exists(path):
+        raise ClientException('mocking')
+
+    status = _mock_status_code()
+    if status < 200 or status >= 300:
+        raise ClientException('mocking')
+
+    return open(path, 'rb')
+
+
+# Get multiple blocks
+def get_async_object(url,
+            token,
+            container,
+            names):
+
+    if not os.path.exists(_get_vault_path(container)):
+        raise ClientException('mocking')
+
+    blocks = []
+
+    for name in names:
+        path = _get_block_path(container, name)
+
+        if os.path.exists(path):
+            with open(path, 'rb') as infile:
+                blocks.append(infile.read())
+        else:
+            blocks.append(None)
+
+    return blocks
+
+
 def get_keystoneclient_2_0(auth_url,
             user,
             key,
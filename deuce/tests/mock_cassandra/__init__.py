@@ -1,6 +1,8 @@
 import deuce.drivers.cassandra.cassandrametadatadriver \
     as actual_driver
+from deuce.tests.mock_cassandra.query import PreparedStatement
 
+import threading
 import uuid
 
 
@@ -43,7 +45,20 @@ class Session(object):
     def __init__(self, conn):
         self.conn = conn
 
+        # Sessions are shared between threads, like cassandra's
+        self._lock = threading.RLock()
+
+    def prepare(self, query):
+        return PreparedStatement(query)
+
     def execute(self, query, queryargs):
+        with self._lock:
+            return self._execute(query, queryargs)
+
+    def _execute(self, query, queryargs):
+        if isinstance(query, PreparedStatement):
+            query = query.query_string
+
         # Health check.
         if 'system.local' in query:
             return 'true'
@@ -95,6 +110,31 @@ class Session(object):
 
             self.conn.execute(insert_query, insert_args)
 
+        elif original_query == actual_driver.CQL_INC_VAULT_STATISTICS:
+
+            # Counters start out at zero, like blockreferences above
+
+            insert_query = """
+                INSERT or IGNORE into vaultstats
+                (projectid, vaultid, files, blocks, bytes, badblocks)
+                VALUES
+                (:projectid, :vaultid, 0, 0, 0, 0)
+            """
+
+            self.conn.execute(insert_query, queryargs)
+
+        elif original_query == actual_driver.CQL_GET_FILES_PER_BLOCKS:
+
+            # sqlite cannot bind a list, each element of the IN
+            # list gets a parameter of its own
+            queryargs = queryargs.copy()
+            blockids = queryargs.pop('blockids')
+            params = ['blockids{0}'.format(i) for i in range(len(blockids))]
+
+            queryargs.update(zip(params, blockids))
+            query = query.replace(':blockids', '({0})'.format(
+                ', '.join(':' + param for param in params)))
+
         elif original_query == actual_driver.CQL_REGISTER_BLOCK:
 
             # Cassandra's inserts by default are upserts, when mocked with
@@ -121,6 +161,20 @@ class Session(object):
             upsert_args = queryargs.copy()
             self.conn.execute(upsert_query, upsert_args)
 
+        elif original_query in [actual_driver.CQL_ADD_BAD_BLOCK,
+                                actual_driver.CQL_ADD_BLOCK_STORAGE,
+                                actual_driver.CQL_ADD_FINALIZED_FILE]:
+
+            # Inserts into the lookup tables are upserts as well
+            query = query.replace('INSERT INTO', 'INSERT OR REPLACE INTO')
+
+        elif 'USING TIMESTAMP :timestamp' in original_query:
+
+            # sqlite has no write times, so the rows written with
+            # an explicit one are plain upserts
+            query = query.replace('USING TIMESTAMP :timestamp', '')
+            query = query.replace('INSERT INTO', 'INSERT OR REPLACE INTO')
+
         elif original_query == actual_driver.CQL_UPDATE_REF_TIME or \
                 original_query == actual_driver.CQL_REGISTER_BLOCK:
 
@@ -128,6 +182,15 @@ class Session(object):
             query = query.replace('unixTimeStampOf(now())',
                                   "strftime('%s', 'now')")
 
+        elif original_query == actual_driver.CQL_UPDATE_FILE_COVERAGE:
+
+            # sqlite has no lightweight transactions, the condition
+            # becomes part of the WHERE clause instead
+            cas_query = query.replace('IF coverage =', 'AND coverage IS')
+            cursor = self.conn.execute(cas_query, queryargs)
+
+            return [(cursor.rowcount == 1,)]
+
         elif original_query == actual_driver.CQL_HEALTH_CHECK:
 
             # neither now() nor system.local are part of sqlite
@@ -1,4 +1,5 @@
 
+import hashlib
 import sqlite3
 import uuid
 import collections
@@ -21,17 +22,45 @@ CREATE TABLE blocks (
   PRIMARY KEY(projectid, vaultid, blockid)
 );
 """, """
+CREATE TABLE blockstorage (
+  projectid TEXT,
+  vaultid TEXT,
+  storageid TEXT,
+  blockid TEXT,
+  PRIMARY KEY(projectid, vaultid, storageid)
+);
+""", """
+CREATE TABLE badblocks (
+  projectid TEXT,
+  vaultid TEXT,
+  blockid TEXT,
+  PRIMARY KEY(projectid, vaultid, blockid)
+);
+""", """
 CREATE TABLE files (
   projectid TEXT,
   vaultid TEXT,
   fileid TEXT,
   size INT,
   finalized BOOLEAN,
+  manifest BLOB,
+  coverage TEXT,
   PRIMARY KEY(projectid, vaultid, fileid)
 );
 """, """
-CREATE INDEX finalized_index
-    on files (finalized);
+CREATE TABLE finalizedfiles (
+  projectid TEXT,
+  vaultid TEXT,
+  fileid TEXT,
+  PRIMARY KEY(projectid, vaultid, fileid)
+);
+""", """
+CREATE TABLE unfinalizedfiles (
+  projectid TEXT,
+  vaultid TEXT,
+  fileid TEXT,
+  PRIMARY KEY(projectid, vaultid, fileid)
+);
 """, """
 CREATE TABLE fileblocks (
   projectid TEXT,
@@ -48,7 +77,7 @@ CREATE TABLE blockfiles (
   vaultid TEXT,
   fileid TEXT,
   blockid TEXT,
-  PRIMARY KEY(projectid, vaultid, fileid, blockid)
+  PRIMARY KEY(projectid, vaultid, blockid, fileid)
 );
 """, """
 CREATE TABLE blockreferences (
@@ -58,18 +87,40 @@ CREATE TABLE blockreferences (
   refcount INTEGER,
   PRIMARY KEY(projectid, vaultid, blockid)
 );
+""", """
+CREATE TABLE vaultstats (
+  projectid TEXT,
+  vaultid TEXT,
+  files INTEGER,
+  blocks INTEGER,
+  bytes INTEGER,
+  badblocks INTEGER,
+  PRIMARY KEY(projectid, vaultid)
+);
 """]
 
 from deuce.tests.mock_cassandra import Session
 
 
+def _token(*values):
+    # A signed 64-bit token, like the ones of the Murmur3Partitioner
+    digest = hashlib.md5('/'.join(values).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
 class Cluster(object):
 
-    def __init__(self, contact_points, auth_provider, ssl_options):
+    def __init__(self, contact_points, auth_provider, ssl_options,
+                 load_balancing_policy):
         # Create the mock driver in memory only
-        self._sqliteconn = sqlite3.connect(':memory:')
+        self._sqliteconn = sqlite3.connect(':memory:',
+                                           check_same_thread=False)
         self.cluster_contact_points = contact_points
 
+        # The token and write time functions of cassandra
+        self._sqliteconn.create_function('token', -1, _token)
+        self._sqliteconn.create_function('writetime', 1, lambda value: 0)
+
         for stmt in MOCK_CASSANDRA_SCHEMA:
             self._sqliteconn.execute(stmt)
 
@@ -0,0 +1,9 @@
+
+class RoundRobinPolicy(object):
+    pass
+
+
+class TokenAwarePolicy(object):
+
+    def __init__(self, child_policy):
+        self._child_policy = child_policy
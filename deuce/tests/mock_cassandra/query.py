@@ -1,3 +1,6 @@
 
-def SimpleStatement(query, consistency_level):
-    return query
+class PreparedStatement(object):
+
+    def __init__(self, query_string):
+        self.query_string = query_string
+        self.consistency_level = None
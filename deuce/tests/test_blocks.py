@@ -159,6 +159,37 @@ class TestBlocksController(ControllerTest):
         response = self.simulate_put(path, headers=headers, body=data)
         self.assertEqual(self.srmock.status, falcon.HTTP_412)
 
+    @ddt.data(True, False)
+    def test_put_invalid_data_rolls_back(self, bad_hash):
+        import deuce
+
+        # Either the hash or the length of the data is wrong,
+        # in which case the block is removed from storage again
+        data = os.urandom(100)
+        if bad_hash:
+            blockid = self.calc_sha1(os.urandom(100))
+            blocklen = 100
+        else:
+            blockid = self.calc_sha1(data)
+            blocklen = 200
+
+        path = self.get_block_path(self.vault_name, blockid)
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(blocklen),
+        }
+        headers.update(self._hdrs)
+
+        with patch.object(deuce.storage_driver, 'delete_block',
+                          wraps=deuce.storage_driver.delete_block) \
+                as delete_block:
+            response = self.simulate_put(path, headers=headers, body=data)
+            self.assertEqual(self.srmock.status, falcon.HTTP_412)
+            self.assertTrue(delete_block.called)
+
+        response = self.simulate_head(path, headers=self._hdrs)
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
+
     def test_put_happy_case(self):
 
         block_list = self.helper_create_blocks(num_blocks=1)
@@ -169,6 +200,164 @@ class TestBlocksController(ControllerTest):
         self.assertIn('x-block-id', self.srmock.headers_dict)
         self.assertEqual(block_list[0], self.srmock.headers_dict['x-block-id'])
         self.assertNotEqual(0, self.srmock.headers_dict['x-storage-id'])
+        self.assertEqual('False',
+                         self.srmock.headers_dict['x-block-deduplicated'])
+
+    def test_put_deduplicated(self):
+        import deuce
+
+        data = os.urandom(100)
+        blockid = self.calc_sha1(data)
+
+        path = self.get_block_path(self.vault_name, blockid)
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(len(data)),
+        }
+        headers.update(self._hdrs)
+
+        response = self.simulate_put(path, headers=headers, body=data)
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+        self.assertEqual('False',
+                         self.srmock.headers_dict['x-block-deduplicated'])
+        storage_id = self.srmock.headers_dict['x-storage-id']
+
+        # The vault already has the block, so it is not stored again
+        with patch.object(deuce.storage_driver, 'store_block_stream') \
+                as store_block_stream:
+            response = self.simulate_put(path, headers=headers, body=data)
+            self.assertEqual(self.srmock.status, falcon.HTTP_201)
+            self.assertEqual('True',
+                             self.srmock.headers_dict['x-block-deduplicated'])
+            self.assertEqual(storage_id,
+                             self.srmock.headers_dict['x-storage-id'])
+
+            # The data of a deduplicated block is still verified
+            response = self.simulate_put(path, headers=headers,
+                                         body=os.urandom(100))
+            self.assertEqual(self.srmock.status, falcon.HTTP_412)
+
+            headers['Content-Length'] = str(len(data) + 1)
+            response = self.simulate_put(path, headers=headers, body=data)
+            self.assertEqual(self.srmock.status, falcon.HTTP_412)
+
+            self.assertFalse(store_block_stream.called)
+
+        # A block marked as bad is stored again
+        deuce.metadata_driver.mark_block_as_bad(self.vault_name, blockid)
+
+        headers['Content-Length'] = str(len(data))
+        response = self.simulate_put(path, headers=headers, body=data)
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+        self.assertEqual('False',
+                         self.srmock.headers_dict['x-block-deduplicated'])
+
+    def test_put_block_removed(self):
+        from deuce.model import Vault
+
+        data = os.urandom(100)
+        blockid = self.calc_sha1(data)
+
+        path = self.get_block_path(self.vault_name, blockid)
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(len(data)),
+        }
+        headers.update(self._hdrs)
+
+        # The block is gone by the time its metadata is looked up
+        with patch.object(Vault, 'get_block_info', return_value=None):
+            response = self.simulate_put(path, headers=headers, body=data)
+            self.assertEqual(self.srmock.status, falcon.HTTP_409)
+
+    def test_get_block_range(self):
+        data = os.urandom(100)
+        blockid = self.calc_sha1(data)
+
+        path = self.get_block_path(self.vault_name, blockid)
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(len(data)),
+        }
+        headers.update(self._hdrs)
+
+        response = self.simulate_put(path, headers=headers, body=data)
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+
+        response = self.simulate_get(path, headers=self._hdrs)
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(self.srmock.headers_dict['accept-ranges'], 'bytes')
+        self.assertEqual(response.read(), data)
+        response.close()
+
+        positive_cases = [
+            ('bytes=10-19', data[10:20]),
+            ('bytes=-30', data[-30:]),
+            ('bytes=90-', data[90:]),
+            ('bytes=0-1000', data),
+        ]
+
+        for value, expected in positive_cases:
+            range_hdrs = self._hdrs.copy()
+            range_hdrs['range'] = value
+            response = self.simulate_get(path, headers=range_hdrs)
+            self.assertEqual(self.srmock.status, falcon.HTTP_206)
+            self.assertEqual(b''.join(response), expected)
+            self.assertEqual(self.srmock.headers_dict['content-length'],
+                             str(len(expected)))
+
+        self.assertEqual(self.srmock.headers_dict['content-range'],
+                         'bytes 0-99/100')
+
+        range_hdrs['range'] = 'bytes=100-'
+        response = self.simulate_get(path, headers=range_hdrs)
+        self.assertEqual(self.srmock.status, falcon.HTTP_416)
+        self.assertEqual(self.srmock.headers_dict['content-range'],
+                         'bytes */100')
+
+    @ddt.data('100-continue', '100-Continue')
+    def test_put_expect_continue(self, expect):
+        import deuce
+
+        data = os.urandom(100)
+        blockid = self.calc_sha1(data)
+
+        path = self.get_block_path(self.vault_name, blockid)
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(len(data)),
+            "Expect": expect,
+        }
+        headers.update(self._hdrs)
+
+        # The block is new, so the body is read and stored
+        response = self.simulate_put(path, headers=headers, body=data)
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+        self.assertEqual('False',
+                         self.srmock.headers_dict['x-block-deduplicated'])
+        storage_id = self.srmock.headers_dict['x-storage-id']
+
+        # The block already exists, so the body is never read
+        with patch.object(Vault, 'put_block') as put_block:
+            response = self.simulate_put(path, headers=headers, body=data)
+            self.assertEqual(self.srmock.status, falcon.HTTP_201)
+            self.assertEqual('True',
+                             self.srmock.headers_dict['x-block-deduplicated'])
+            self.assertEqual(storage_id,
+                             self.srmock.headers_dict['x-storage-id'])
+            self.assertEqual('0',
+                             self.srmock.headers_dict[
+                                 'x-block-reference-count'])
+            self.assertIn('x-ref-modified', self.srmock.headers_dict)
+            self.assertFalse(put_block.called)
+
+        # A block marked as bad has to be sent again
+        deuce.metadata_driver.mark_block_as_bad(self.vault_name, blockid)
+
+        response = self.simulate_put(path, headers=headers, body=data)
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+        self.assertEqual('False',
+                         self.srmock.headers_dict['x-block-deduplicated'])
 
     def test_post_invalid_block_id(self):
         path = self.get_block_path(self.vault_name,
@@ -193,6 +382,18 @@ class TestBlocksController(ControllerTest):
                                       body=request_body)
         self.assertEqual(self.srmock.status, falcon.HTTP_412)
 
+        # Only one of many blocks has an invalid blockid/hash
+        data = [os.urandom(3000) for _ in range(20)]
+        block_list = [self.calc_sha1(d) for d in data]
+        block_list[10] = hashlib.sha1(b'mock').hexdigest()
+        contents = dict(zip(block_list, data))
+
+        request_body = msgpack.packb(contents)
+        response = self.simulate_post(self.get_blocks_path(self.vault_name),
+                                      headers=headers,
+                                      body=request_body)
+        self.assertEqual(self.srmock.status, falcon.HTTP_412)
+
     def test_reset_block_status_non_existent_vault(self):
         path = self.get_blocks_path(self.vault_name)
 
@@ -241,6 +442,94 @@ class TestBlocksController(ControllerTest):
                                       body='non-msgpack')
         self.assertEqual(self.srmock.status, falcon.HTTP_400)
 
+        # Post a truncated request body
+        request_body = msgpack.packb({block_list: data})
+        response = self.simulate_post(path,
+                                      headers=headers,
+                                      body=request_body[:-1])
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+    @ddt.data(1, 1000, 1000000)
+    def test_post_inflight_budget(self, max_inflight_bytes):
+        # Whatever the budget, every block must end up stored
+        orig_max_inflight_bytes = conf.api_configuration.max_inflight_bytes
+        conf.api_configuration.max_inflight_bytes = max_inflight_bytes
+        try:
+            block_list = self.helper_create_blocks(10, async=True,
+                                                   singleblocksize=True)
+        finally:
+            conf.api_configuration.max_inflight_bytes = \
+                orig_max_inflight_bytes
+
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+
+        for block_id in block_list:
+            response = self.simulate_head(
+                self.get_block_path(self.vault_name, block_id),
+                headers=self._hdrs)
+            self.assertEqual(self.srmock.status, falcon.HTTP_204)
+
+    def test_post_inflight_budget_failure(self):
+        from deuce.model import Vault
+
+        # The second batch fails to be stored
+        orig_max_inflight_bytes = conf.api_configuration.max_inflight_bytes
+        conf.api_configuration.max_inflight_bytes = 1
+        try:
+            with patch.object(Vault, 'put_async_block',
+                              side_effect=[(True, []), (False, [])]):
+                self.helper_create_blocks(2, async=True)
+                self.assertEqual(self.srmock.status, falcon.HTTP_500)
+        finally:
+            conf.api_configuration.max_inflight_bytes = \
+                orig_max_inflight_bytes
+
+    def test_post_empty_batch(self):
+        block_list = self.helper_create_blocks(0, async=True)
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+
+    def test_post_deduplicated(self):
+        import deuce
+
+        headers = {
+            "Content-Type": "application/msgpack",
+        }
+        headers.update(self._hdrs)
+
+        data = [os.urandom(100) for _ in range(4)]
+        block_list = [self.calc_sha1(d) for d in data]
+        contents = dict(zip(block_list[:3], data[:3]))
+
+        response = self.simulate_post(self.get_blocks_path(self.vault_name),
+                                      headers=headers,
+                                      body=msgpack.packb(contents))
+        self.assertEqual(self.srmock.status, falcon.HTTP_201)
+        self.assertEqual(json.loads(response[0].decode()), [])
+
+        # Only the block the vault does not have yet is stored
+        contents = dict(zip(block_list, data))
+
+        with patch.object(deuce.storage_driver, 'store_async_block',
+                          wraps=deuce.storage_driver.store_async_block) \
+                as store_async_block:
+            response = self.simulate_post(
+                self.get_blocks_path(self.vault_name),
+                headers=headers,
+                body=msgpack.packb(contents))
+            self.assertEqual(self.srmock.status, falcon.HTTP_201)
+            self.assertEqual(sorted(json.loads(response[0].decode())),
+                             sorted(block_list[:3]))
+
+            stored_ids = [block_id
+                          for call in store_async_block.call_args_list
+                          for block_id in call[0][1]]
+            self.assertEqual(stored_ids, block_list[3:])
+
+        response = self.simulate_head(
+            self.get_block_path(self.vault_name, block_list[3]),
+            headers=self._hdrs)
+        self.assertEqual(self.srmock.status, falcon.HTTP_204)
+
     def test_post_invalid_endpoint(self):
         path = self.get_blocks_path(self.vault_name)
 
@@ -435,7 +724,7 @@ class TestBlocksController(ControllerTest):
         from deuce.model import Vault
         with patch.object(Vault,
                           'put_async_block',
-                          return_value=False):
+                          return_value=(False, [])):
             self.helper_create_blocks(1, async=True)
             self.assertEqual(self.srmock.status, falcon.HTTP_500)
 
@@ -444,7 +733,7 @@ class TestBlocksController(ControllerTest):
         from deuce.model import Vault
 
         with patch.object(deuce.storage_driver,
-                          'store_block',
+                          'store_block_stream',
                           return_value=(False, '')):
             self.helper_create_blocks(1, async=False)
             self.assertEqual(self.srmock.status, falcon.HTTP_500)
@@ -6,6 +6,7 @@ import json
 import uuid
 import os
 from mock import patch
+import deuce
 from deuce.model import Block
 
 from deuce.tests import ControllerTest
@@ -238,7 +239,9 @@ class TestBlockStorageController(ControllerTest):
             "Content-Length": str(size[0]),
         })
 
-        # Upload the block twice, orphaning the second block
+        # Upload the block, then store it a second time directly in
+        # block storage, orphaning the second block. Uploading it twice
+        # would be deduplicated
         upload_first = self.simulate_put(block_path,
                                          headers=upload_headers,
                                          body=data[0])
@@ -246,15 +249,11 @@ class TestBlockStorageController(ControllerTest):
         first_storage_id = self.srmock.headers_dict['x-storage-id']
         first_block_id = self.srmock.headers_dict['x-block-id']
 
-        upload_second = self.simulate_put(block_path,
-                                          headers=upload_headers,
-                                         body=data[0])
-        self.assertEqual(self.srmock.status, falcon.HTTP_201)
-        second_storage_id = self.srmock.headers_dict['x-storage-id']
-        second_block_id = self.srmock.headers_dict['x-block-id']
+        retval, second_storage_id = deuce.storage_driver.store_block(
+            self.vault_name, first_block_id, data[0])
+        self.assertTrue(retval)
 
-        # Verify we got the same block id but different storage ids
-        self.assertEqual(first_block_id, second_block_id)
+        # Verify we got different storage ids
         self.assertNotEqual(first_storage_id, second_storage_id)
 
         # Get the storage id from the orphaned second block
@@ -397,7 +396,9 @@ class TestBlockStorageController(ControllerTest):
             "Content-Length": str(size[0]),
         })
 
-        # Upload the block twice, orphaning the second block
+        # Upload the block, then store it a second time directly in
+        # block storage, orphaning the second block. Uploading it twice
+        # would be deduplicated
         upload_first = self.simulate_put(upload_block_path,
                                          headers=upload_headers,
                                          body=data[0])
@@ -405,15 +406,11 @@ class TestBlockStorageController(ControllerTest):
         first_storage_id = self.srmock.headers_dict['x-storage-id']
         first_block_id = self.srmock.headers_dict['x-block-id']
 
-        upload_second = self.simulate_put(upload_block_path,
-                                          headers=upload_headers,
-                                         body=data[0])
-        self.assertEqual(self.srmock.status, falcon.HTTP_201)
-        second_storage_id = self.srmock.headers_dict['x-storage-id']
-        second_block_id = self.srmock.headers_dict['x-block-id']
+        retval, second_storage_id = deuce.storage_driver.store_block(
+            self.vault_name, first_block_id, data[0])
+        self.assertTrue(retval)
 
-        # Verify we got the same block id but different storage ids
-        self.assertEqual(first_block_id, second_block_id)
+        # Verify we got different storage ids
         self.assertNotEqual(first_storage_id, second_storage_id)
 
         # Get the storage id from the orphaned second block
@@ -475,7 +472,7 @@ class TestBlockStorageController(ControllerTest):
 
     def test_delete_storage_orphaned_block(self):
         block_id = self.create_block_id(b'mock')
-        # NOTE(TheSriram): We put the same block twice, to orphan the second
+        # NOTE(TheSriram): We store the same block twice, to orphan the second
         # block as it will not have a reference in the metadata. But, it will
         # nevertheless be present in block storage
         response = self.simulate_put(self.get_block_path(self.vault_name,
@@ -483,11 +480,8 @@ class TestBlockStorageController(ControllerTest):
                                      headers=self._hdrs,
                                      body=b'mock')
         real_storage_id = self.srmock.headers_dict['x-storage-id']
-        response = self.simulate_put(self.get_block_path(self.vault_name,
-                                                         block_id),
-                                     headers=self._hdrs,
-                                     body=b'mock')
-        orphaned_storage_id = self.srmock.headers_dict['x-storage-id']
+        retval, orphaned_storage_id = deuce.storage_driver.store_block(
+            self.vault_name, block_id, b'mock')
 
         self.assertNotEqual(real_storage_id, orphaned_storage_id)
 
@@ -0,0 +1,90 @@
+import io
+
+from mock import patch
+
+from deuce.drivers.cassandra import CassandraStorageDriver
+from deuce.drivers.cassandra import migrate
+from deuce.tests import V1Base
+
+
+class TestCassandraMigrate(V1Base):
+
+    def setUp(self):
+        super(TestCassandraMigrate, self).setUp()
+
+        self.driver = CassandraStorageDriver()
+        self.vault_id = self.create_vault_id()
+
+        self.block_ids = [self.create_block_id() for _ in range(3)]
+        self.storage_ids = [self.create_storage_block_id()
+                            for _ in self.block_ids]
+        self.file_ids = [self.create_file_id() for _ in range(2)]
+
+        self.driver.register_blocks(self.vault_id, [
+            (block_id, storage_id, 100) for block_id, storage_id in
+            zip(self.block_ids, self.storage_ids)])
+
+        for file_id in self.file_ids:
+            self.driver.create_file(self.vault_id, file_id)
+
+        # Both files reference the bad block
+        self.driver.assign_block(self.vault_id, self.file_ids[0],
+                                 self.block_ids[0], 0)
+        self.driver.assign_blocks(self.vault_id, self.file_ids[1],
+                                  self.block_ids[:2], [0, 100])
+
+        self.driver.finalize_file(self.vault_id, self.file_ids[0], 100)
+        self.driver.mark_block_as_bad(self.vault_id, self.block_ids[0])
+
+        # Start out from the tables as they were before the lookup
+        # tables were introduced
+        for table in ('blockstorage', 'badblocks', 'finalizedfiles',
+                      'unfinalizedfiles', 'blockfiles'):
+            self.driver._session.execute('DELETE FROM {0}'.format(table), {})
+
+    def test_token_ranges(self):
+        ranges = migrate.token_ranges(4)
+
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual(ranges[0][0], migrate.MIN_TOKEN)
+        self.assertEqual(ranges[-1][1], migrate.MAX_TOKEN)
+
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(start, end)
+
+    def test_backfill(self):
+        self.assertEqual(self.driver.vault_health(self.vault_id), (0, 0))
+        self.assertEqual(self.driver.create_file_generator(self.vault_id), [])
+        self.assertEqual(self.driver.create_file_generator(
+            self.vault_id, finalized=False), [])
+
+        counts = migrate.backfill(self.driver, splits=4, workers=2,
+                                  concurrency=2)
+
+        self.assertEqual(counts, dict(blockstorage=3, badblocks=1,
+                                      finalizedfiles=1, unfinalizedfiles=1,
+                                      blockfiles=3))
+
+        for block_id, storage_id in zip(self.block_ids, self.storage_ids):
+            self.assertEqual(self.driver.get_block_metadata_id(
+                self.vault_id, storage_id), block_id)
+
+        self.assertEqual(self.driver.vault_health(self.vault_id), (1, 2))
+        self.assertEqual(self.driver.create_file_generator(self.vault_id),
+                         self.file_ids[:1])
+        self.assertEqual(self.driver.create_file_generator(
+            self.vault_id, finalized=False), self.file_ids[1:])
+
+    def test_main(self):
+        with patch.object(migrate, 'CassandraStorageDriver',
+                          return_value=self.driver):
+            with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+                migrate.main(['--splits', '2', '--workers', '1'])
+
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            'badblocks: 1 rows',
+            'blockfiles: 3 rows',
+            'blockstorage: 3 rows',
+            'finalizedfiles: 1 rows',
+            'unfinalizedfiles: 1 rows'
+        ])
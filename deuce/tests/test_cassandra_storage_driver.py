@@ -1,12 +1,15 @@
 import importlib
 import unittest
+import uuid
 
 import ddt
 from mock import patch, MagicMock
 
 from deuce.drivers.cassandra import CassandraStorageDriver
+from deuce.drivers.cassandra import cassandrametadatadriver
 from deuce.tests.test_sqlite_storage_driver import SqliteStorageDriverTest
 from deuce import conf
+import deuce
 
 # Explanation:
 #   - The SqliteStorageDriver is the reference metadata driver. All
@@ -25,6 +28,10 @@ class CassandraStorageDriverTest(SqliteStorageDriverTest):
     def create_driver(self):
         return CassandraStorageDriver()
 
+    def skew_vault_statistics(self, driver, vault_id):
+        # Adds a file and takes 10 bytes off the counters
+        driver._inc_vault_statistics(vault_id, files=1, bytes=-10)
+
     @unittest.skipIf(cassandra_mock is False
        and ssl_enabled is False,
        "Don't run the test if we are running without SSL")
@@ -53,8 +60,8 @@ class CassandraStorageDriverTest(SqliteStorageDriverTest):
             conf.metadata_driver.cassandra.db_module)
         cassandra_auth = importlib.import_module(
             '{0}.auth'.format(conf.metadata_driver.cassandra.db_module))
-        cassandra_query = importlib.import_module(
-            '{0}.query'.format(conf.metadata_driver.cassandra.db_module))
+        cassandra_policies = importlib.import_module(
+            '{0}.policies'.format(conf.metadata_driver.cassandra.db_module))
 
         # Mock importlib so we can control the cassandra cluster import
         with patch('importlib.import_module') as mock_importlib:
@@ -62,7 +69,7 @@ class CassandraStorageDriverTest(SqliteStorageDriverTest):
                 cassandra_driver,
                 MagicMock(),
                 cassandra_auth,
-                cassandra_query
+                cassandra_policies
             ]
             # override the connect method so it doesn't actually do anything
             mock_importlib.return_value[1].connect = MagicMock()
@@ -70,3 +77,49 @@ class CassandraStorageDriverTest(SqliteStorageDriverTest):
 
             conf.metadata_driver.cassandra.cluster = contact_points
             return CassandraStorageDriver()
+
+    def test_concurrent_file_coverage(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+        block_id = self.create_block_id()
+
+        driver.create_file(vault_id, file_id)
+        driver.register_block(vault_id, block_id,
+                              self._genstorageid(block_id), 100)
+
+        update_coverage = driver._update_file_coverage
+
+        def concurrent_update(coverage, blocks):
+            # Another assignment changes the summary in the meantime
+            driver._session.execute(
+                cassandrametadatadriver.CQL_SET_FILE_COVERAGE, dict(
+                    projectid=deuce.context.project_id,
+                    vaultid=vault_id,
+                    fileid=uuid.UUID(file_id),
+                    coverage='changed'))
+            return update_coverage(coverage, blocks)
+
+        with patch.object(driver, '_update_file_coverage',
+                          side_effect=concurrent_update):
+            driver.assign_blocks(vault_id, file_id, [block_id], [0])
+
+        self.assertIsNone(driver._get_file_coverage(vault_id, file_id))
+
+    def test_prepared_statements(self):
+        driver = self.create_driver()
+
+        with patch.object(driver._session, 'prepare',
+                          wraps=driver._session.prepare) as prepare:
+            driver.create_vaults_generator()
+            driver.create_vaults_generator()
+
+            statement = driver._statement(cassandrametadatadriver.
+                                          CQL_GET_ALL_VAULTS)
+
+        # The statement is prepared once and reused afterwards
+        prepare.assert_called_once_with(
+            cassandrametadatadriver.CQL_GET_ALL_VAULTS)
+        self.assertEqual(statement.consistency_level,
+                         driver.consistency_level)
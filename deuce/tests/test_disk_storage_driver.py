@@ -151,6 +151,41 @@ class DiskStorageDriverTest(V1Base):
 
         assert driver.delete_vault(vault_id)
 
+    def test_block_stream_crud(self):
+        driver = self.create_driver()
+
+        # Larger than a single chunk so that the stream
+        # must be read more than once
+        block_size = driver.stream_chunk_size * 2 + 100
+        vault_id = self.create_vault_id()
+
+        driver.create_vault(vault_id)
+
+        block_data = MockFile(block_size)
+        block_id = block_data.sha1()
+
+        status, storage_id = driver.store_block_stream(vault_id, block_id,
+                                                       block_data, block_size)
+        assert status
+        assert driver.block_exists(vault_id, storage_id)
+
+        # Read back the block data and compare
+        file_obj = driver.get_block_obj(vault_id, storage_id)
+
+        returned_data = file_obj.read()
+        file_obj.close()
+
+        assert len(returned_data) == block_size
+        assert returned_data == block_data._content
+        assert (driver.get_block_object_length(vault_id, storage_id)
+                == block_size)
+
+        driver.delete_block(vault_id, storage_id)
+
+        assert not driver.block_exists(vault_id, storage_id)
+
+        assert driver.delete_vault(vault_id)
+
     def test_multi_block_crud(self):
         driver = self.create_driver()
 
@@ -183,6 +218,33 @@ class DiskStorageDriverTest(V1Base):
             assert None == driver.get_block_obj(vault_id, 'invalid_block_id')
         assert driver.delete_vault(vault_id)
 
+    def test_get_blocks_data(self):
+        driver = self.create_driver()
+
+        block_size = 3000
+        vault_id = self.create_vault_id()
+
+        driver.create_vault(vault_id)
+        block_datas = [MockFile(block_size) for _ in range(3)]
+        block_ids = [block_data.sha1() for block_data in block_datas]
+        (status, storage_ids) = driver.store_async_block(vault_id, block_ids, [
+            block_data.read() for block_data in block_datas])
+        assert status
+
+        # Data comes back in the order asked for, with None for
+        # blocks that do not exist
+        request = storage_ids[::-1] + ['invalid_block_id']
+        expected = [block_data._content for block_data in block_datas]
+        expected = expected[::-1] + [None]
+
+        assert driver.get_blocks_data(vault_id, request) == expected
+        assert driver.get_blocks_data(vault_id, []) == []
+
+        for storage_id in storage_ids:
+            driver.delete_block(vault_id, storage_id)
+
+        assert driver.delete_vault(vault_id)
+
     def test_block_generator(self):
         driver = self.create_driver()
 
@@ -282,6 +344,29 @@ class DiskStorageDriverTest(V1Base):
                 self.assertFalse(retVal)
                 self.assertEqual(storage_id, '')
 
+    def test_storage_block_stream_failure(self):
+        if self.__class__ != DiskStorageDriverTest:
+            self.skipTest('Test only applies to DiskStorageDriverTest')
+
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        driver.create_vault(vault_id)
+
+        block_data = MockFile(100)
+        block_id = block_data.sha1()
+
+        open_value = mock.mock_open()
+        open_value.side_effect = Exception('mocking open failure')
+
+        with mock.patch('builtins.open', open_value, create=True):
+            retVal, storage_id = driver.store_block_stream(vault_id,
+                                                           block_id,
+                                                           block_data,
+                                                           100)
+            self.assertFalse(retVal)
+            self.assertEqual(storage_id, '')
+
     def test_storage_block_async_failure(self):
         # (BenjamenMeyer) Success cases are taken care of elsewhere
         # we're only concerned about the failure case that explicitly
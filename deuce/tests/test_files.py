@@ -361,6 +361,197 @@ class TestFiles(ControllerTest):
         response = self.simulate_delete(self._file_path, headers=self._hdrs)
         self.assertEqual(self.srmock.status, falcon.HTTP_204)
 
+    def test_get_file_range(self):
+        num_blocks = 5
+
+        block_list, blocks_data = self.helper_create_blocks(
+            num_blocks=num_blocks)
+        blocks_data = list(blocks_data)
+        storage_list = self.helper_store_blocks(self.vault_id, blocks_data)
+
+        content = b''.join(data for _, data, _ in blocks_data)
+        file_length = len(content)
+
+        data = json.dumps([[block_list[cnt], cnt * 100]
+                           for cnt in range(0, num_blocks)])
+        response = self.simulate_post(self._fileblocks_path, body=data,
+                                      headers=self._hdrs)
+
+        finalize_hdrs = self._hdrs.copy()
+        finalize_hdrs['x-file-length'] = str(file_length)
+        response = self.simulate_post(self._file_path,
+                                      headers=finalize_hdrs)
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        def get_range(value):
+            hdrs = self._hdrs.copy()
+            hdrs['range'] = value
+            response = self.simulate_get(self._file_path, headers=hdrs)
+            return b''.join(response)
+
+        # Only the blocks overlapping the range are read
+        with patch.object(deuce.storage_driver, 'get_block_obj',
+                          wraps=deuce.storage_driver.get_block_obj) as get:
+            self.assertEqual(get_range('bytes=150-349'), content[150:350])
+            self.assertEqual(get.call_count, 3)
+
+        self.assertEqual(self.srmock.status, falcon.HTTP_206)
+        self.assertEqual(self.srmock.headers_dict['content-range'],
+                         'bytes 150-349/{0}'.format(file_length))
+        self.assertEqual(self.srmock.headers_dict['content-length'], '200')
+        self.assertEqual(self.srmock.headers_dict['accept-ranges'], 'bytes')
+
+        positive_cases = [
+            ('bytes=0-0', content[:1]),
+            ('bytes=-50', content[-50:]),
+            ('bytes=450-', content[450:]),
+            ('bytes=400-9999', content[400:]),
+        ]
+
+        for value, expected in positive_cases:
+            self.assertEqual(get_range(value), expected)
+            self.assertEqual(self.srmock.status, falcon.HTTP_206)
+
+        # Ranges that cannot be satisfied
+        for value in ('bytes=500-', 'bytes=-0'):
+            get_range(value)
+            self.assertEqual(self.srmock.status, falcon.HTTP_416)
+            self.assertEqual(self.srmock.headers_dict['content-range'],
+                             'bytes */{0}'.format(file_length))
+
+        # Malformed ranges are ignored
+        self.assertEqual(get_range('bytes=b-a'), content)
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        # The range stops short at a block missing from storage
+        deuce.storage_driver.delete_block(self.vault_id, storage_list[2][1])
+
+        self.assertEqual(get_range('bytes=150-349'), content[150:200])
+        self.assertEqual(self.srmock.status, falcon.HTTP_206)
+
+        # A block without a size cannot be placed within the range
+        manifest = Vault.get(self.vault_id).get_file_manifest(self._file_id)
+        blocks = [block[:3] + (None,) for block in manifest.blocks]
+
+        with patch.object(Vault, 'get_file_manifest',
+                          return_value=manifest._replace(blocks=blocks)):
+            get_range('bytes=150-349')
+            self.assertEqual(self.srmock.status, falcon.HTTP_409)
+
+    def test_get_file_manifest_cache(self):
+        from deuce.model.vault import manifest_cache
+
+        num_blocks = 3
+
+        block_list, blocks_data = self.helper_create_blocks(
+            num_blocks=num_blocks)
+        blocks_data = list(blocks_data)
+        self.helper_store_blocks(self.vault_id, blocks_data)
+
+        content = b''.join(data for _, data, _ in blocks_data)
+
+        data = json.dumps([[block_list[cnt], cnt * 100]
+                           for cnt in range(0, num_blocks)])
+        response = self.simulate_post(self._fileblocks_path, body=data,
+                                      headers=self._hdrs)
+
+        finalize_hdrs = self._hdrs.copy()
+        finalize_hdrs['x-file-length'] = str(len(content))
+        response = self.simulate_post(self._file_path,
+                                      headers=finalize_hdrs)
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        stats = manifest_cache.stats()
+
+        response = self.simulate_get(self._file_path, headers=self._hdrs)
+        self.assertEqual(b''.join(response), content)
+        self.assertEqual(manifest_cache.misses, stats['misses'] + 1)
+
+        # Once cached, the file is served without any metadata lookup
+        with patch.object(deuce, 'metadata_driver') as metadata_driver:
+            response = self.simulate_get(self._file_path,
+                                         headers=self._hdrs)
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+            self.assertEqual(b''.join(response), content)
+            self.assertEqual(metadata_driver.method_calls, [])
+
+        self.assertEqual(manifest_cache.hits, stats['hits'] + 1)
+
+        # Deleting the file drops it from the cache
+        response = self.simulate_delete(self._file_path, headers=self._hdrs)
+        self.assertEqual(self.srmock.status, falcon.HTTP_204)
+
+        response = self.simulate_get(self._file_path, headers=self._hdrs)
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
+
+    def test_get_file_manifest_cache_invalidation(self):
+        from deuce.model.vault import manifest_cache
+
+        num_blocks = 3
+
+        block_list, blocks_data = self.helper_create_blocks(
+            num_blocks=num_blocks)
+        blocks_data = list(blocks_data)
+        storage_list = self.helper_store_blocks(self.vault_id, blocks_data)
+
+        content = b''.join(data for _, data, _ in blocks_data)
+
+        file_paths = []
+        file_keys = []
+
+        for file_path, file_id in ((self._file_path, self._file_id),
+                                   (self._distractor_file_path,
+                                    self._distractor_file_id)):
+            data = json.dumps([[block_list[cnt], cnt * 100]
+                               for cnt in range(0, num_blocks)])
+            response = self.simulate_post(file_path + '/blocks', body=data,
+                                          headers=self._hdrs)
+
+            finalize_hdrs = self._hdrs.copy()
+            finalize_hdrs['x-file-length'] = str(len(content))
+            response = self.simulate_post(file_path, headers=finalize_hdrs)
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+            response = self.simulate_get(file_path, headers=self._hdrs)
+            self.assertEqual(b''.join(response), content)
+
+            file_paths.append(file_path)
+            file_keys.append((deuce.context.project_id, self.vault_id,
+                              file_id))
+
+        for key in file_keys:
+            self.assertIsNotNone(manifest_cache.get(key))
+
+        # A block lost from storage drops the manifests of the files
+        # that fail to read it, whether whole or in part
+        deuce.storage_driver.delete_block(self.vault_id, storage_list[1][1])
+
+        response = self.simulate_get(file_paths[0], headers=self._hdrs)
+        self.assertEqual(b''.join(response), content[:100])
+        self.assertIsNone(manifest_cache.get(file_keys[0]))
+
+        hdrs = self._hdrs.copy()
+        hdrs['range'] = 'bytes=50-249'
+        response = self.simulate_get(file_paths[1], headers=hdrs)
+        self.assertEqual(b''.join(response), content[50:100])
+        self.assertIsNone(manifest_cache.get(file_keys[1]))
+
+        # A file deleted by another process, which cannot invalidate
+        # the cache of this one, is served until its manifest expires
+        response = self.simulate_get(file_paths[0], headers=self._hdrs)
+        self.assertIsNotNone(manifest_cache.get(file_keys[0]))
+
+        deuce.metadata_driver.delete_file(self.vault_id, self._file_id)
+
+        response = self.simulate_get(file_paths[0], headers=self._hdrs)
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        expired = time.time() + manifest_cache.ttl
+        with patch('deuce.util.lrucache.time.time', return_value=expired):
+            response = self.simulate_get(file_paths[0], headers=self._hdrs)
+            self.assertEqual(self.srmock.status, falcon.HTTP_404)
+            self.assertIsNone(manifest_cache.get(file_keys[0]))
+
     def test_check_x_ref_modified_with_change_in_references(self):
 
         enough_num = int(conf.api_configuration.default_returned_num)
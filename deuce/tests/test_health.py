@@ -1,3 +1,5 @@
+import json
+
 import falcon
 
 from deuce.tests import V1Base
@@ -8,3 +10,6 @@ class TestHealth(V1Base):
     def test_health(self):
         response = self.simulate_get('/v1.0/health')
         self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        health = json.loads(response[0].decode())
+        self.assertTrue(health[-1].startswith('manifest cache:'))
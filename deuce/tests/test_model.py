@@ -1,6 +1,16 @@
+import concurrent.futures
+from io import BytesIO
+import os
+import threading
+
+import mock
+
+import deuce
 from deuce.tests import V1Base
 
 from deuce.model import Vault, File
+from deuce.util import executors
+from deuce.model.exceptions import ConsistencyError
 
 
 class TestModel(V1Base):
@@ -57,3 +67,275 @@ class TestModel(V1Base):
         blocks_list = list(blocks_gen)
 
         assert len(blocks_list) == 0
+
+    def test_block_info(self):
+        vault_id = self.create_vault_id()
+
+        v = Vault.create(vault_id)
+
+        data = os.urandom(100)
+        block_id = self.calc_sha1(data)
+
+        self.assertIsNone(v.get_block_info(block_id))
+
+        retval, storage_id, deduplicated = v.put_block(
+            block_id, BytesIO(data), len(data))
+        self.assertTrue(retval)
+
+        self.assertTrue(v.has_block(block_id, check_storage=True))
+
+        info = v.get_block_info(block_id, check_storage=True)
+        self.assertEqual(info['storageid'], storage_id)
+        self.assertEqual(info['blocksize'], len(data))
+        self.assertEqual(info['refcount'], 0)
+        self.assertFalse(info['isinvalid'])
+
+        # Once the block is gone from storage it is marked as bad
+        deuce.storage_driver.delete_block(vault_id, storage_id)
+
+        self.assertRaises(ConsistencyError, v.has_block, block_id,
+                          check_storage=True)
+        self.assertRaises(ConsistencyError, v.get_block_info, block_id,
+                          check_storage=True)
+
+        self.assertTrue(v.get_block_info(block_id)['isinvalid'])
+
+    def test_block_length(self):
+        vault_id = self.create_vault_id()
+
+        v = Vault.create(vault_id)
+
+        data = os.urandom(100)
+        block_id = self.calc_sha1(data)
+
+        retval, storage_id, deduplicated = v.put_block(
+            block_id, BytesIO(data), len(data))
+
+        block = v.get_block(block_id)
+        self.assertEqual(block.get_storage_id(), storage_id)
+        self.assertEqual(block.get_block_length(), len(data))
+
+        # Without a length in metadata the block is measured in
+        # storage, under the storage id found in metadata
+        with mock.patch.object(deuce.metadata_driver, 'get_block_info',
+                               return_value=None):
+            with mock.patch.object(deuce.metadata_driver,
+                                   'get_block_storage_id',
+                                   return_value=storage_id):
+                self.assertEqual(block.get_block_length(), len(data))
+
+        block.get_obj().close()
+
+    def test_blocks_generator(self):
+        vault_id = self.create_vault_id()
+
+        v = Vault.create(vault_id)
+
+        datas = [os.urandom(100) for _ in range(3)]
+        block_ids = [self.calc_sha1(data) for data in datas]
+
+        for block_id, data in zip(block_ids, datas):
+            v.put_block(block_id, BytesIO(data), len(data))
+
+        storage_ids = deuce.metadata_driver.get_block_storage_ids(
+            vault_id, block_ids)
+
+        self.assertEqual(list(v.get_blocks_generator(block_ids)),
+                         list(zip(storage_ids, datas)))
+
+        # Blocks missing from storage come back without data
+        self.assertEqual(list(v.get_blocks_generator(['missing'],
+                                                     ['missing'])),
+                         [('missing', None)])
+
+    def test_blocks_generator_windows(self):
+        vault_id = self.create_vault_id()
+
+        v = Vault.create(vault_id)
+
+        datas = [os.urandom(size) for size in (10, 20, 30, 40, 50)]
+        block_ids = [self.calc_sha1(data) for data in datas]
+
+        for block_id, data in zip(block_ids, datas):
+            v.put_block(block_id, BytesIO(data), len(data))
+
+        storage_ids = deuce.metadata_driver.get_block_storage_ids(
+            vault_id, block_ids)
+        block_sizes = [len(data) for data in datas]
+
+        def windows(prefetch_depth, prefetch_max_bytes, sizes):
+            conf = deuce.conf.api_configuration
+            orig = (conf.prefetch_depth, conf.prefetch_max_bytes)
+            conf.prefetch_depth = prefetch_depth
+            conf.prefetch_max_bytes = prefetch_max_bytes
+
+            try:
+                with mock.patch.object(
+                        deuce.storage_driver, 'get_blocks_data',
+                        wraps=deuce.storage_driver.get_blocks_data) as read:
+
+                    self.assertEqual(
+                        list(v.get_blocks_generator(block_ids, storage_ids,
+                                                    sizes)),
+                        list(zip(storage_ids, datas)))
+
+                    return [len(call[0][1]) for call in read.call_args_list]
+
+            finally:
+                conf.prefetch_depth, conf.prefetch_max_bytes = orig
+
+        # Each window takes half of the blocks and bytes allowed
+        # in flight
+        self.assertEqual(windows(4, 1000, block_sizes), [2, 2, 1])
+        self.assertEqual(windows(1, 1000, block_sizes), [1, 1, 1, 1, 1])
+
+        # Bounded by the number of bytes, a block larger than the
+        # limit is still read on its own
+        self.assertEqual(windows(10, 120, block_sizes), [3, 1, 1])
+        self.assertEqual(windows(10, 1, block_sizes), [1, 1, 1, 1, 1])
+
+        # Without sizes only the number of blocks is bounded
+        self.assertEqual(windows(10, 1, None), [5])
+        self.assertEqual(windows(10, 1, [None] * len(datas)), [5])
+
+    def test_blocks_generator_overlap(self):
+        vault_id = self.create_vault_id()
+
+        v = Vault.create(vault_id)
+
+        datas = [os.urandom(100) for _ in range(3)]
+        block_ids = [self.calc_sha1(data) for data in datas]
+
+        for block_id, data in zip(block_ids, datas):
+            v.put_block(block_id, BytesIO(data), len(data))
+
+        conf = deuce.conf.api_configuration
+        orig = conf.prefetch_depth
+        conf.prefetch_depth = 2
+
+        executor = executors.get_executor('prefetch', conf.prefetch_workers)
+
+        # The executor threads run within a copy of the context of
+        # the request
+        context = threading.local()
+        vars(context).update(vars(deuce.context))
+
+        try:
+            with mock.patch.object(deuce, 'context', context):
+                with mock.patch.object(executor, 'submit',
+                                       wraps=executor.submit) as submit:
+                    gen = v.get_blocks_generator(block_ids)
+
+                    # The second window is being read by the time the
+                    # first block is yielded
+                    self.assertEqual(next(gen)[1], datas[0])
+                    self.assertEqual(submit.call_count, 2)
+
+                    self.assertEqual([data for _, data in gen], datas[1:])
+                    self.assertEqual(submit.call_count, 3)
+
+                    # A generator closed early leaves nothing behind
+                    gen = v.get_blocks_generator(block_ids)
+                    next(gen)
+                    gen.close()
+
+        finally:
+            conf.prefetch_depth = orig
+
+    def test_blocks_generator_close(self):
+        vault_id = self.create_vault_id()
+
+        v = Vault.create(vault_id)
+
+        datas = [os.urandom(100) for _ in range(2)]
+        block_ids = [self.calc_sha1(data) for data in datas]
+
+        for block_id, data in zip(block_ids, datas):
+            v.put_block(block_id, BytesIO(data), len(data))
+
+        futures = []
+
+        def submit(func, *args):
+            # Only the first window is read, the second is left queued
+            future = concurrent.futures.Future()
+            if not futures:
+                future.set_result(func(*args))
+            futures.append(future)
+            return future
+
+        conf = deuce.conf.api_configuration
+        orig = conf.prefetch_depth
+        conf.prefetch_depth = 2
+
+        try:
+            with mock.patch.object(executors, 'get_executor') as executor:
+                executor.return_value.submit.side_effect = submit
+
+                gen = v.get_blocks_generator(block_ids)
+                self.assertEqual(next(gen)[1], datas[0])
+
+                # Closing the generator while the first window is being
+                # yielded cancels the read of the second
+                gen.close()
+
+        finally:
+            conf.prefetch_depth = orig
+
+        self.assertEqual(len(futures), 2)
+        self.assertTrue(futures[1].cancelled())
+
+    def test_vault_delete_drops_manifests(self):
+        from deuce.model.vault import manifest_cache
+
+        vault_id = self.create_vault_id()
+        v = Vault.create(vault_id)
+
+        f = v.create_file()
+        deuce.metadata_driver.finalize_file(vault_id, f.file_id, 0)
+
+        manifest = v.get_file_manifest(f.file_id)
+        self.assertEqual(manifest.length, 0)
+        self.assertEqual(manifest.blocks, [])
+        self.assertIs(v.get_file_manifest(f.file_id), manifest)
+
+        # Files that are missing or not finalized have no manifest
+        self.assertIsNone(v.get_file_manifest(self.create_file_id()))
+        self.assertIsNone(v.get_file_manifest(v.create_file().file_id))
+
+        self.assertTrue(v.delete())
+        self.assertIsNot(v.get_file_manifest(f.file_id), manifest)
+
+    def test_bad_block_drops_manifests(self):
+        from deuce.model.vault import manifest_cache
+
+        vault_id = self.create_vault_id()
+        v = Vault.create(vault_id)
+
+        data = os.urandom(100)
+        block_id = self.calc_sha1(data)
+
+        retval, storage_id, deduplicated = v.put_block(
+            block_id, BytesIO(data), len(data))
+
+        f = v.create_file()
+        deuce.metadata_driver.assign_block(vault_id, f.file_id, block_id, 0)
+        deuce.metadata_driver.finalize_file(vault_id, f.file_id, len(data))
+
+        # The manifest recorded at finalize time is cached
+        manifest = v.get_file_manifest(f.file_id)
+        self.assertEqual(manifest.blocks,
+                         [(block_id, 0, storage_id, len(data))])
+        self.assertIs(v.get_file_manifest(f.file_id), manifest)
+
+        deuce.storage_driver.delete_block(vault_id, storage_id)
+        self.assertRaises(ConsistencyError, v.get_block_info, block_id,
+                          check_storage=True)
+
+        # Once one of its blocks is bad, the blocks of the file are
+        # looked up on every read
+        self.assertIsNone(manifest_cache.get(v._manifest_key(f.file_id)))
+
+        manifest = v.get_file_manifest(f.file_id)
+        self.assertEqual(manifest.blocks,
+                         [(block_id, 0, storage_id, len(data))])
+        self.assertIsNot(v.get_file_manifest(f.file_id), manifest)
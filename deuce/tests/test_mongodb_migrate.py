@@ -0,0 +1,87 @@
+import io
+
+from mock import patch
+
+import deuce
+from deuce.drivers.mongodb import MongoDbStorageDriver
+from deuce.drivers.mongodb import migrate
+from deuce.tests import V1Base
+
+
+class TestMongoDbMigrate(V1Base):
+
+    def setUp(self):
+        super(TestMongoDbMigrate, self).setUp()
+
+        self.driver = MongoDbStorageDriver()
+        self.vault_id = self.create_vault_id()
+
+        self.block_ids = [self.create_block_id() for _ in range(3)]
+        self.file_ids = [self.create_file_id() for _ in range(2)]
+
+        self.driver.register_blocks(self.vault_id, [
+            (block_id, self.create_storage_block_id(), 100)
+            for block_id in self.block_ids])
+
+        for file_id in self.file_ids:
+            self.driver.create_file(self.vault_id, file_id)
+
+        # The first block is referenced three times, the second
+        # once and the last one not at all
+        self.driver.assign_blocks(self.vault_id, self.file_ids[0],
+                                  self.block_ids[:2], [0, 100])
+        self.driver.assign_blocks(self.vault_id, self.file_ids[1],
+                                  self.block_ids[:1] * 2, [0, 100])
+
+        # Start out from the collections as they were before the
+        # counters were introduced
+        self.driver._blockrefs.remove(
+            {'projectid': deuce.context.project_id})
+
+    def assert_ref_counts(self, counts):
+        self.assertEqual([self.driver.get_block_ref_count(self.vault_id,
+                                                          block_id)
+                          for block_id in self.block_ids], counts)
+
+    def test_backfill(self):
+        self.assert_ref_counts([0, 0, 0])
+
+        self.assertEqual(migrate.backfill(self.driver,
+                                          deuce.context.project_id), 2)
+        self.assert_ref_counts([3, 1, 0])
+
+        # Running it again changes nothing
+        self.assertEqual(migrate.backfill(self.driver,
+                                          deuce.context.project_id), 2)
+        self.assert_ref_counts([3, 1, 0])
+
+        self.driver.delete_file(self.vault_id, self.file_ids[1])
+        self.assert_ref_counts([1, 1, 0])
+
+    def test_backfill_resets_counters(self):
+        # A counter off by some updates lost in the past
+        self.driver._blockrefs.update({
+            'projectid': deuce.context.project_id,
+            'vaultid': self.vault_id,
+            'blockid': self.block_ids[2]
+        }, {'$set': {'refcount': 5}}, upsert=True)
+        self.assert_ref_counts([0, 0, 5])
+
+        self.assertEqual(migrate.backfill(self.driver,
+                                          deuce.context.project_id), 2)
+        self.assert_ref_counts([3, 1, 0])
+
+    def test_backfill_all_projects(self):
+        self.assertGreaterEqual(migrate.backfill(self.driver), 2)
+        self.assert_ref_counts([3, 1, 0])
+
+    def test_main(self):
+        with patch.object(migrate, 'MongoDbStorageDriver',
+                          return_value=self.driver):
+            with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+                migrate.main(['--project', deuce.context.project_id])
+
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            '2 block reference counters written'
+        ])
+        self.assert_ref_counts([3, 1, 0])
@@ -1,3 +1,6 @@
+from mock import patch
+
+import deuce
 from deuce.drivers.mongodb import MongoDbStorageDriver
 from deuce.tests.test_sqlite_storage_driver import SqliteStorageDriverTest
 
@@ -12,3 +15,174 @@ class MongoDbStorageDriverTest(SqliteStorageDriverTest):
 
     def create_driver(self):
         return MongoDbStorageDriver()
+
+    def skew_vault_statistics(self, driver, vault_id):
+        # Adds a file and takes 10 bytes off the counters
+        driver._vaultstats.update({
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id
+        }, {'$inc': {'files': 1, 'bytes': -10}})
+
+    def test_concurrent_file_coverage(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+        block_id = self.create_block_id()
+
+        driver.create_file(vault_id, file_id)
+        driver.register_block(vault_id, block_id,
+                              self._genstorageid(block_id), 100)
+
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'fileid': file_id
+        }
+
+        update_coverage = driver._update_file_coverage
+
+        def concurrent_update(coverage, blocks):
+            # Another assignment changes the summary in the meantime
+            driver._files.update(args, {'$set': {'coverage': 'changed'}})
+            return update_coverage(coverage, blocks)
+
+        with patch.object(driver, '_update_file_coverage',
+                          side_effect=concurrent_update):
+            driver.assign_block(vault_id, file_id, block_id, 0)
+
+        self.assertIsNone(driver._files.find_one(args).get('coverage'))
+
+    def test_block_ref_counters(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+        block_id = self.create_block_id()
+
+        driver.create_file(vault_id, file_id)
+        driver.register_block(vault_id, block_id,
+                              self._genstorageid(block_id), 100)
+
+        # Assigning the same block at the same offset twice adds a
+        # single reference
+        driver.assign_block(vault_id, file_id, block_id, 0)
+        driver.assign_block(vault_id, file_id, block_id, 0)
+        driver.assign_blocks(vault_id, file_id, [block_id, block_id],
+                             [0, 100])
+
+        self.assertEqual(driver.get_block_ref_count(vault_id, block_id), 2)
+
+        args = {
+            'projectid': deuce.context.project_id,
+            'vaultid': vault_id,
+            'blockid': block_id
+        }
+
+        driver.delete_file(vault_id, file_id)
+        self.assertEqual(driver._blockrefs.find_one(args)['refcount'], 0)
+
+        # The counter goes away with the block
+        driver.unregister_block(vault_id, block_id)
+        self.assertIsNone(driver._blockrefs.find_one(args))
+
+    def test_block_ref_counters_concurrent_delete(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+        block_ids = [self.create_block_id() for _ in range(2)]
+
+        driver.create_file(vault_id, file_id)
+        driver.register_blocks(vault_id, [
+            (block_id, self._genstorageid(block_id), 100)
+            for block_id in block_ids])
+        driver.assign_block(vault_id, file_id, block_ids[0], 0)
+
+        remove_file = driver._files.remove
+
+        def concurrent_remove(*args, **kwargs):
+            # Another block is assigned while the file is deleted
+            driver.assign_block(vault_id, file_id, block_ids[1], 100)
+            return remove_file(*args, **kwargs)
+
+        with patch.object(driver._files, 'remove',
+                          side_effect=concurrent_remove):
+            driver.delete_file(vault_id, file_id)
+
+        # Every assignment removed is taken off the counters
+        for block_id in block_ids:
+            self.assertEqual(driver.get_block_ref_count(vault_id, block_id),
+                             0)
+
+    def test_delete_file_round_trips(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+        block_ids = [self.create_block_id() for _ in range(4)]
+
+        driver.create_file(vault_id, file_id)
+        driver.register_blocks(vault_id, [
+            (block_id, self._genstorageid(block_id), 100)
+            for block_id in block_ids])
+
+        # The first block is referenced twice, the others once
+        driver.assign_blocks(vault_id, file_id, block_ids[:1] + block_ids,
+                             [i * 100 for i in range(5)])
+
+        with patch.object(driver._fileblocks, 'remove',
+                          wraps=driver._fileblocks.remove) as remove:
+            with patch.object(driver._blockrefs, 'update',
+                              wraps=driver._blockrefs.update) as update:
+                driver.delete_file(vault_id, file_id)
+
+        # The fileblocks are removed at once, and the counters are
+        # decremented once per number of references
+        self.assertEqual(remove.call_count, 1)
+        self.assertEqual(update.call_count, 2)
+
+        for block_id in block_ids:
+            self.assertEqual(driver.get_block_ref_count(vault_id, block_id),
+                             0)
+
+    def test_concurrent_register_blocks(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        block_id = self.create_block_id()
+        storage_id = self._genstorageid(block_id)
+
+        driver.register_blocks(vault_id, [(block_id, storage_id, 100)])
+
+        def block_docs():
+            return list(driver._blocks.find({
+                'projectid': deuce.context.project_id,
+                'vaultid': vault_id,
+                'blockid': block_id
+            }))
+
+        find = driver._blocks.find
+
+        # Another upload registered the block after this one looked
+        # it up, as missing and then as invalid
+        for existing in ([], [{'blockid': block_id, 'isinvalid': True}]):
+            def stale_find(spec, *args, **kwargs):
+                if isinstance(spec.get('blockid'), dict):
+                    return iter(existing)
+
+                return find(spec, *args, **kwargs)
+
+            with patch.object(driver._blocks, 'find',
+                              side_effect=stale_find):
+                driver.register_blocks(vault_id, [
+                    (block_id, self._genstorageid(block_id), 200)])
+
+            docs = block_docs()
+            self.assertEqual(len(docs), 1)
+            self.assertEqual(docs[0]['storageid'], storage_id)
+
+            stats = driver.get_vault_statistics(vault_id)
+            self.assertEqual(stats['blocks']['count'], 1)
+            self.assertEqual(stats['blocks']['bytes'], 100)
+            self.assertEqual(stats['blocks']['bad'], 0)
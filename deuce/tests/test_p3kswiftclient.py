@@ -233,6 +233,31 @@ class Test_P3k_SwiftClient(V1Base):
                               self.vault,
                               'mock'))
 
+    def test_head_object_length(self):
+        res = Response(204)
+        res.headers['Content-Length'] = '10'
+        fut = asyncio.Future(loop=None)
+        fut.set_result(res)
+        p3k_swiftclient.aiohttp.request = mock.Mock(return_value=fut)
+        length = p3k_swiftclient.head_object_length(
+            self.storage_url,
+            self.token,
+            self.vault,
+            'mock')
+        self.assertEqual(length, 10)
+        self.assertEqual(p3k_swiftclient.aiohttp.request.call_args[1][
+            'method'], 'HEAD')
+        res_exception = Response(404)
+        fut = asyncio.Future(loop=None)
+        fut.set_result(res_exception)
+        p3k_swiftclient.aiohttp.request = mock.Mock(return_value=fut)
+        self.assertRaises(ClientException,
+                          lambda: p3k_swiftclient.head_object_length(
+                              self.storage_url,
+                              self.token,
+                              self.vault,
+                              'mock'))
+
     def test_get_object(self):
         mock_file = MockFile(10)
         r = Response(200, mock_file)
@@ -249,6 +274,95 @@ class Test_P3k_SwiftClient(V1Base):
         self.assertEqual(r, response)
         self.assertEqual(mock_file, block)
 
+    def test_get_object_stream(self):
+        def chunk(data):
+            fut = asyncio.Future(loop=None)
+            fut.set_result(data)
+            return fut
+
+        res = Response(200, MockFile(10))
+        res.content.read = mock.Mock(
+            side_effect=[chunk(b'mo'), chunk(b'ck'), chunk(b'')])
+        res.close = mock.Mock()
+        fut = asyncio.Future(loop=None)
+        fut.set_result(res)
+        p3k_swiftclient.aiohttp.request = mock.Mock(return_value=fut)
+
+        stream = p3k_swiftclient.get_object_stream(
+            self.storage_url,
+            self.token,
+            self.vault,
+            self.block,
+            2)
+        self.assertEqual(p3k_swiftclient.aiohttp.request.call_args[1][
+            'method'], 'GET')
+        self.assertEqual(stream.read(2), b'mo')
+        self.assertFalse(res.close.called)
+        self.assertEqual(list(stream), [b'ck'])
+        self.assertTrue(stream.closed)
+        self.assertEqual(res.close.call_count, 1)
+        self.assertEqual(stream.read(), b'')
+        stream.close()
+        self.assertEqual(res.close.call_count, 1)
+
+        res = Response(200, MockFile(10))
+        res.content.read = mock.Mock(
+            side_effect=[chunk(b'mock'), chunk(b'')])
+        res.close = mock.Mock()
+        fut = asyncio.Future(loop=None)
+        fut.set_result(res)
+        p3k_swiftclient.aiohttp.request = mock.Mock(return_value=fut)
+
+        stream = p3k_swiftclient.get_object_stream(
+            self.storage_url,
+            self.token,
+            self.vault,
+            self.block,
+            4)
+        self.assertEqual(stream.read(), b'mock')
+        self.assertTrue(res.close.called)
+
+        res_exception = Response(404)
+        res_exception.close = mock.Mock()
+        fut = asyncio.Future(loop=None)
+        fut.set_result(res_exception)
+        p3k_swiftclient.aiohttp.request = mock.Mock(return_value=fut)
+        self.assertRaises(ClientException,
+                          lambda: p3k_swiftclient.get_object_stream(
+                              self.storage_url,
+                              self.token,
+                              self.vault,
+                              self.block,
+                              4))
+        self.assertTrue(res_exception.close.called)
+
+    def test_get_async_object(self):
+        responses = [Response(200, MockFile(10)), Response(200, MockFile(10)),
+                     Response(404)]
+
+        def request(method, url, headers):
+            fut = asyncio.Future(loop=None)
+            fut.set_result(responses[int(url[-1])])
+            return fut
+
+        p3k_swiftclient.aiohttp.request = mock.Mock(side_effect=request)
+
+        # The 404 has no content to read
+        fut = asyncio.Future(loop=None)
+        fut.set_result(b'')
+        responses[2].content = mock.Mock()
+        responses[2].content.read = mock.Mock(return_value=fut)
+
+        blocks = p3k_swiftclient.get_async_object(
+            self.storage_url,
+            self.token,
+            self.vault,
+            ['mock0', 'mock1', 'mock2'])
+        self.assertEqual(blocks, [responses[0].content,
+                                  responses[1].content,
+                                  None])
+        self.assertEqual(p3k_swiftclient.aiohttp.request.call_count, 3)
+
     def test_delete_object(self):
         r = Response(204)
         fut1 = asyncio.Future(loop=None)
@@ -0,0 +1,54 @@
+import io
+
+from mock import patch
+
+import deuce
+from deuce.drivers import reconcile
+from deuce.drivers.sqlite import SqliteStorageDriver
+from deuce.tests import V1Base
+
+
+class TestReconcile(V1Base):
+
+    def setUp(self):
+        super(TestReconcile, self).setUp()
+
+        self.driver = SqliteStorageDriver()
+        self.vault_ids = sorted(self.create_vault_id() for _ in range(5))
+
+        for vault_id in self.vault_ids:
+            self.driver.create_vault(vault_id)
+            self.driver.create_file(vault_id, self.create_file_id())
+
+        # Lose track of the file of the last vault
+        with self.driver._transaction() as conn:
+            conn.execute('''
+                UPDATE vaultstats SET files = files - 1
+                WHERE projectid = ? AND vaultid = ?''',
+                (deuce.context.project_id, self.vault_ids[-1]))
+
+    def test_reconcile(self):
+        self.assertEqual(reconcile.reconcile(self.driver, batch=2), [
+            (self.vault_ids[-1], dict(files=1, blocks=0, bytes=0,
+                                      badblocks=0))
+        ])
+
+        for vault_id in self.vault_ids:
+            self.assertEqual(self.driver.get_vault_statistics(
+                vault_id)['files']['count'], 1)
+
+        self.assertEqual(reconcile.reconcile(self.driver, batch=2), [])
+
+    def test_main(self):
+        project_id = deuce.context.project_id
+
+        with patch.object(reconcile, '_load_metadata_driver',
+                          return_value=self.driver):
+            with patch.object(deuce, 'context', deuce.context):
+                with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+                    reconcile.main(['--project', project_id])
+
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            '{0}: files +1'.format(self.vault_ids[-1]),
+            '1 vaults corrected'
+        ])
@@ -1,12 +1,15 @@
 import ddt
-from mock import MagicMock
+import json
+from mock import MagicMock, patch
 import random
 
 from deuce.tests import V1Base
 from deuce.drivers.metadatadriver import MetadataStorageDriver, GapError,\
-    OverlapError, ConstraintError
+    OverlapError, ConstraintError, EMPTY_FILE_COVERAGE
 from deuce.drivers.sqlite import SqliteStorageDriver
+from deuce.drivers.sqlite import sqlitemetadatadriver
 from deuce.drivers import BlockStorageDriver
+from deuce.drivers import metadatadriver
 import deuce
 
 
@@ -19,6 +22,14 @@ class SqliteStorageDriverTest(V1Base):
     def create_driver(self):
         return SqliteStorageDriver()
 
+    def skew_vault_statistics(self, driver, vault_id):
+        # Adds a file and takes 10 bytes off the counters
+        with driver._transaction() as conn:
+            conn.execute('''
+                UPDATE vaultstats SET files = files + 1, bytes = bytes - 10
+                WHERE projectid = ? AND vaultid = ?''',
+                (deuce.context.project_id, vault_id))
+
     def test_basic_construction(self):
         driver = self.create_driver()
 
@@ -80,6 +91,91 @@ class SqliteStorageDriverTest(V1Base):
         self.assertEqual(new_stats['blocks']['bad'], 3)
         self.assertEqual(new_stats['files']['bad'], 1)
 
+    def test_vault_statistics_counters(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_ids = [self.create_file_id() for _ in range(2)]
+        block_ids = [self.create_block_id() for _ in range(3)]
+
+        def assert_counters(files, blocks, size, bad):
+            stats = driver.get_vault_statistics(vault_id)
+
+            self.assertEqual(stats['files']['count'], files)
+            self.assertEqual(stats['blocks']['count'], blocks)
+            self.assertEqual(stats['blocks']['bytes'], size)
+            self.assertEqual(stats['blocks']['bad'], bad)
+
+        assert_counters(0, 0, 0, 0)
+
+        for file_id in file_ids:
+            driver.create_file(vault_id, file_id)
+
+        blocks = [(block_id, self.create_storage_block_id(), size)
+                  for block_id, size in zip(block_ids, (100, 200, 300))]
+
+        driver.register_blocks(vault_id, blocks)
+        assert_counters(2, 3, 600, 0)
+
+        # Registering valid blocks again changes nothing
+        driver.register_blocks(vault_id, blocks)
+        assert_counters(2, 3, 600, 0)
+
+        # Bad blocks are only counted once
+        driver.mark_block_as_bad(vault_id, block_ids[0])
+        driver.mark_block_as_bad(vault_id, block_ids[0])
+        assert_counters(2, 3, 600, 1)
+
+        # Registering a bad block replaces it
+        driver.register_block(vault_id, block_ids[0],
+                              self.create_storage_block_id(), 150)
+        assert_counters(2, 3, 650, 0)
+
+        driver.mark_block_as_bad(vault_id, block_ids[1])
+        driver.reset_block_status(vault_id)
+        assert_counters(2, 3, 650, 0)
+
+        driver.mark_block_as_bad(vault_id, block_ids[2])
+        driver.unregister_block(vault_id, block_ids[2])
+        driver.unregister_block(vault_id, block_ids[2])
+        assert_counters(2, 2, 350, 0)
+
+        driver.delete_file(vault_id, file_ids[0])
+        driver.delete_file(vault_id, file_ids[0])
+        assert_counters(1, 2, 350, 0)
+
+        self.assertEqual(driver.reconcile_vault_statistics(vault_id),
+                         dict(files=0, blocks=0, bytes=0, badblocks=0))
+
+    def test_reconcile_vault_statistics(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+
+        # Nothing to correct in an empty vault
+        self.assertEqual(driver.reconcile_vault_statistics(vault_id),
+                         dict(files=0, blocks=0, bytes=0, badblocks=0))
+
+        driver.create_file(vault_id, self.create_file_id())
+        driver.register_block(vault_id, self.create_block_id(),
+                              self.create_storage_block_id(), 100)
+
+        self.skew_vault_statistics(driver, vault_id)
+
+        self.assertEqual(driver.get_vault_statistics(vault_id)['files'],
+                         dict(count=2, bad=0))
+
+        self.assertEqual(driver.reconcile_vault_statistics(vault_id),
+                         dict(files=-1, blocks=0, bytes=10, badblocks=0))
+
+        stats = driver.get_vault_statistics(vault_id)
+        self.assertEqual(stats['files']['count'], 1)
+        self.assertEqual(stats['blocks']['count'], 1)
+        self.assertEqual(stats['blocks']['bytes'], 100)
+
+        self.assertEqual(driver.reconcile_vault_statistics(vault_id),
+                         dict(files=0, blocks=0, bytes=0, badblocks=0))
+
     def test_db_health(self):
         driver = self.create_driver()
         retval = driver.get_health()
@@ -229,6 +325,56 @@ class SqliteStorageDriverTest(V1Base):
         self.assertEqual(bad_files, 1)
         self.assertEqual(bad_blocks, num_blocks)
 
+    def test_vault_health_many_bad_blocks(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_ids = [self.create_file_id() for _ in range(3)]
+        block_ids = [self.create_block_id() for _ in range(250)]
+        size = 1024
+
+        driver.register_blocks(vault_id, [
+            (block_id, self._genstorageid(block_id), size)
+            for block_id in block_ids])
+
+        # The first two files hold half of the blocks each, the
+        # last one a block that stays valid
+        bad_ids, good_ids = block_ids[:-1], block_ids[-1:]
+        manifests = [bad_ids[:120], bad_ids[120:], good_ids]
+
+        for file_id, manifest in zip(file_ids, manifests):
+            driver.create_file(vault_id, file_id)
+            driver.assign_blocks(vault_id, file_id, manifest,
+                                 [i * size for i in range(len(manifest))])
+
+        self.assertEqual(driver.vault_health(vault_id), (0, 0))
+
+        for block_id in bad_ids:
+            driver.mark_block_as_bad(vault_id, block_id)
+
+        self.assertEqual(driver.vault_health(vault_id), (len(bad_ids), 2))
+
+    def test_vault_health_shared_bad_block(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_ids = [self.create_file_id() for _ in range(3)]
+        block_id = self.create_block_id()
+
+        driver.register_block(vault_id, block_id,
+                              self._genstorageid(block_id), 1024)
+
+        # Every file referencing the bad block is counted
+        for file_id in file_ids:
+            driver.create_file(vault_id, file_id)
+            driver.assign_block(vault_id, file_id, block_id, 0)
+
+        driver.mark_block_as_bad(vault_id, block_id)
+        self.assertEqual(driver.vault_health(vault_id), (1, 3))
+
+        driver.delete_file(vault_id, file_ids[0])
+        self.assertEqual(driver.vault_health(vault_id), (1, 2))
+
     def test_blockid_to_storageid(self):
 
         driver = self.create_driver()
@@ -306,6 +452,502 @@ class SqliteStorageDriverTest(V1Base):
 
         self.assertFalse(driver.has_block(vault_id, 'invalidid'))
 
+    def test_block_info(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+        block_id = self.create_block_id()
+        storage_id = self._genstorageid(block_id)
+        size = 4096
+
+        self.assertIsNone(driver.get_block_info(vault_id, block_id))
+
+        driver.register_block(vault_id, block_id, storage_id, size)
+
+        info = driver.get_block_info(vault_id, block_id)
+        self.assertEqual(info['storageid'], storage_id)
+        self.assertEqual(info['blocksize'], size)
+        self.assertEqual(info['refcount'], 0)
+        self.assertEqual(info['reftime'],
+                         driver.get_block_ref_modified(vault_id, block_id))
+        self.assertFalse(info['isinvalid'])
+
+        driver.create_file(vault_id, file_id)
+        driver.assign_block(vault_id, file_id, block_id, 0)
+        driver.mark_block_as_bad(vault_id, block_id)
+
+        info = driver.get_block_info(vault_id, block_id)
+        self.assertEqual(info['refcount'], 1)
+        self.assertTrue(info['isinvalid'])
+
+    def test_block_storage_ids(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        block_ids = [self.create_block_id() for _ in range(3)]
+        storage_ids = [self._genstorageid(block_id)
+                       for block_id in block_ids]
+
+        self.assertEqual(driver.get_block_storage_ids(vault_id, []), [])
+        self.assertEqual(driver.get_block_storage_ids(vault_id, block_ids),
+                         [None, None, None])
+
+        for block_id, storage_id in zip(block_ids[:2], storage_ids):
+            driver.register_block(vault_id, block_id, storage_id, 1024)
+
+        # The results follow the order of the request, including
+        # repeats, with None for the block that is not registered
+        request = block_ids[::-1] + block_ids[:1]
+        self.assertEqual(driver.get_block_storage_ids(vault_id, request),
+                         [None, storage_ids[1], storage_ids[0],
+                          storage_ids[0]])
+
+    def test_file_block_generator_with_storage(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+        driver.create_file(vault_id, file_id)
+
+        block_ids = [self.create_block_id() for _ in range(4)]
+        storage_ids = [self._genstorageid(block_id)
+                       for block_id in block_ids]
+        sizes = [100, 200, 300, 400]
+        offsets = [0, 100, 300, 600]
+
+        # The last block is assigned but never registered
+        for block_id, storage_id, size in list(
+                zip(block_ids, storage_ids, sizes))[:3]:
+            driver.register_block(vault_id, block_id, storage_id, size)
+
+        driver.assign_blocks(vault_id, file_id, block_ids, offsets)
+
+        expected = list(zip(block_ids, offsets, storage_ids[:3] + [None],
+                            sizes[:3] + [None]))
+
+        output = sorted(driver.create_file_block_generator(
+            vault_id, file_id, with_storage=True), key=lambda x: x[1])
+        self.assertEqual(output, expected)
+
+        output = sorted(driver.create_file_block_generator(
+            vault_id, file_id, offset=100, limit=2, with_storage=True),
+            key=lambda x: x[1])
+        self.assertEqual(output, expected[1:3])
+
+    def test_file_manifest(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_ids = [self.create_file_id() for _ in range(2)]
+
+        block_ids = [self.create_block_id() for _ in range(4)]
+        storage_ids = [self._genstorageid(block_id)
+                       for block_id in block_ids]
+        sizes = [100, 200, 300, 400]
+        offsets = [0, 100, 300, 600]
+
+        for block_id, storage_id, size in zip(block_ids, storage_ids, sizes):
+            driver.register_block(vault_id, block_id, storage_id, size)
+
+        # The second file only holds the first block
+        for file_id in file_ids:
+            driver.create_file(vault_id, file_id)
+
+        driver.assign_blocks(vault_id, file_ids[0], block_ids, offsets)
+        driver.assign_block(vault_id, file_ids[1], block_ids[0], 0)
+
+        # Only finalized files have a manifest
+        self.assertIsNone(driver.get_file_manifest(vault_id, file_ids[0]))
+        self.assertIsNone(driver.get_file_manifest(vault_id,
+                                                   self.create_file_id()))
+
+        driver.finalize_file(vault_id, file_ids[0], 1000)
+        driver.finalize_file(vault_id, file_ids[1], 100)
+
+        expected = list(zip(block_ids, offsets, storage_ids, sizes))
+
+        self.assertEqual(driver.get_file_manifest(vault_id, file_ids[0]),
+                         expected)
+
+        # Listing the blocks of a finalized file reads its manifest
+        self.assertEqual(list(driver.create_file_block_generator(
+            vault_id, file_ids[0])), [block[:2] for block in expected])
+
+        self.assertEqual(list(driver.create_file_block_generator(
+            vault_id, file_ids[0], offset=100, limit=2)),
+            [block[:2] for block in expected[1:3]])
+
+        self.assertEqual(list(driver.create_file_block_generator(
+            vault_id, file_ids[0], offset=350, limit=5, with_storage=True)),
+            expected[3:])
+
+        # Marking a block as bad drops the manifests of the
+        # files that reference it
+        driver.mark_block_as_bad(vault_id, block_ids[2])
+
+        self.assertIsNone(driver.get_file_manifest(vault_id, file_ids[0]))
+        self.assertEqual(driver.get_file_manifest(vault_id, file_ids[1]),
+                         expected[:1])
+
+        self.assertEqual(sorted(driver.create_file_block_generator(
+            vault_id, file_ids[0]), key=lambda x: x[1]),
+            [block[:2] for block in expected])
+
+        # The manifest is recorded again once the block is valid,
+        # whether its status is reset or it is stored again
+        driver.reset_block_status(vault_id)
+
+        self.assertEqual(driver.get_file_manifest(vault_id, file_ids[0]),
+                         expected)
+
+        driver.mark_block_as_bad(vault_id, block_ids[2])
+        self.assertIsNone(driver.get_file_manifest(vault_id, file_ids[0]))
+
+        storage_ids[2] = self._genstorageid(block_ids[2])
+        driver.register_block(vault_id, block_ids[2], storage_ids[2],
+                              sizes[2])
+
+        expected = list(zip(block_ids, offsets, storage_ids, sizes))
+
+        self.assertEqual(driver.get_file_manifest(vault_id, file_ids[0]),
+                         expected)
+
+    def test_bad_block_shared_by_files(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_ids = [self.create_file_id() for _ in range(3)]
+
+        block_id = self.create_block_id()
+        storage_id = self._genstorageid(block_id)
+        driver.register_block(vault_id, block_id, storage_id, 100)
+
+        for file_id in file_ids:
+            driver.create_file(vault_id, file_id)
+            driver.assign_block(vault_id, file_id, block_id, 0)
+            driver.finalize_file(vault_id, file_id, 100)
+
+        expected = [(block_id, 0, storage_id, 100)]
+
+        # Marking the block as bad drops the manifests of every
+        # file that references it
+        driver.mark_block_as_bad(vault_id, block_id)
+
+        for file_id in file_ids:
+            self.assertIsNone(driver.get_file_manifest(vault_id, file_id))
+
+        driver.reset_block_status(vault_id)
+
+        for file_id in file_ids:
+            self.assertEqual(driver.get_file_manifest(vault_id, file_id),
+                             expected)
+
+        # Deleting one of the files leaves the others referencing
+        # the block
+        driver.delete_file(vault_id, file_ids[0])
+        driver.mark_block_as_bad(vault_id, block_id)
+
+        for file_id in file_ids[1:]:
+            self.assertIsNone(driver.get_file_manifest(vault_id, file_id))
+
+    def test_verify_file_blocks(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+
+        # Blocks come in any order, unregistered blocks are left out
+        # and anything after the size is carried through
+        blocks = [('b', 100, 200, 'sb'), ('x', 50, None, None),
+                  ('a', 0, 100, 'sa'), ('c', 300, 50, 'sc')]
+
+        self.assertEqual(
+            driver._verify_file_blocks(vault_id, file_id, blocks, 350),
+            [blocks[2], blocks[0], blocks[3]])
+
+        self.assertEqual(
+            driver._verify_file_blocks(vault_id, file_id, blocks),
+            [blocks[2], blocks[0], blocks[3]])
+
+        self.assertEqual(driver._verify_file_blocks(vault_id, file_id, []),
+                         [])
+
+        with self.assertRaises(GapError) as ctx:
+            driver._verify_file_blocks(vault_id, file_id, blocks[1:], 350)
+
+        self.assertEqual(ctx.exception.startpos, 100)
+        self.assertEqual(ctx.exception.endpos, 300)
+
+        with self.assertRaises(OverlapError) as ctx:
+            driver._verify_file_blocks(vault_id, file_id,
+                                       blocks + [('d', 320, 30)], 350)
+
+        self.assertEqual(ctx.exception.block_id, 'd')
+        self.assertEqual(ctx.exception.startpos, 320)
+        self.assertEqual(ctx.exception.endpos, 350)
+
+        with self.assertRaises(OverlapError) as ctx:
+            driver._verify_file_blocks(vault_id, file_id, blocks, 340)
+
+        self.assertEqual(ctx.exception.block_id, 'c')
+        self.assertEqual(ctx.exception.startpos, 340)
+        self.assertEqual(ctx.exception.endpos, 350)
+
+    def test_update_file_coverage(self):
+        driver = self.create_driver()
+
+        def coverage(blocks, summary=EMPTY_FILE_COVERAGE):
+            return driver._update_file_coverage(summary, blocks)
+
+        # Blocks may come in any order
+        summary = coverage([(0, 100), (300, 50), (100, 200)])
+        self.assertTrue(driver._file_is_covered(summary, 350))
+        self.assertTrue(driver._file_is_covered(summary))
+        self.assertFalse(driver._file_is_covered(summary, 400))
+
+        # A gap is covered by a later assignment
+        summary = coverage([(0, 100), (200, 100)])
+        self.assertFalse(driver._file_is_covered(summary, 300))
+        self.assertFalse(driver._file_is_covered(summary))
+
+        summary = coverage([(100, 100)], summary)
+        self.assertTrue(driver._file_is_covered(summary, 300))
+
+        # Overlaps, repeated assignments and unknown sizes make
+        # the coverage unknown
+        self.assertIsNone(coverage([(0, 100), (50, 100)]))
+        self.assertIsNone(coverage([(0, 100), (0, 100)]))
+        self.assertIsNone(coverage([(200, 100), (150, 100)]))
+        self.assertIsNone(coverage([(200, 100), (250, 100)]))
+        self.assertIsNone(coverage([(0, 100), (100, None)]))
+        self.assertIsNone(coverage([(0, 100)], None))
+        self.assertFalse(driver._file_is_covered(None))
+
+        # Blocks assigned in reverse are held as a single range
+        summary = coverage([(offset, 100)
+                            for offset in range(10000, 0, -100)])
+        self.assertEqual(json.loads(summary), {'end': 0,
+                                               'pending': [[100, 10100]]})
+
+        summary = coverage([(0, 100)], summary)
+        self.assertTrue(driver._file_is_covered(summary, 10100))
+
+        # Too many scattered ranges make the coverage unknown
+        with patch.object(metadatadriver, 'MAX_FILE_COVERAGE_RANGES', 2):
+            summary = coverage([(100, 100), (300, 100)])
+            self.assertEqual(len(json.loads(summary)['pending']), 2)
+
+            self.assertIsNone(coverage([(500, 100)], summary))
+            self.assertIsNotNone(coverage([(200, 100), (500, 100)],
+                                          summary))
+
+    def test_finalize_file_coverage_limit(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+        driver.create_file(vault_id, file_id)
+
+        block_ids = [self.create_block_id() for _ in range(6)]
+        offsets = [index * 100 for index in range(6)]
+
+        for block_id in block_ids:
+            driver.register_block(vault_id, block_id,
+                                  self._genstorageid(block_id), 100)
+
+        # Every other block leaves more ranges than the summary holds
+        with patch.object(metadatadriver, 'MAX_FILE_COVERAGE_RANGES', 2):
+            driver.assign_blocks(vault_id, file_id, block_ids[1::2],
+                                 offsets[1::2])
+            driver.assign_blocks(vault_id, file_id, block_ids[::2],
+                                 offsets[::2])
+
+        # The blocks of the file are checked when it is finalized
+        with patch.object(driver, '_create_file_manifest',
+                          wraps=driver._create_file_manifest) as create:
+            driver.finalize_file(vault_id, file_id, 600)
+            self.assertTrue(create.called)
+
+        self.assertTrue(driver.is_finalized(vault_id, file_id))
+
+    def test_finalize_covered_file(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+        driver.create_file(vault_id, file_id)
+
+        block_ids = [self.create_block_id() for _ in range(4)]
+        storage_ids = [self._genstorageid(block_id)
+                       for block_id in block_ids]
+        sizes = [100, 200, 300, 400]
+        offsets = [0, 100, 300, 600]
+
+        for block_id, storage_id, size in zip(block_ids, storage_ids, sizes):
+            driver.register_block(vault_id, block_id, storage_id, size)
+
+        driver.assign_blocks(vault_id, file_id, block_ids[2:], offsets[2:])
+        driver.assign_block(vault_id, file_id, block_ids[0], offsets[0])
+
+        # The file is not covered yet, so its blocks are checked
+        with self.assertRaises(GapError) as ctx:
+            driver.finalize_file(vault_id, file_id, 1000)
+
+        self.assertEqual(ctx.exception.startpos, 100)
+        self.assertEqual(ctx.exception.endpos, 300)
+
+        driver.assign_blocks(vault_id, file_id, block_ids[1:2], offsets[1:2])
+
+        # Once it is, finalizing it does not walk its blocks
+        with patch.object(driver, '_create_file_manifest') as create:
+            driver.finalize_file(vault_id, file_id, 1000)
+            self.assertFalse(create.called)
+
+        self.assertTrue(driver.is_finalized(vault_id, file_id))
+
+        # The manifest is recorded when the file is first read
+        expected = list(zip(block_ids, offsets, storage_ids, sizes))
+
+        self.assertEqual(driver.get_file_manifest(vault_id, file_id),
+                         expected)
+
+        with patch.object(driver, '_create_file_manifest') as create:
+            self.assertEqual(driver.get_file_manifest(vault_id, file_id),
+                             expected)
+            self.assertFalse(create.called)
+
+    def test_block_and_file_lookups(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        block_id = self.create_block_id()
+        old_storage_id = self._genstorageid(block_id)
+        new_storage_id = self._genstorageid(block_id)
+
+        driver.register_block(vault_id, block_id, old_storage_id, 100)
+        self.assertEqual(
+            driver.get_block_metadata_id(vault_id, old_storage_id), block_id)
+
+        driver.mark_block_as_bad(vault_id, block_id)
+        self.assertEqual(driver.vault_health(vault_id), (1, 0))
+
+        # Registering the block again replaces the bad one
+        driver.register_block(vault_id, block_id, new_storage_id, 100)
+        self.assertIsNone(
+            driver.get_block_metadata_id(vault_id, old_storage_id))
+        self.assertEqual(
+            driver.get_block_metadata_id(vault_id, new_storage_id), block_id)
+        self.assertEqual(driver.vault_health(vault_id), (0, 0))
+
+        driver.mark_block_as_bad(vault_id, block_id)
+        driver.reset_block_status(vault_id)
+        self.assertEqual(driver.vault_health(vault_id), (0, 0))
+
+        driver.mark_block_as_bad(vault_id, block_id)
+        driver.unregister_block(vault_id, block_id)
+        self.assertIsNone(
+            driver.get_block_metadata_id(vault_id, new_storage_id))
+        self.assertEqual(driver.vault_health(vault_id), (0, 0))
+
+        file_ids = sorted(self.create_file_id() for _ in range(3))
+
+        for file_id in file_ids:
+            driver.create_file(vault_id, file_id)
+
+        for file_id in file_ids[:2]:
+            driver.finalize_file(vault_id, file_id, 0)
+
+        self.assertEqual(sorted(driver.create_file_generator(vault_id)),
+                         file_ids[:2])
+        self.assertEqual(driver.create_file_generator(vault_id,
+                                                      finalized=False),
+                         file_ids[2:])
+        self.assertEqual(driver.create_file_generator(vault_id,
+                                                      marker=file_ids[1],
+                                                      limit=1,
+                                                      finalized=False),
+                         file_ids[2:])
+
+        driver.delete_file(vault_id, file_ids[0])
+        self.assertEqual(driver.create_file_generator(vault_id),
+                         file_ids[1:2])
+
+        driver.delete_file(vault_id, file_ids[2])
+        self.assertEqual(driver.create_file_generator(vault_id,
+                                                      finalized=False), [])
+
+    def test_has_many_blocks(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        block_ids = [self.create_block_id() for _ in range(1200)]
+
+        # Enough blocks to span several chunks of the lookup, one
+        # of which is marked bad
+        driver.register_blocks(vault_id, [
+            (block_id, self._genstorageid(block_id), 100)
+            for block_id in block_ids[:1100]])
+        driver.mark_block_as_bad(vault_id, block_ids[0])
+
+        # The missing blocks are reported in the order they were
+        # asked for, including the ones asked for more than once
+        query_ids = block_ids + block_ids[-2:] + block_ids[:1]
+
+        self.assertEqual(driver.has_blocks(vault_id, query_ids),
+                         block_ids[1100:] + block_ids[-2:])
+
+        self.assertEqual(driver.has_blocks(vault_id, query_ids,
+                                           check_status=True),
+                         block_ids[:1] + block_ids[1100:] +
+                         block_ids[-2:] + block_ids[:1])
+
+        self.assertEqual(driver.has_blocks(vault_id, []), [])
+
+    def test_register_blocks(self):
+        driver = self.create_driver()
+
+        vault_id = self.create_vault_id()
+        block_ids = [self.create_block_id() for _ in range(5)]
+        size = 4096
+
+        # One block is already registered and one has been marked bad
+        good_id, bad_id = block_ids[:2]
+
+        driver.register_block(vault_id, good_id, 'good-storage-id', size)
+        driver.register_block(vault_id, bad_id, 'bad-storage-id', size)
+        driver.mark_block_as_bad(vault_id, bad_id)
+
+        self.assertEqual(driver.has_blocks(vault_id, block_ids,
+                                           check_status=True),
+                         block_ids[1:])
+
+        # The last block appears twice in the batch
+        blocks = [(block_id, self._genstorageid(block_id), size)
+                  for block_id in block_ids + block_ids[-1:]]
+
+        driver.register_blocks(vault_id, blocks)
+
+        self.assertEqual(driver.has_blocks(vault_id, block_ids,
+                                           check_status=True), [])
+
+        # The valid registration is left alone, the bad one is replaced
+        self.assertEqual(driver.get_block_storage_id(vault_id, good_id),
+                         'good-storage-id')
+
+        for block_id, storage_id, _ in blocks[1:len(block_ids)]:
+            self.assertEqual(driver.get_block_storage_id(vault_id, block_id),
+                             storage_id)
+            self.assertEqual(driver.get_block_data(vault_id,
+                                                   block_id)['blocksize'],
+                             size)
+
+        self.assertEqual(driver.get_vault_statistics(
+            vault_id)['blocks']['count'], len(block_ids))
+
+        # An empty batch is a no-op
+        driver.register_blocks(vault_id, [])
+
     def test_file_assignment_no_block(self):
 
         driver = self.create_driver()
@@ -1157,3 +1799,210 @@ class SqliteStorageDriverTest(V1Base):
 
         for vault_id in vaultids:
             driver.delete_vault(vault_id)
+
+
+class SqliteTransactionTest(V1Base):
+
+    def test_assign_blocks_single_transaction(self):
+        driver = SqliteStorageDriver()
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+        block_ids = [self.create_block_id() for _ in range(5)]
+        offsets = [x * 100 for x in range(5)]
+
+        driver.create_file(vault_id, file_id)
+        driver.register_blocks(vault_id, [
+            (block_id, BlockStorageDriver.storage_id(block_id), 100)
+            for block_id in block_ids])
+
+        with patch.object(driver, '_conn', MagicMock(wraps=driver._conn)):
+            driver.assign_blocks(vault_id, file_id, block_ids, offsets)
+
+            self.assertEqual(driver._conn.commit.call_count, 1)
+            self.assertEqual(driver._conn.executemany.call_count, 2)
+
+        self.assertEqual(
+            list(driver.create_file_block_generator(vault_id, file_id)),
+            list(zip(block_ids, offsets)))
+
+    def test_transaction_rollback(self):
+        driver = SqliteStorageDriver()
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+        block_id = self.create_block_id()
+
+        driver.create_file(vault_id, file_id)
+        driver.register_block(vault_id, block_id,
+                              BlockStorageDriver.storage_id(block_id), 100)
+
+        # A failure part way through an assignment leaves no trace
+        # of the statements that ran before it
+        with patch.object(driver, '_add_file_coverage',
+                          side_effect=RuntimeError('failed')):
+
+            with self.assertRaises(RuntimeError):
+                driver.assign_blocks(vault_id, file_id, [block_id], [0])
+
+        self.assertEqual(
+            list(driver.create_file_block_generator(vault_id, file_id)), [])
+        self.assertEqual(driver.get_block_ref_count(vault_id, block_id), 0)
+
+
+class SqliteSchemaTest(V1Base):
+
+    def query_plan(self, driver, query):
+        args = dict(projectid=deuce.context.project_id,
+                    vaultid=self.create_vault_id(),
+                    blockid=self.create_block_id(),
+                    fileid=self.create_file_id(),
+                    storageid=self.create_storage_block_id(),
+                    offset=0, limit=10)
+
+        return ' '.join(row[-1] for row in driver._conn.execute(
+            'EXPLAIN QUERY PLAN ' + query, args))
+
+    def test_vault_health_indexes(self):
+        driver = SqliteStorageDriver()
+
+        plan = self.query_plan(driver,
+                               sqlitemetadatadriver.SQL_GET_VAULT_HEALTH)
+
+        self.assertIn('INDEX blocks_isinvalid', plan)
+        self.assertIn('COVERING INDEX fileblocks_blockid', plan)
+
+    def test_covering_indexes(self):
+        driver = SqliteStorageDriver()
+
+        self.assertIn('COVERING INDEX blocks_storageid', self.query_plan(
+            driver, sqlitemetadatadriver.SQL_GET_BLOCK_ID))
+        self.assertIn('COVERING INDEX fileblocks_blockid', self.query_plan(
+            driver, sqlitemetadatadriver.SQL_GET_BLOCK_REF_COUNT))
+
+        for query in (sqlitemetadatadriver.SQL_GET_ALL_FILE_BLOCKS,
+                      sqlitemetadatadriver.SQL_GET_FILE_BLOCKS):
+            plan = self.query_plan(driver, query)
+
+            self.assertIn('COVERING INDEX fileblocks_offset', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+        self.assertNotIn('SCAN', self.query_plan(
+            driver, sqlitemetadatadriver.SQL_CREATE_FILEBLOCK_LIST))
+
+    def test_binary_ids(self):
+        driver = SqliteStorageDriver()
+
+        vault_id = self.create_vault_id()
+        block_ids = [self.create_block_id(), 'block_0']
+        file_ids = [self.create_file_id(), 'file_0']
+
+        driver.register_blocks(vault_id, [
+            (block_id, BlockStorageDriver.storage_id(block_id), 100)
+            for block_id in block_ids])
+
+        for file_id in file_ids:
+            driver.create_file(vault_id, file_id)
+            driver.assign_blocks(vault_id, file_id, block_ids, [0, 100])
+
+        def types(query):
+            return list(driver._conn.execute(query))
+
+        self.assertEqual(
+            types('SELECT length(blockid), typeof(blockid) FROM blocks '
+                  'ORDER BY blockid'),
+            [(7, 'text'), (20, 'blob')])
+        self.assertEqual(
+            types('SELECT length(fileid), typeof(fileid) FROM files '
+                  'ORDER BY fileid'),
+            [(6, 'text'), (16, 'blob')])
+
+        # sqlite orders TEXT before BLOBs
+        self.assertEqual(driver.create_block_generator(vault_id),
+                         block_ids[::-1])
+        self.assertEqual(driver.create_file_generator(vault_id,
+                                                      finalized=False),
+                         file_ids[::-1])
+
+        for file_id in file_ids:
+            self.assertEqual(
+                list(driver.create_file_block_generator(vault_id, file_id)),
+                list(zip(block_ids, [0, 100])))
+
+        # Ids that only look like SHA-1 digests and UUIDs are kept as
+        # they are
+        for block_id in (block_ids[0].upper(), block_ids[0][:-1]):
+            self.assertEqual(sqlitemetadatadriver._pack_block_id(block_id),
+                             block_id)
+
+        self.assertEqual(sqlitemetadatadriver._pack_file_id(
+            file_ids[0].upper()), file_ids[0].upper())
+
+    def test_migrate_binary_ids(self):
+        # Start out from a database as it was before binary ids
+        with patch.object(sqlitemetadatadriver, 'CURRENT_DB_VERSION', 5):
+            driver = SqliteStorageDriver()
+
+        self.assertEqual(driver._get_user_version(), 5)
+
+        vault_id = self.create_vault_id()
+        file_id = self.create_file_id()
+        block_ids = [self.create_block_id() for _ in range(5)]
+        storage_ids = [BlockStorageDriver.storage_id(block_id)
+                       for block_id in block_ids]
+
+        args = dict(projectid=deuce.context.project_id, vaultid=vault_id,
+                    fileid=file_id)
+
+        driver._conn.execute('''
+            INSERT INTO files (projectid, vaultid, fileid, finalized)
+            VALUES (:projectid, :vaultid, :fileid, 1)''', args)
+
+        for offset, (block_id, storage_id) in enumerate(zip(block_ids,
+                                                            storage_ids)):
+            args.update(blockid=block_id, storageid=storage_id,
+                        offset=offset * 100)
+
+            driver._conn.execute('''
+                INSERT INTO blocks
+                (projectid, vaultid, blockid, storageid, size, reftime)
+                VALUES (:projectid, :vaultid, :blockid, :storageid, 100, 0)
+            ''', args)
+            driver._conn.execute('''
+                INSERT INTO fileblocks
+                (projectid, vaultid, fileid, blockid, offset)
+                VALUES (:projectid, :vaultid, :fileid, :blockid, :offset)
+            ''', args)
+
+        driver._conn.commit()
+
+        with patch.object(sqlitemetadatadriver, 'SQL_MIGRATE_BATCH_SIZE', 2):
+            driver._do_migrate()
+
+            self.assertEqual(driver._get_user_version(),
+                             sqlitemetadatadriver.CURRENT_DB_VERSION)
+
+            # Migrating ids again leaves them as they are
+            sqlitemetadatadriver._migrate_binary_ids(driver._conn)
+
+        self.assertEqual(list(driver._conn.execute('''
+            SELECT DISTINCT typeof(blockid), typeof(fileid)
+            FROM fileblocks''')), [('blob', 'blob')])
+
+        self.assertEqual(driver.create_block_generator(vault_id),
+                         sorted(block_ids))
+        self.assertEqual(driver.create_file_generator(vault_id), [file_id])
+        self.assertEqual(
+            list(driver.create_file_block_generator(vault_id, file_id)),
+            [(block_id, offset * 100)
+             for offset, block_id in enumerate(block_ids)])
+
+        for block_id, storage_id in zip(block_ids, storage_ids):
+            self.assertEqual(driver.get_block_metadata_id(vault_id,
+                                                          storage_id),
+                             block_id)
+            self.assertEqual(driver.get_block_ref_count(vault_id, block_id),
+                             1)
+
+        self.assertEqual(driver.get_vault_statistics(vault_id)['blocks'],
+                         dict(count=5, bytes=500, bad=0))
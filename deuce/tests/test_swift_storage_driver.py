@@ -9,6 +9,7 @@ from unittest.mock import call
 from deuce.drivers.swift import SwiftStorageDriver
 
 from deuce.tests.test_disk_storage_driver import DiskStorageDriverTest
+from deuce.tests.util import MockFile
 
 # Users need take care of authenticate themselves and
 # have the token ready for each query.
@@ -108,6 +109,11 @@ class SwiftStorageDriverTest(DiskStorageDriverTest):
             self.assertFalse(retVal)
             self.assertEqual(storage_id, '')
 
+            retVal, storage_id = driver.store_block_stream(
+                vault_id, block_id, MockFile(10), 10)
+            self.assertFalse(retVal)
+            self.assertEqual(storage_id, '')
+
         with mock.patch(
             'deuce.tests.db_mocking.swift_mocking.client.put_async_object'
         ) as put_async_object:
@@ -135,15 +141,30 @@ class SwiftStorageDriverTest(DiskStorageDriverTest):
             self.assertFalse(driver.delete_block(vault_id, block_id))
 
         with mock.patch(
-            'deuce.tests.db_mocking.swift_mocking.client.get_object'
-        ) as get_object:
-            get_object.side_effect = ClientException('mock')
+            'deuce.tests.db_mocking.swift_mocking.client.get_object_stream'
+        ) as get_object_stream:
+            get_object_stream.side_effect = ClientException('mock')
 
             self.assertIsNone(driver.get_block_obj(vault_id, block_id))
 
+        with mock.patch(
+            'deuce.tests.db_mocking.swift_mocking.client.get_async_object'
+        ) as get_async_object:
+            get_async_object.side_effect = ClientException('mock')
+
+            self.assertEqual(driver.get_blocks_data(vault_id,
+                                                    [block_id, block_id]),
+                             [None, None])
+
+        with mock.patch(
+            'deuce.tests.db_mocking.swift_mocking.client.head_object_length'
+        ) as head_object_length:
+            head_object_length.side_effect = ClientException('mock')
+
             self.assertEqual(driver.get_block_object_length(vault_id,
                                                             block_id),
                              0)
+
         with mock.patch(
             'deuce.tests.db_mocking.swift_mocking.client._mock_status_code'
         ) as mock_status:
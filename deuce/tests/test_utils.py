@@ -1,7 +1,15 @@
-from hashlib import md5
+import asyncio
+from hashlib import md5, sha1
+from io import BytesIO
+import io
+import mock
 from random import randrange
 from unittest import TestCase
-from deuce.util import FileCat, set_qs, set_qs_on_url
+from deuce.util import DigestStream, FileCat, set_qs, set_qs_on_url
+from deuce.util import LRUCache
+from deuce.util import executors, parse_byte_range, read_range
+from deuce.util import pack_manifest, unpack_manifest
+from deuce.util.event_loop import get_event_loop
 from deuce.tests.util import MockFile
 
 try:  # pragma: no cover
@@ -15,6 +23,26 @@ except ImportError:  # pragma: no cover
 
 class TestFileCat(TestCase):
 
+    def _segments(self, files):
+        # Each segment is opened through a callable, note
+        # which of them have actually been opened
+        self.opened = []
+
+        def opener(index):
+            def open_file():
+                self.opened.append(index)
+                files[index].seek(0)
+                return files[index]
+            return open_file
+
+        offset = 0
+        segments = []
+        for index, f in enumerate(files):
+            segments.append((offset, len(f._content), opener(index)))
+            offset += len(f._content)
+
+        return segments
+
     def test_full_read(self):
         num_files = 9
         min_file_size = 1
@@ -35,12 +63,16 @@ class TestFileCat(TestCase):
 
         # Pass None to FileCat
         fc = FileCat(None)
+        assert fc.read() == b''
 
         # Pass empty list to FileCat
-        fc = FileCat((f for f in range(1, 0)))
+        fc = FileCat([])
+        assert fc.read() == b''
 
-        # FileCat only takes generators
-        fc = FileCat((f for f in files))
+        fc = FileCat(self._segments(files))
+
+        # Nothing is opened until it is read
+        assert self.opened == []
 
         data = fc.read()  # read it all
 
@@ -50,6 +82,7 @@ class TestFileCat(TestCase):
 
         assert len(data) == sum(file_sizes)
         assert computed_md5 == expected_md5
+        assert self.opened == list(range(num_files))
 
     def test_small_read(self):
         num_files = 7
@@ -69,8 +102,7 @@ class TestFileCat(TestCase):
         expected_size = sum(file_sizes)
         expected_md5 = z.hexdigest()
 
-        # FileCat only takes generators
-        fc = FileCat((f for f in files))
+        fc = FileCat(self._segments(files))
 
         z = md5()
         bytes_read = 0
@@ -90,6 +122,96 @@ class TestFileCat(TestCase):
         assert bytes_read == sum(file_sizes)
         assert computed_md5 == expected_md5
 
+    def test_readinto(self):
+        files = [MockFile(size) for size in (100, 0, 50, 200)]
+        content = b''.join(f._content for f in files)
+
+        fc = FileCat(self._segments(files))
+        assert fc.readable()
+
+        buff = bytearray(120)
+        view = memoryview(buff)
+
+        # Reads span the segments, filling the caller's buffer
+        assert fc.readinto(view) == 120
+        assert bytes(buff) == content[:120]
+
+        assert fc.readinto(view[:10]) == 10
+        assert bytes(buff[:10]) == content[120:130]
+
+        assert fc.readinto(view) == 120
+        assert fc.readinto(view) == 350 - 250
+        assert bytes(buff[:100]) == content[250:]
+        assert fc.readinto(view) == 0
+
+        # Objects that can readinto are read into directly
+        fc = FileCat([(0, 4, lambda: BytesIO(b'mock'))])
+        assert fc.readinto(buff) == 4
+        assert bytes(buff[:4]) == b'mock'
+
+    def test_seek(self):
+        files = [MockFile(size) for size in (100, 0, 50, 200)]
+        content = b''.join(f._content for f in files)
+
+        fc = FileCat(self._segments(files))
+        assert fc.seekable()
+
+        # Only the segment holding the position is opened
+        assert fc.seek(120) == 120
+        assert fc.tell() == 120
+        assert fc.read(10) == content[120:130]
+        assert self.opened == [2]
+
+        assert fc.seek(-20, io.SEEK_CUR) == 110
+        assert fc.read(50) == content[110:160]
+        assert self.opened == [2, 2, 3]
+
+        assert fc.seek(-10, io.SEEK_END) == 340
+        assert fc.read() == content[340:]
+
+        # Seeking to the current position keeps the open segment
+        assert fc.seek(0) == 0
+        assert fc.read(1) == content[:1]
+        assert fc.seek(1) == 1
+        assert fc.read() == content[1:]
+
+        # Seeking past the end reads nothing
+        assert fc.seek(1000) == 1000
+        assert fc.read() == b''
+
+        self.assertRaises(ValueError, fc.seek, -1)
+        self.assertRaises(ValueError, fc.seek, 0, 3)
+
+        # Segments that cannot seek are read up to the position
+        stream = mock.Mock(spec=['read', 'close'])
+        stream.read.side_effect = [b'mo', b'ck', b'data', b'']
+        fc = FileCat([(0, 8, lambda: stream)])
+        fc.seek(4)
+        assert fc.read() == b'data'
+
+        stream.read.side_effect = [b'mo', b'', b'']
+        fc = FileCat([(0, 8, lambda: stream)])
+        fc.seek(4)
+        self.assertRaises(IOError, fc.read)
+
+    def test_close(self):
+        files = [MockFile(size) for size in (10, 10)]
+        files[0].close = mock.Mock()
+
+        fc = FileCat(self._segments(files))
+        assert fc.read(5) == files[0]._content[:5]
+
+        fc.close()
+        assert fc.closed
+        assert files[0].close.called
+        self.assertRaises(ValueError, fc.read)
+
+        # A segment shorter than described is an error, the data
+        # before it is still returned first
+        fc = FileCat([(0, 10, lambda: MockFile(5))])
+        assert len(fc.read()) == 5
+        self.assertRaises(IOError, fc.read)
+
     def test_set_qs_on_url(self):
         url = 'http://whatever:8080/hello/world'
 
@@ -116,3 +238,249 @@ class TestFileCat(TestCase):
 
             qs = parts.query
             output = parse.parse_qs(qs)
+
+
+class TestByteRange(TestCase):
+
+    def test_parse_byte_range(self):
+        length = 100
+
+        positive_cases = [
+            ('bytes=0-0', (0, 0)),
+            ('bytes=10-19', (10, 19)),
+            ('bytes=90-', (90, 99)),
+            ('bytes=90-1000', (90, 99)),
+            ('bytes=-10', (90, 99)),
+            ('bytes=-1000', (0, 99)),
+            (' Bytes = 5-6 ', (5, 6)),
+        ]
+
+        for value, expected in positive_cases:
+            self.assertEqual(parse_byte_range(value, length), expected)
+
+        # Missing or malformed ranges are ignored
+        ignored_cases = [None, '', 'bytes', 'bytes=', 'bytes=-',
+                         'bytes=10', 'bytes=a-b', 'bytes=10-5',
+                         'bytes=0-1,5-6', 'items=0-1']
+
+        for value in ignored_cases:
+            self.assertIsNone(parse_byte_range(value, length))
+
+        for value in ('bytes=100-', 'bytes=100-200', 'bytes=-0'):
+            self.assertRaises(ValueError, parse_byte_range, value, length)
+
+        self.assertRaises(ValueError, parse_byte_range, 'bytes=0-', 0)
+
+    def test_read_range(self):
+        f = MockFile(1000)
+        f.close = mock.Mock()
+
+        chunks = list(read_range(f, 100, 349, 100))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [100, 100, 50])
+        self.assertEqual(b''.join(chunks), f._content[100:350])
+        self.assertTrue(f.close.called)
+
+        # A range past the end of the data stops short
+        f = MockFile(100)
+        self.assertEqual(b''.join(read_range(f, 50, 199, 64)),
+                         f._content[50:])
+
+
+class TestLRUCache(TestCase):
+
+    def test_lru_eviction(self):
+        cache = LRUCache(3)
+
+        for key in ('a', 'b', 'c'):
+            cache.put(key, key.upper())
+
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get('a'), 'A')
+
+        # 'b' is now the least recently used
+        cache.put('d', 'D')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get(key) for key in ('a', 'c', 'd')],
+                         ['A', 'C', 'D'])
+
+        self.assertEqual(cache.hits, 4)
+        self.assertEqual(cache.misses, 1)
+
+        # Replacing a value does not grow the cache
+        cache.put('a', 'AA')
+        self.assertEqual(cache.get('a'), 'AA')
+        self.assertEqual(cache.size, 3)
+
+    def test_sized_entries(self):
+        cache = LRUCache(10, sizeof=len)
+
+        cache.put('a', 'x' * 4)
+        cache.put('b', 'x' * 4)
+        cache.put('c', 'x' * 4)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 8)
+
+        # Values larger than the cache are not cached
+        cache.put('d', 'x' * 11)
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.size, 8)
+
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['size'], 8)
+        self.assertEqual(stats['max-size'], 10)
+        self.assertEqual(stats['misses'], 2)
+
+        # A disabled cache holds nothing
+        cache = LRUCache(0)
+        cache.put('a', 'A')
+        self.assertIsNone(cache.get('a'))
+
+    def test_invalidate(self):
+        cache = LRUCache(10)
+
+        for key in [('p', 'v1', 'a'), ('p', 'v1', 'b'), ('p', 'v2', 'a')]:
+            cache.put(key, 'value')
+
+        cache.invalidate(('p', 'v1', 'a'))
+        cache.invalidate(('p', 'v1', 'a'))
+        self.assertIsNone(cache.get(('p', 'v1', 'a')))
+
+        cache.invalidate_if(lambda key, value: key[1] == 'v1')
+        self.assertIsNone(cache.get(('p', 'v1', 'b')))
+        self.assertEqual(cache.get(('p', 'v2', 'a')), 'value')
+        self.assertEqual(cache.size, 1)
+
+        cache.put(('p', 'v2', 'b'), 'other')
+        cache.invalidate_if(lambda key, value: value == 'other')
+        self.assertIsNone(cache.get(('p', 'v2', 'b')))
+        self.assertEqual(cache.size, 1)
+
+    def test_ttl(self):
+        cache = LRUCache(10, ttl=60)
+
+        with mock.patch('deuce.util.lrucache.time.time', return_value=100):
+            cache.put('a', 'A')
+            cache.put('b', 'B')
+
+        with mock.patch('deuce.util.lrucache.time.time', return_value=159):
+            self.assertEqual(cache.get('a'), 'A')
+
+        # Expired entries are dropped once looked up
+        with mock.patch('deuce.util.lrucache.time.time', return_value=160):
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.size, 1)
+            self.assertEqual(len(cache), 1)
+
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+
+class TestManifest(TestCase):
+
+    def test_pack_unpack(self):
+        block_id = sha1(b'block').hexdigest()
+        uuid_id = '1b4e28ba-2fa1-11d2-883f-0016d3cca427'
+
+        blocks = [
+            (block_id, 0, '{0}_{1}'.format(block_id, uuid_id), 100),
+            (block_id, 100, 'storage-id', 1 << 40),
+            ('block_1', (1 << 40) + 100, '{0}_{1}'.format(block_id, uuid_id),
+             0),
+            ('block_2', (1 << 40) + 100, 'block_2_' + uuid_id, 10),
+            (block_id.upper(), (1 << 40) + 110,
+             '{0}_{1}'.format(block_id, uuid_id.upper()), 10),
+            (block_id, (1 << 40) + 120, block_id + '_not-a-uuid', 10),
+        ]
+
+        manifest = pack_manifest(blocks)
+        self.assertIsInstance(manifest, bytes)
+        self.assertEqual(unpack_manifest(manifest), blocks)
+        self.assertEqual(unpack_manifest(bytearray(manifest)), blocks)
+
+        self.assertEqual(unpack_manifest(pack_manifest([])), [])
+
+        # SHA1 block ids and uuid storage ids are stored in 38 bytes
+        # for the ids, plus the flags and the varint offset and size
+        self.assertEqual(len(pack_manifest(blocks[:1])), 2 + 1 + 36 + 2)
+
+    def test_invalid(self):
+        blocks = [('a', 10, 'b', 10), ('c', 0, 'd', 10)]
+        self.assertRaises(ValueError, pack_manifest, blocks)
+        self.assertRaises(ValueError, pack_manifest, [('a', 0, 'b', -1)])
+
+        manifest = pack_manifest(blocks[:1])
+        self.assertRaises(ValueError, unpack_manifest, manifest[:-1])
+        self.assertRaises(ValueError, unpack_manifest, b'')
+        self.assertRaises(ValueError, unpack_manifest,
+                          b'\x02' + manifest[1:])
+
+
+class TestDigestStream(TestCase):
+
+    def test_full_read(self):
+        f = MockFile(randrange(1, 5000))
+
+        ds = DigestStream(f)
+        data = ds.read()
+
+        assert data == f._content
+        assert ds.bytes_read == len(f._content)
+        assert ds.hexdigest() == f.sha1()
+
+    def test_limited_read(self):
+        f = MockFile(1000)
+        limit = 600
+
+        ds = DigestStream(f, limit=limit)
+
+        bytes_read = 0
+        while True:
+            buff = ds.read(99)
+            assert len(buff) <= 99
+
+            if len(buff) == 0:
+                break  # DONE
+
+            bytes_read += len(buff)
+
+        # Nothing past the limit may be read from the stream
+        assert bytes_read == limit
+        assert ds.bytes_read == limit
+        assert ds.read() == b''
+        assert ds.hexdigest() == sha1(f._content[:limit]).hexdigest()
+
+    def test_alternate_digest(self):
+        f = MockFile(100)
+
+        ds = DigestStream(f, digest=md5)
+        ds.read()
+
+        assert ds.hexdigest() == md5(f._content).hexdigest()
+
+
+class TestExecutors(TestCase):
+
+    def test_shared_executor(self):
+        executor = executors.get_executor('test_shared_executor', 2)
+
+        # The same executor is handed out every time
+        self.assertIs(executor,
+                      executors.get_executor('test_shared_executor', 2))
+        self.assertIsNot(executor,
+                         executors.get_executor('test_other_executor', 2))
+
+        self.assertEqual(executor.submit(sum, [1, 2, 3]).result(), 6)
+
+    def test_event_loop_in_thread(self):
+        @get_event_loop
+        def answer():
+            return asyncio.sleep(0, result=42)
+
+        executor = executors.get_executor('test_event_loop_in_thread', 1)
+
+        # Executor threads are given an event loop of their own
+        self.assertEqual(executor.submit(answer).result(), 42)
+        self.assertEqual(executor.submit(answer).result(), 42)
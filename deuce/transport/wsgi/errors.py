@@ -88,3 +88,11 @@ class HTTPMethodNotAllowed(falcon.HTTPMethodNotAllowed):
     def __init__(self, allowed_method, description):
         super(HTTPMethodNotAllowed, self).__init__(allowed_method,
                                                    description=description)
+
+
+class HTTPRangeNotSatisfiable(falcon.HTTPRangeNotSatisfiable):
+
+    """Wraps falcon.HTTPRangeNotSatisfiable"""
+
+    def __init__(self, resource_length):
+        super(HTTPRangeNotSatisfiable, self).__init__(resource_length)
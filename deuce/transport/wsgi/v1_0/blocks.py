@@ -5,9 +5,9 @@ import msgpack
 
 import deuce
 from deuce import conf
-from deuce.util import set_qs_on_url
+from deuce.util import set_qs_on_url, parse_byte_range, read_range
+from deuce.util import FileCat
 from deuce.model import Vault
-from deuce.model import Block
 from deuce.model.exceptions import ConsistencyError
 from deuce.drivers.metadatadriver import ConstraintError
 from deuce.transport.validation import *
@@ -17,6 +17,9 @@ import deuce.util.log as logging
 
 logger = logging.getLogger(__name__)
 
+# Number of bytes read from a request body at a time
+BODY_CHUNK_SIZE = 64 * 1024
+
 
 class ItemResource(object):
     @validate(vault_id=VaultGetRule, block_id=BlockGetRule)
@@ -36,43 +39,22 @@ class ItemResource(object):
             logger.error('Vault [{0}] does not exist'.format(vault_id))
             raise errors.HTTPNotFound
 
-        # This is safe to construct before we check the status of the block
-        # b/c the constructor does not do anything other than save values
-        # to itself, no lookups, etc
-        block = Block(vault_id, block_id)
         try:
-            if not vault.has_block(block_id, check_storage=True):
+            info = vault.get_block_info(block_id, check_storage=True)
+
+            if info is None:
                 logger.error('block [{0}] does not exist'.format(block_id))
                 raise errors.HTTPNotFound
-            ref_cnt = block.get_ref_count()
-            resp.set_header('X-Block-Reference-Count', str(ref_cnt))
-
-            ref_mod = block.get_ref_modified()
-            resp.set_header('X-Ref-Modified', str(ref_mod))
-
-            storage_id = block.get_storage_id()
-            resp.set_header('X-Storage-ID', str(storage_id))
-            resp.set_header('X-Block-ID', str(block_id))
 
-            resp.set_header('X-Block-Size',
-                            str(block.get_block_length()))
+            _set_block_headers(resp, block_id, info)
+            resp.set_header('X-Block-Size', str(info['blocksize']))
 
             resp.status = falcon.HTTP_204
 
         except ConsistencyError as ex:
             # We have the block in metadata...
             # so we can get anything that only touches metadata
-            ref_cnt = block.get_ref_count()
-            resp.set_header('X-Block-Reference-Count', str(ref_cnt))
-
-            ref_mod = block.get_ref_modified()
-            resp.set_header('X-Ref-Modified', str(ref_mod))
-
-            storage_id = block.get_storage_id()
-            resp.set_header('X-Storage-ID', str(storage_id))
-            resp.set_header('X-Block-ID', str(block_id))
-
-            # Block-size is retrieved from storage...
+            _set_block_headers(resp, block_id, vault.get_block_info(block_id))
 
             logger.error(ex)
             raise errors.HTTPGone(str(ex))
@@ -90,7 +72,10 @@ class ItemResource(object):
         assert vault is not None
 
         try:
-            block = vault.get_block(block_id)
+            info = vault.get_block_info(block_id)
+
+            block = vault.get_block(block_id, info['storageid']) \
+                if info is not None else None
 
             if block is None:
                 logger.error('block [{0}] does not exist'
@@ -113,38 +98,40 @@ class ItemResource(object):
 
                 raise errors.HTTPNotFound
 
-            ref_cnt = block.get_ref_count()
-            resp.set_header('X-Block-Reference-Count', str(ref_cnt))
+            _set_block_headers(resp, block_id, info)
+            resp.set_header('Accept-Ranges', 'bytes')
+            resp.content_type = 'application/octet-stream'
 
-            ref_mod = block.get_ref_modified()
-            resp.set_header('X-Ref-Modified', str(ref_mod))
+            block_size = info['blocksize']
 
-            storage_id = block.get_storage_id()
-            resp.set_header('X-Storage-ID', str(storage_id))
-            resp.set_header('X-Block-ID', str(block_id))
+            try:
+                byte_range = parse_byte_range(req.get_header('range'),
+                                              block_size)
+            except ValueError:
+                block.get_obj().close()
+                raise errors.HTTPRangeNotSatisfiable(block_size)
 
-            resp.stream = block.get_obj()
-            resp.stream_len = block.get_block_length()
+            if byte_range is not None:
+                first, last = byte_range
+                obj = block.get_obj()
+                blockobj = FileCat([(0, block_size, lambda: obj)])
 
-            resp.status = falcon.HTTP_200
-            resp.content_type = 'application/octet-stream'
+                chunk_size = deuce.storage_driver.stream_chunk_size
+
+                resp.stream = read_range(blockobj, first, last, chunk_size)
+                resp.stream_len = last - first + 1
+                resp.content_range = (first, last, block_size)
+                resp.status = falcon.HTTP_206
+
+            else:
+                resp.stream = block.get_obj()
+                resp.stream_len = block_size
+                resp.status = falcon.HTTP_200
 
         except ConsistencyError as ex:
             # We have the block in metadata...
             # so we can get anything that only touches metadata
-            block = Block(vault_id, block_id)
-
-            ref_cnt = block.get_ref_count()
-            resp.set_header('X-Block-Reference-Count', str(ref_cnt))
-
-            ref_mod = block.get_ref_modified()
-            resp.set_header('X-Ref-Modified', str(ref_mod))
-
-            storage_id = block.get_storage_id()
-            resp.set_header('X-Storage-ID', str(storage_id))
-            resp.set_header('X-Block-ID', str(block_id))
-
-            # Block-size is retrieved from storage...
+            _set_block_headers(resp, block_id, vault.get_block_info(block_id))
 
             logger.error(ex)
             raise errors.HTTPGone(str(ex))
@@ -158,20 +145,39 @@ class ItemResource(object):
         vault = Vault.get(vault_id)
 
         try:
-            retval, storage_id = vault.put_block(
-                block_id, req.stream.read(), req.content_length)
-            resp.set_header('X-Storage-ID', str(storage_id))
-            resp.set_header('X-Block-ID', str(block_id))
+            # If the client is waiting for a 100 Continue before sending
+            # the block data and the vault already has a valid copy of
+            # the block, then answer right away without reading the body
+            if _expects_continue(req) and vault.has_valid_block(block_id):
+                retval = True
+                storage_id = None
+                deduplicated = True
 
-            block = vault.get_block(block_id)
+            else:
+                retval, storage_id, deduplicated = vault.put_block(
+                    block_id, req.stream, req.content_length)
 
             ref_cnt = 0
             ref_mod = 0
 
             if retval:
-                ref_cnt = block.get_ref_count()
-                ref_mod = block.get_ref_modified()
+                info = vault.get_block_info(block_id)
+
+                if info is None:
+                    # The block was removed, f.e by a concurrent
+                    # delete, after it was stored
+                    logger.error('block [{0}] was removed while it was '
+                                 'uploaded'.format(block_id))
+                    raise errors.HTTPConflict('Block was removed while '
+                                              'it was uploaded')
+
+                storage_id = info['storageid']
+                ref_cnt = info['refcount']
+                ref_mod = info['reftime']
 
+            resp.set_header('X-Storage-ID', str(storage_id))
+            resp.set_header('X-Block-ID', str(block_id))
+            resp.set_header('X-Block-Deduplicated', str(deduplicated))
             resp.set_header('X-Block-Reference-Count', str(ref_cnt))
             resp.set_header('X-Ref-Modified', str(ref_mod))
 
@@ -225,27 +231,22 @@ class CollectionResource(object):
     def on_post(self, req, resp, vault_id):
         vault = Vault.get(vault_id)
         try:
-            unpacked = msgpack.unpackb(req.stream.read())
-
-            if not isinstance(unpacked, dict):
-                raise TypeError
-
-            else:
-                block_ids = list(unpacked.keys())
-                block_datas = list(unpacked.values())
-                try:
-                    retval = vault.put_async_block(
-                        block_ids,
-                        block_datas)
-                    if retval:
-                        resp.status = falcon.HTTP_201
-                    else:
-                        raise errors.HTTPInternalServerError('Block '
-                                                            'Post Failed')
-                    logger.info('blocks [{0}] added'.format(block_ids))
-                except ValueError:
-                    raise errors.HTTPPreconditionFailed('hash error')
-        except (TypeError, ValueError):
+            blocks = _unpack_blocks(req.stream, req.content_length)
+            try:
+                retval, deduplicated_ids = vault.put_async_block_stream(
+                    blocks)
+                if retval:
+                    # Report the blocks the vault already had, and
+                    # were therefore not stored again
+                    resp.body = json.dumps(deduplicated_ids)
+                    resp.status = falcon.HTTP_201
+                else:
+                    raise errors.HTTPInternalServerError('Block '
+                                                        'Post Failed')
+                logger.info('blocks added to vault [{0}]'.format(vault_id))
+            except ValueError:
+                raise errors.HTTPPreconditionFailed('hash error')
+        except TypeError:
             logger.error('Request Body not well formed '
                          'for posting multiple blocks to {0}'.format(vault_id))
             raise errors.HTTPBadRequestBody("Request Body not well formed")
@@ -298,3 +299,62 @@ class CollectionResource(object):
         vault.reset_block_status()
 
         resp.status = falcon.HTTP_204
+
+
+def _set_block_headers(resp, block_id, info):
+    """Sets the headers describing a block from its metadata,
+    see Vault.get_block_info(). If metadata does not know about
+    the block then it has no references"""
+    if info is None:
+        info = dict(refcount=0, reftime=0, storageid=None)
+
+    resp.set_header('X-Block-Reference-Count', str(info['refcount']))
+    resp.set_header('X-Ref-Modified', str(info['reftime']))
+    resp.set_header('X-Storage-ID', str(info['storageid']))
+    resp.set_header('X-Block-ID', str(block_id))
+
+
+def _expects_continue(req):
+    """Returns True if the client sent Expect: 100-continue and
+    is waiting to be told to send the request body"""
+    return req.expect is not None and \
+        req.expect.lower() == '100-continue'
+
+
+def _unpack_blocks(stream, content_length):
+    """Yields the (block_id, blockdata) pairs of a msgpack'd map
+    as they are decoded from the request body, reading at most
+    BODY_CHUNK_SIZE bytes of the body at a time
+
+    :raises TypeError: if the body is not a well formed map
+    """
+    unpacker = msgpack.Unpacker()
+    remaining = content_length
+
+    def unpack(func):
+        nonlocal remaining
+
+        while True:
+            try:
+                return func()
+
+            except msgpack.OutOfData:
+                size = BODY_CHUNK_SIZE if remaining is None \
+                    else min(BODY_CHUNK_SIZE, remaining)
+
+                data = stream.read(size) if size else b''
+                if not data:
+                    raise TypeError('Request Body is truncated')
+
+                if remaining is not None:
+                    remaining -= len(data)
+
+                unpacker.feed(data)
+
+            except (msgpack.UnpackException, ValueError):
+                raise TypeError('Request Body is not a msgpack map')
+
+    for _ in range(unpack(unpacker.read_map_header)):
+        block_id = unpack(unpacker.unpack)
+        blockdata = unpack(unpacker.unpack)
+        yield block_id, blockdata
@@ -2,8 +2,9 @@ import json
 
 from stoplight import validate
 
-from deuce.util import set_qs_on_url
+from deuce.util import set_qs_on_url, parse_byte_range, read_range
 from deuce.model import Vault
+from deuce.model.vault import manifest_cache
 from deuce import conf
 import deuce.util.log as logging
 from deuce.transport.validation import *
@@ -85,41 +86,88 @@ class ItemResource(object):
             logger.error('Vault [{0}] does not exist'.format(vault_id))
             raise errors.HTTPNotFound
 
-        f = vault.get_file(file_id)
+        # The manifest holds the storage id of each block, so no
+        # further metadata lookups are needed
+        manifest = vault.get_file_manifest(file_id)
 
-        if not f:
-            logger.error('File [{0}] does not exist'.format(file_id))
-            raise errors.HTTPNotFound
+        if manifest is None:
+            if not vault.get_file(file_id):
+                logger.error('File [{0}] does not exist'.format(file_id))
+                raise errors.HTTPNotFound
 
-        if not f.finalized:
             raise errors.HTTPConflict('File not Finalized')
 
-        block_gen = deuce.metadata_driver.create_file_block_generator(
-            vault_id, file_id)
+        blocks = manifest.blocks
+        file_length = manifest.length
+
+        resp.set_header('Accept-Ranges', 'bytes')
+        resp.content_type = 'application/octet-stream'
 
-        block_ids = [block[0] for block in sorted(block_gen,
-                                                  key=lambda block: block[1])]
+        try:
+            byte_range = parse_byte_range(req.get_header('range'),
+                                          file_length)
+        except ValueError:
+            raise errors.HTTPRangeNotSatisfiable(file_length)
+
+        if byte_range is not None:
+            # Only the blocks overlapping the range are fetched,
+            # the first of them is found by searching the offsets
+            first, last = byte_range
+
+            try:
+                fileobj = vault.open_file_blocks(blocks)
+            except ValueError as ex:
+                logger.error('[{0}/{1}/{2}] {3}'.format(
+                    deuce.context.project_id, vault_id, file_id, ex))
+                raise errors.HTTPConflict('Block size is unknown')
+
+            def ranged_stream():
+                try:
+                    for chunk in read_range(
+                            fileobj, first, last,
+                            deuce.storage_driver.stream_chunk_size):
+                        yield chunk
+
+                except IOError as ex:
+                    logger.error('[{0}/{1}/{2}] {3}'.format(
+                        deuce.context.project_id, vault_id, file_id, ex))
+
+                    # The manifest points at a block that is gone
+                    manifest_cache.invalidate(vault._manifest_key(file_id))
+
+            resp.stream = ranged_stream()
+            resp.status = falcon.HTTP_206
+            resp.content_range = (first, last, file_length)
+            resp.set_header('Content-Length', str(last - first + 1))
+            return
 
-        objs = vault.get_blocks_generator(block_ids)
+        objs = vault.get_blocks_generator(
+            [block[0] for block in blocks],
+            storage_ids=[block[2] for block in blocks],
+            block_sizes=[block[3] for block in blocks])
 
         # NOTE(TheSriram): falcon 0.2.0 might fix this problem,
         # we should be able to set resp.stream to any file like
         # object instead of an iterator.
 
-        def premature_close(storage_id):
-            msg = '[{0}/{1}/{2}] is missing data' \
-                  'for storage block {3}'.format(deuce.context.project_id,
-                                                 vault_id,
-                                                 file_id,
-                                                 storage_id)
-            logger.error(msg)
-            raise StopIteration(msg)
-
-        resp.stream = (obj.read() if obj else premature_close(storageid)
-                       for (storageid, obj) in objs)
+        def stream():
+            for storage_id, data in objs:
+                if data is None:
+                    logger.error('[{0}/{1}/{2}] is missing data'
+                                 'for storage block {3}'.format(
+                                     deuce.context.project_id, vault_id,
+                                     file_id, storage_id))
+
+                    # The manifest points at a block that is gone,
+                    # the download stops short
+                    manifest_cache.invalidate(vault._manifest_key(file_id))
+                    return
+
+                yield data
+
+        resp.stream = stream()
         resp.status = falcon.HTTP_200
-        resp.set_header('Content-Length', str(vault.get_file_length(file_id)))
-        resp.content_type = 'application/octet-stream'
+        resp.set_header('Content-Length', str(file_length))
 
     @validate(vault_id=VaultPutRule, file_id=FilePostRuleNoneOk)
     def on_post(self, req, resp, vault_id, file_id):
@@ -1,7 +1,16 @@
 import six
 from deuce.util.misc import set_qs
 from deuce.util.misc import set_qs_on_url
+from deuce.util.misc import parse_byte_range
+from deuce.util.misc import read_range
+from deuce.util.manifest import pack_manifest
+from deuce.util.manifest import unpack_manifest
 from deuce.util import client
+from deuce.util import digeststream
+from deuce.util import executors
 from deuce.util import filecat
+from deuce.util import lrucache
 
+DigestStream = digeststream.DigestStream
 FileCat = filecat.FileCat
+LRUCache = lrucache.LRUCache
@@ -44,6 +44,23 @@ def _async_request(method, url, headers, names, contents, etag):
     return total_responses
 
 
+def _noloop_request_getobj(method, url, headers):
+    response = yield from aiohttp.request(method=method, url=url,
+                                          headers=headers)
+
+    block = yield from response.content.read()
+    return (response, block)
+
+
+@get_event_loop
+def _async_request_getobj(method, url, headers, names):
+    tasks = [asyncio.Task(_noloop_request_getobj(method, url + str(name),
+                                                 headers=headers))
+             for name in names]
+    total_responses = yield from asyncio.gather(*tasks)
+    return total_responses
+
+
 @get_event_loop
 def _request(method, url, headers, data=None):
     response = yield from aiohttp.request(method=method, url=url,
@@ -60,6 +77,45 @@ def _request_getobj(method, url, headers, data=None):
     return (response, block)
 
 
+@get_event_loop
+def _read_content(response, size):
+    chunk = yield from response.content.read(size)
+    return chunk
+
+
+class ObjectStream(object):
+    """A read-only file-like object over the body of an object
+    response. The body is read from the connection as it is
+    asked for, so the object is never held in memory as a whole.
+    The connection is released once the body has been read or
+    when the stream is closed"""
+
+    def __init__(self, response, chunk_size):
+        self._response = response
+        self._chunk_size = chunk_size
+        self.closed = False
+
+    def read(self, size=None):
+        if self.closed:
+            return b''
+
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(self._chunk_size), b''))
+
+        chunk = _read_content(self._response, size)
+        if not chunk:
+            self.close()
+        return chunk
+
+    def __iter__(self):
+        return iter(lambda: self.read(self._chunk_size), b'')
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._response.close()
+
+
 @get_event_loop
 def _request_getcontainer(method, url, headers, data=None):
     response = yield from aiohttp.request(method=method, url=url,
@@ -175,6 +231,12 @@ def head_object(url, token, container, name):
         raise ClientException("Block HEAD failed")
 
 
+# Block Length
+def head_object_length(url, token, container, name):
+    headers = head_object(url, token, container, name)
+    return int(headers['Content-Length'])
+
+
 # Delete Block
 def delete_object(url, token, container, name, response_dict):
     headers = {'X-Auth-Token': token}
@@ -206,3 +268,38 @@ def get_object(url, token, container, name, response_dict):
     response_dict['status'] = response.status
 
     return (response, block)
+
+
+def get_object_stream(url, token, container, name, chunk_size):
+    headers = {'X-Auth-Token': token}
+    response = _request(
+        'GET',
+        url +
+        '/' +
+        container +
+        '/' +
+        str(name),
+        headers=headers)
+
+    if response.status >= 200 and response.status < 300:
+        return ObjectStream(response, chunk_size)
+    else:
+        response.close()
+        raise ClientException("Block GET failed")
+
+
+# Get multiple blocks
+def get_async_object(url, token, container, names):
+    headers = {'X-Auth-Token': token}
+
+    responses = _async_request_getobj(
+        'GET',
+        url +
+        '/' +
+        container +
+        '/',
+        headers,
+        names)
+
+    return [block if response.status >= 200 and response.status < 300
+            else None for response, block in responses]
@@ -0,0 +1,46 @@
+import hashlib
+
+import six
+
+
+class DigestStream(object):
+
+    """DigestStream: Wraps a read-only file-like object and
+    keeps a running hash and byte count of everything that
+    is read through it, so data can be verified while it is
+    being streamed somewhere else"""
+
+    def __init__(self, stream, limit=None, digest=hashlib.sha1):
+        """Constructs a new DigestStream object.
+        :param stream: The file-like object to read from
+        :param limit: The maximum number of bytes to read from
+            the stream, f.e the Content-Length of a request
+        :param digest: The hashlib constructor used to hash the data
+        """
+        self._stream = stream
+        self._remaining = limit
+        self._hash = digest()
+        self.bytes_read = 0
+
+    def read(self, count=None):
+
+        if self._remaining is not None:
+            if count is None or count < 0 or count > self._remaining:
+                count = self._remaining
+
+            if count == 0:
+                return six.binary_type()
+
+        buff = self._stream.read() if count is None \
+            else self._stream.read(count)
+
+        self._hash.update(buff)
+        self.bytes_read += len(buff)
+
+        if self._remaining is not None:
+            self._remaining -= len(buff)
+
+        return buff
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
@@ -4,10 +4,18 @@ import functools
 
 def get_event_loop(func):
     """
-    Gets the event loop from asyncio implicitly through a decorator
+    Gets the event loop from asyncio implicitly through a decorator.
+    Threads other than the main thread, which have no event loop
+    of their own, are given one the first time they need it
     """
     @functools.wraps(func)
     def wrap(*args, **kwargs):
-        loop = asyncio.get_event_loop()
+        try:
+            loop = asyncio.get_event_loop()
+
+        except RuntimeError:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+
         return loop.run_until_complete(func(*args, **kwargs))
     return wrap
@@ -0,0 +1,22 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+_lock = threading.Lock()
+_executors = {}
+
+
+def get_executor(name, max_workers):
+    """Returns the process-wide executor registered under name.
+    The executor is shared by every request handled by this
+    process and is created, with max_workers threads, the first
+    time it is asked for
+
+    :param name: The name of the executor, f.e 'hashing'
+    :param max_workers: The number of threads in the executor
+    """
+    with _lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers=max_workers)
+
+        return _executors[name]
@@ -1,54 +1,136 @@
-import six
+import bisect
+import io
 
 
-class FileCat(object):
+class FileCat(io.RawIOBase):
 
     """FileCat: Allows multiple files to be handled
-    as a single file-like-object for read-only
-    operations. Seek is not supported"""
+    as a single read-only, seekable file-like-object.
 
-    def __init__(self, fileobjs):
+    The files are described by segments of the form
+    (offset, length, opener), ordered by offset, where
+    opener is a callable that returns a ready-to-read
+    file-like object for the segment. A segment is only
+    opened once data is read from it, and is closed as
+    soon as it has been read to the end"""
+
+    def __init__(self, segments):
         """Constructs a new FileCat object.
-        :param fileobjs: Any iterable capable of
-            returning file-like objects. The objects
-            must be ready-to-read
+        :param segments: Any iterable of (offset, length, opener)
+            tuples describing contiguous parts of the file
         """
-        self._objs = fileobjs
+        super(FileCat, self).__init__()
         self._current_file = None
-        if self._objs:
-            try:
-                self._current_file = next(self._objs)
-            except StopIteration:
-                self._current_file = None
 
-    def read(self, count=None):
+        self._segments = list(segments) if segments else []
+        self._offsets = [offset for offset, _, _ in self._segments]
+        self._length = sum(length for _, length, _ in self._segments)
+
+        self._pos = 0
+        self._index = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
 
-        res = six.binary_type()
+    def tell(self):
+        return self._pos
 
-        if not self._current_file:
-            return res
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._length
+        elif whence != io.SEEK_SET:
+            raise ValueError('Invalid whence ({0})'.format(whence))
 
-        while count is None or len(res) < count:
+        if pos < 0:
+            raise ValueError('Negative seek position {0}'.format(pos))
 
-            bytes_to_read = count - len(res) if count else None
+        if pos != self._pos:
+            self._close_current()
+            self._pos = pos
+            self._index = max(bisect.bisect_right(self._offsets, pos) - 1, 0)
 
-            buff = self._current_file.read(bytes_to_read)
+        return self._pos
 
-            if len(buff) == 0:  # End of file
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError('I/O operation on closed FileCat')
+
+        view = memoryview(b).cast('B')
+        count = 0
+
+        while count < len(view) and self._index < len(self._segments):
+            offset, length, _ = self._segments[self._index]
+            bytes_to_read = min(len(view) - count, offset + length - self._pos)
+
+            if bytes_to_read <= 0:
+                # End of this segment, move on to the next one
+                self._close_current()
+                self._index += 1
+                continue
+
+            # If a segment cannot be read, the data read before it is
+            # still returned and the error is raised on the next read
+            try:
+                buff = view[count:count + bytes_to_read]
+                bytes_read = self._readinto_current(buff)
 
-                # Close this file. We're going
-                # to move on to the next one
-                self._current_file.close()
+                if bytes_read == 0:
+                    raise IOError('Segment at offset {0} ended after {1} '
+                                  'of its {2} bytes'.format(
+                                      offset, self._pos - offset, length))
 
-                try:
-                    self._current_file = next(self._objs)
-                except StopIteration:
-                    # We are done, just break and
-                    # return whatever we've already
-                    # read (if anything)
-                    self._current_file = None
+            except IOError:
+                if count > 0:
                     break
+                raise
+
+            count += bytes_read
+            self._pos += bytes_read
+
+        return count
+
+    def readall(self):
+        buff = bytearray(max(self._length - self._pos, 0))
+        return bytes(buff[:self.readinto(buff)])
+
+    def close(self):
+        self._close_current()
+        super(FileCat, self).close()
+
+    def _readinto_current(self, buff):
+        if self._current_file is None:
+            self._open_current()
+
+        if hasattr(self._current_file, 'readinto'):
+            return self._current_file.readinto(buff)
+
+        data = self._current_file.read(len(buff))
+        buff[:len(data)] = data
+        return len(data)
+
+    def _open_current(self):
+        offset, _, opener = self._segments[self._index]
+        self._current_file = opener()
+
+        # Position the file where the last seek left off
+        skip = self._pos - offset
+
+        if skip > 0:
+            if hasattr(self._current_file, 'seek'):
+                self._current_file.seek(skip)
             else:
-                res += buff
+                while skip > 0:
+                    skipped = len(self._current_file.read(skip))
+                    if skipped == 0:
+                        break
+                    skip -= skipped
 
-        return res
+    def _close_current(self):
+        if self._current_file is not None:
+            self._current_file.close()
+            self._current_file = None
@@ -0,0 +1,106 @@
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+
+    """LRUCache: A thread-safe, size-bounded cache that evicts
+    the least recently used entries first. The size of each
+    entry is given by the sizeof callable, so the cache can be
+    bounded by something other than its number of entries.
+    Entries may also expire a fixed time after being cached"""
+
+    def __init__(self, max_size, sizeof=None, ttl=None):
+        """Constructs a new LRUCache object.
+        :param max_size: The total size the entries may reach.
+            A max_size of 0 disables the cache
+        :param sizeof: A callable returning the size of a value,
+            every value has a size of 1 if not given
+        :param ttl: The number of seconds an entry is kept for,
+            entries never expire if not given
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._sizeof = sizeof or (lambda value: 1)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the value cached for key, or None"""
+        with self._lock:
+            try:
+                value, size, expires = self._entries.pop(key)
+
+            except KeyError:
+                self.misses += 1
+                return None
+
+            if expires is not None and expires <= time.time():
+                self.size -= size
+                self.misses += 1
+                return None
+
+            # Re-insert the entry as the most recently used
+            self._entries[key] = (value, size, expires)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Caches value under key. Values larger than the cache
+        as a whole are not cached"""
+        size = self._sizeof(value)
+        expires = None if self.ttl is None else time.time() + self.ttl
+
+        with self._lock:
+            self._remove(key)
+
+            if size > self.max_size:
+                return
+
+            while self.size + size > self.max_size:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+            self._entries[key] = (value, size, expires)
+            self.size += size
+
+    def invalidate(self, key):
+        """Removes the value cached under key, if any"""
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_if(self, predicate):
+        """Removes every entry for which predicate(key, value)
+        is true"""
+        with self._lock:
+            for key in [key for key, (value, _, _) in self._entries.items()
+                        if predicate(key, value)]:
+                self._remove(key)
+
+    def stats(self):
+        """Returns the hit and miss counters and the size
+        of the cache"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'size': self.size,
+                'max-size': self.max_size
+            }
+
+    def _remove(self, key):
+        try:
+            _, size, _ = self._entries.pop(key)
+            self.size -= size
+
+        except KeyError:
+            pass
@@ -0,0 +1,153 @@
+import binascii
+import re
+import uuid
+
+# Binary manifest format, version 1:
+#
+#   version (1 byte), count (varint), followed by count entries of
+#   flags (1 byte), block id, offset delta (varint), size (varint),
+#   storage id
+#
+# The offset of each entry is stored as the distance from the offset
+# of the previous entry. A block id that is a lower case SHA1 hex
+# digest is stored as its 20 raw bytes, and a storage id of the form
+# <block id>_<uuid> is stored as the 16 raw bytes of the uuid. Other
+# ids are stored as a varint length followed by their UTF-8 bytes.
+
+MANIFEST_VERSION = 1
+
+_FLAG_SHA1_BLOCK_ID = 0x01
+_FLAG_UUID_STORAGE_ID = 0x02
+
+_SHA1_HEXDIGEST = re.compile(r'^[0-9a-f]{40}\Z')
+
+
+def _pack_varint(value, buff):
+    if value < 0:
+        raise ValueError('Negative value {0} in manifest'.format(value))
+
+    while value > 0x7f:
+        buff.append(0x80 | (value & 0x7f))
+        value >>= 7
+
+    buff.append(value)
+
+
+def _pack_string(value, buff):
+    data = value.encode('utf-8')
+    _pack_varint(len(data), buff)
+    buff.extend(data)
+
+
+def _storage_uuid(block_id, storage_id):
+    """Returns the uuid of a storage id of the form <block id>_<uuid>,
+    or None if the storage id has any other form"""
+    prefix = block_id + '_'
+
+    if not storage_id.startswith(prefix):
+        return None
+
+    try:
+        value = uuid.UUID(storage_id[len(prefix):])
+    except ValueError:
+        return None
+
+    # Only use the compact form if it gives back the exact same id
+    return value if prefix + str(value) == storage_id else None
+
+
+def pack_manifest(blocks):
+    """Packs the blocks of a file into a compact binary manifest
+
+    :param blocks: A list of (block_id, offset, storage_id, size)
+        tuples, ordered by offset
+    :returns: The manifest as bytes
+    """
+    buff = bytearray([MANIFEST_VERSION])
+    _pack_varint(len(blocks), buff)
+
+    last_offset = 0
+
+    for block_id, offset, storage_id, size in blocks:
+        storage_uuid = _storage_uuid(block_id, storage_id)
+
+        flags = 0
+        if _SHA1_HEXDIGEST.match(block_id):
+            flags |= _FLAG_SHA1_BLOCK_ID
+        if storage_uuid is not None:
+            flags |= _FLAG_UUID_STORAGE_ID
+
+        buff.append(flags)
+
+        if flags & _FLAG_SHA1_BLOCK_ID:
+            buff.extend(binascii.unhexlify(block_id))
+        else:
+            _pack_string(block_id, buff)
+
+        _pack_varint(offset - last_offset, buff)
+        _pack_varint(size, buff)
+        last_offset = offset
+
+        if storage_uuid is not None:
+            buff.extend(storage_uuid.bytes)
+        else:
+            _pack_string(storage_id, buff)
+
+    return bytes(buff)
+
+
+def unpack_manifest(data):
+    """Unpacks a manifest created by pack_manifest()
+
+    :returns: The list of (block_id, offset, storage_id, size) tuples
+    :raises ValueError: if the manifest is truncated or of an
+        unknown version
+    """
+    data = bytes(data)
+    pos = 0
+
+    def read(count):
+        nonlocal pos
+        if pos + count > len(data):
+            raise ValueError('Truncated manifest')
+        pos += count
+        return data[pos - count:pos]
+
+    def read_varint():
+        value = shift = 0
+        while True:
+            byte = read(1)[0]
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value
+
+    def read_string():
+        return read(read_varint()).decode('utf-8')
+
+    version = read(1)[0]
+    if version != MANIFEST_VERSION:
+        raise ValueError('Unknown manifest version {0}'.format(version))
+
+    blocks = []
+    offset = 0
+
+    for _ in range(read_varint()):
+        flags = read(1)[0]
+
+        if flags & _FLAG_SHA1_BLOCK_ID:
+            block_id = binascii.hexlify(read(20)).decode('ascii')
+        else:
+            block_id = read_string()
+
+        offset += read_varint()
+        size = read_varint()
+
+        if flags & _FLAG_UUID_STORAGE_ID:
+            storage_id = '{0}_{1}'.format(block_id, uuid.UUID(bytes=read(16)))
+        else:
+            storage_id = read_string()
+
+        blocks.append((block_id, offset, storage_id, size))
+
+    return blocks
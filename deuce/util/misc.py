@@ -23,3 +23,71 @@ def set_qs_on_url(url, args={}):
 def relative_uri(url):
     parts = list(parse.urlparse(url))
     return (parts[2], parts[4])
+
+
+def parse_byte_range(value, length):
+    """Parses the value of a Range header, f.e 'bytes=0-499', for
+    a resource of the given length. Only a single range is
+    supported.
+
+    :returns: The first and last byte positions of the range,
+        inclusive and clipped to the resource, or None if the
+        header is missing or malformed and should be ignored
+    :raises ValueError: if the range cannot be satisfied
+    """
+    if not value:
+        return None
+
+    unit, _, spec = value.strip().partition('=')
+
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+
+    first, sep, last = spec.strip().partition('-')
+
+    if not sep or not (first.isdigit() or first == '') or \
+            not (last.isdigit() or last == '') or first == last == '':
+        return None
+
+    if first == '':
+        # A suffix range, the last N bytes of the resource
+        first = max(length - int(last), 0)
+        last = length - 1
+
+    elif last == '':
+        first = int(first)
+        last = length - 1
+
+    else:
+        first, last = int(first), int(last)
+
+        if last < first:
+            return None
+
+    if first >= length or last < first:
+        raise ValueError('Range {0} cannot be satisfied for {1} '
+                         'bytes'.format(value, length))
+
+    return (first, min(last, length - 1))
+
+
+def read_range(fileobj, first, last, chunk_size):
+    """Returns a generator of chunks of at most chunk_size bytes
+    covering the bytes first to last (inclusive) of a seekable
+    file-like object. The object is closed once the range has
+    been read"""
+    try:
+        fileobj.seek(first)
+        remaining = last - first + 1
+
+        while remaining > 0:
+            chunk = fileobj.read(min(chunk_size, remaining))
+
+            if not chunk:
+                break
+
+            remaining -= len(chunk)
+            yield chunk
+
+    finally:
+        fileobj.close()
@@ -109,6 +109,7 @@ class TestUploadBlocks(base.TestBase):
 
         self.assertHeaders(resp.headers, blockid=self.blockid,
                            lastmodified=True, refcount=0)
+        self.assertEqual(resp.headers['x-block-deduplicated'], 'False')
         self.assertIn('x-storage-id', resp.headers)
         ids = resp.headers['x-storage-id'].split('_')
         self.assertEqual(ids[0], self.blockid,
@@ -125,7 +126,8 @@ class TestUploadBlocks(base.TestBase):
         msgpacked_data = msgpack.packb(data)
         resp = self.client.upload_multiple_blocks(self.vaultname,
                                                   msgpacked_data)
-        self.assert_201_response(resp)
+        self._assert_json_response(resp, 201)
+        self.assertEqual(resp.json(), [])
 
     def tearDown(self):
         super(TestUploadBlocks, self).tearDown()
@@ -226,10 +228,9 @@ class TestBlockUploaded(base.TestBase):
         self.assert_201_response(resp)
 
         self.assertHeaders(resp.headers,
-                           blockid=self.blockid)
-        self.assertIn('X-Storage-Id', resp.headers)
-        self.storageid_added = resp.headers['X-Storage-Id']
-        self.assertNotEqual(self.storageid, resp.headers['X-Storage-Id'])
+                           blockid=self.blockid,
+                           storageid=self.storageid)
+        self.assertEqual(resp.headers['X-Block-Deduplicated'], 'True')
 
         resp = self.client.block_head(self.vaultname, self.blockid)
         self.assert_204_response(resp)
@@ -249,7 +250,8 @@ class TestBlockUploaded(base.TestBase):
         data = {self.blockid: self.block_data}
         msgpack_data = msgpack.packb(data)
         resp = self.client.upload_multiple_blocks(self.vaultname, msgpack_data)
-        self.assert_201_response(resp)
+        self._assert_json_response(resp, 201)
+        self.assertEqual(resp.json(), [self.blockid])
 
         resp = self.client.block_head(self.vaultname, self.blockid)
         self.assert_204_response(resp)
@@ -582,7 +584,8 @@ class TestAssignBlocksFirst(base.TestBase):
         data = dict([(block.Id, block.Data) for block in self.blocks])
         msgpack_data = msgpack.packb(data)
         resp = self.client.upload_multiple_blocks(self.vaultname, msgpack_data)
-        self.assert_201_response(resp)
+        self._assert_json_response(resp, 201)
+        self.assertEqual(resp.json(), [])
 
         for block in self.blocks:
             resp = self.client.block_head(self.vaultname, block.Id)
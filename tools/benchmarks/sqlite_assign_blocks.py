@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Measures the throughput of SqliteStorageDriver.assign_blocks when
+assigning large manifests to files in an on-disk database.
+
+Run from the root of the source tree so the local configuration
+under ini/ is picked up:
+
+    python tools/benchmarks/sqlite_assign_blocks.py --blocks 10000
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..', '..')))
+
+import deuce
+from deuce.drivers.sqlite import SqliteStorageDriver
+
+
+class BenchmarkContext(object):
+    pass
+
+
+def run(blocks, files, block_size):
+    block_ids = [hashlib.sha1(str(i).encode('utf-8')).hexdigest()
+                 for i in range(blocks)]
+    offsets = [i * block_size for i in range(blocks)]
+
+    deuce.context = BenchmarkContext()
+    deuce.context.project_id = 'benchmark'
+
+    db_dir = tempfile.mkdtemp()
+
+    try:
+        deuce.conf.metadata_driver.sqlite.path = os.path.join(db_dir,
+                                                              'deuce.db')
+        driver = SqliteStorageDriver()
+
+        vault_id = 'benchmark_vault'
+        driver.create_vault(vault_id)
+        driver.register_blocks(vault_id, [
+            (block_id, '{0}_{1}'.format(block_id, uuid.uuid4()), block_size)
+            for block_id in block_ids])
+
+        elapsed = []
+
+        for _ in range(files):
+            file_id = str(uuid.uuid4())
+            driver.create_file(vault_id, file_id)
+
+            start = time.perf_counter()
+            driver.assign_blocks(vault_id, file_id, block_ids, offsets)
+            elapsed.append(time.perf_counter() - start)
+
+            driver.finalize_file(vault_id, file_id, blocks * block_size)
+
+    finally:
+        shutil.rmtree(db_dir)
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--blocks', type=int, default=10000,
+                        help='Number of blocks in each manifest')
+    parser.add_argument('--files', type=int, default=3,
+                        help='Number of files to assign the manifest to')
+    parser.add_argument('--block-size', type=int, default=1024 * 1024,
+                        help='Size of each block')
+    args = parser.parse_args()
+
+    elapsed = run(args.blocks, args.files, args.block_size)
+
+    for index, seconds in enumerate(elapsed):
+        print('file {0}: {1} blocks in {2:.3f}s ({3:.0f} blocks/s)'.format(
+            index, args.blocks, seconds, args.blocks / seconds))
+
+    best = min(elapsed)
+    print('best: {0:.0f} blocks/s'.format(args.blocks / best))
+
+
+if __name__ == '__main__':
+    main()
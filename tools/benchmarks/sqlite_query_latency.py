@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+Measures the latency of the block and manifest lookups of
+SqliteStorageDriver against a large on-disk database.
+
+The database holds --rows block assignments, spread over files of
+--blocks-per-file blocks each. Pass --schema-version to build the
+database at an earlier version of the schema, to compare against
+the indexes it lacks.
+
+Run from the root of the source tree so the local configuration
+under ini/ is picked up:
+
+    python tools/benchmarks/sqlite_query_latency.py --rows 10000000
+"""
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..', '..')))
+
+import deuce
+from deuce.drivers.sqlite import SqliteStorageDriver
+from deuce.drivers.sqlite import sqlitemetadatadriver
+
+
+class BenchmarkContext(object):
+    pass
+
+
+def populate(driver, vault_id, rows, blocks_per_file, block_size):
+    """Registers rows blocks and assigns them to files of
+    blocks_per_file blocks. Returns the block ids, storage ids
+    and file ids"""
+    block_ids = []
+    storage_ids = []
+    file_ids = []
+
+    for start in range(0, rows, blocks_per_file):
+        file_block_ids = [
+            hashlib.sha1(str(i).encode('utf-8')).hexdigest()
+            for i in range(start, min(start + blocks_per_file, rows))]
+        file_storage_ids = ['{0}_{1}'.format(block_id, uuid.uuid4())
+                            for block_id in file_block_ids]
+
+        driver.register_blocks(vault_id, [
+            (block_id, storage_id, block_size) for block_id, storage_id in
+            zip(file_block_ids, file_storage_ids)])
+
+        file_id = str(uuid.uuid4())
+        driver.create_file(vault_id, file_id)
+        driver.assign_blocks(vault_id, file_id, file_block_ids,
+                             [i * block_size
+                              for i in range(len(file_block_ids))])
+
+        block_ids.extend(file_block_ids)
+        storage_ids.extend(file_storage_ids)
+        file_ids.append(file_id)
+
+    return block_ids, storage_ids, file_ids
+
+
+def measure(samples, func, args):
+    """Runs func over samples randomly picked args and returns
+    the latencies in milliseconds, sorted"""
+    elapsed = []
+
+    for arg in random.sample(args, min(samples, len(args))):
+        start = time.perf_counter()
+        func(arg)
+        elapsed.append((time.perf_counter() - start) * 1000)
+
+    return sorted(elapsed)
+
+
+def run(rows, blocks_per_file, block_size, samples, schema_version):
+    deuce.context = BenchmarkContext()
+    deuce.context.project_id = 'benchmark'
+
+    db_dir = tempfile.mkdtemp()
+    db_path = os.path.join(db_dir, 'deuce.db')
+
+    try:
+        deuce.conf.metadata_driver.sqlite.path = db_path
+        sqlitemetadatadriver.CURRENT_DB_VERSION = schema_version
+        driver = SqliteStorageDriver()
+
+        vault_id = 'benchmark_vault'
+        driver.create_vault(vault_id)
+
+        start = time.perf_counter()
+        block_ids, storage_ids, file_ids = populate(
+            driver, vault_id, rows, blocks_per_file, block_size)
+        print('populated {0} rows in {1:.0f}s, {2:.0f} MB on disk'.format(
+            rows, time.perf_counter() - start,
+            os.path.getsize(db_path) / 1024 / 1024))
+
+        for block_id in random.sample(block_ids, 10):
+            driver.mark_block_as_bad(vault_id, block_id)
+
+        offsets = range(0, blocks_per_file * block_size, block_size)
+
+        queries = [
+            ('get_block_ref_count', block_ids,
+             lambda block_id: driver.get_block_ref_count(vault_id,
+                                                         block_id)),
+            ('get_block_metadata_id', storage_ids,
+             lambda storage_id: driver.get_block_metadata_id(vault_id,
+                                                             storage_id)),
+            ('create_file_block_generator', file_ids,
+             lambda file_id: driver.create_file_block_generator(
+                 vault_id, file_id, random.choice(offsets), 100)),
+            ('vault_health', [vault_id] * samples,
+             lambda vault_id: driver.vault_health(vault_id))
+        ]
+
+        results = []
+
+        for name, args, func in queries:
+            elapsed = measure(samples, func, args)
+            results.append((name, elapsed[len(elapsed) // 2],
+                            elapsed[len(elapsed) * 99 // 100]))
+
+    finally:
+        shutil.rmtree(db_dir)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rows', type=int, default=10000000,
+                        help='Number of block assignments in the database')
+    parser.add_argument('--blocks-per-file', type=int, default=10000,
+                        help='Number of blocks in each file')
+    parser.add_argument('--block-size', type=int, default=1024 * 1024,
+                        help='Size of each block')
+    parser.add_argument('--samples', type=int, default=1000,
+                        help='Number of times each query is run')
+    parser.add_argument('--schema-version', type=int,
+                        default=sqlitemetadatadriver.CURRENT_DB_VERSION,
+                        help='Version of the schema to build the '
+                             'database at')
+    args = parser.parse_args()
+
+    results = run(args.rows, args.blocks_per_file, args.block_size,
+                  args.samples, args.schema_version)
+
+    for name, median, p99 in results:
+        print('{0}: median {1:.3f}ms, p99 {2:.3f}ms'.format(name, median,
+                                                           p99))
+
+
+if __name__ == '__main__':
+    main()